@@ -1,109 +1,383 @@
 import streamlit as st
-from firebase_admin import credentials, firestore, initialize_app, _apps
-import json
+from google.api_core import exceptions as google_exceptions
+import logging
 import os
 # import dotenv
-from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
+from datetime import datetime, timedelta, timezone
 import time
-from utils import light_tagger, tag, reverse_tag
+from utils import display_colored_sentence, light_tagger, tag, reverse_tag
 import random
+import re
+import contextvars
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import metrics
+from review_stats import analytics_summary, render_status_chart, stats_frame
+from pending_index import PendingIndex
+from review_queue import PrefetchQueue
+from storage import LeaseLostError, lease_is_free, open_store
 
 
 # dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 openai_api_key = os.environ['openai_key']
+# Reviewers who can open the backend metrics panel, comma separated
+admin_users = {name.strip().lower() for name in os.environ.get('admin_users', '').split(',') if name.strip()}
 emotions = ["Happy", "Sad", "Angry", "Neutral", "Surprised", "Fearful", "Disgusted"]
 
 
-# Initialize Firebase if it hasn't been initialized yet
-firebase_secrets = json.loads(os.environ['firebase_credentials'])
-if not _apps:
-    cred = credentials.Certificate(firebase_secrets)
-    initialize_app(cred)
-
-db = firestore.client()
-
-# Function to load the next review item from a batch of 20 random documents
-def load_next_text():
-    # Fetch a batch of 20 documents where Status is "pending"
-    docs = db.collection("stage_four_reviews").where("Status", "==", "pending").limit(20).stream()
-
-    # Convert Firestore documents to a list
-    doc_list = [doc for doc in docs]
+# Function to open the review store once per process and share it across sessions and reruns
+@st.cache_resource
+def get_review_store():
+    # Firestore unless REVIEW_STORE points at a local SQLite or in-memory store
+    return open_store()
+
+store = get_review_store()
+
+# How long a reviewer holds a claimed item before it goes back to the pool
+LEASE_SECONDS = 15 * 60
+# Number of pending items looked at per claim; several reviewers can claim from one batch without colliding
+CLAIM_CANDIDATES = 50
+# Fields needed to pick candidates; listing queries return nothing else
+CANDIDATE_FIELDS = ["Status", "claimed_by", "lease_expires"]
+# The prefetch queue refills in the background once it holds fewer candidates than this
+PREFETCH_LOW_WATER = 5
+# Pending items followed by the shared index; the listener backfills as items are reviewed
+PENDING_INDEX_LIMIT = 5000
+# Items shown per page in bulk review mode; a page holds its leases until submitted, so it is kept well below CLAIM_CANDIDATES
+BULK_PAGE_SIZE = 10
+BULK_MAX_PAGE_SIZE = 20
+
+# Function to start the process-wide index of pending items, shared by every session
+@st.cache_resource
+def get_pending_index():
+    index = PendingIndex()
+    index.start(store, limit=PENDING_INDEX_LIMIT)
+    return index
+
+# Function to fetch a batch of pending documents the reviewer could claim
+def fetch_claim_candidates(username, domain=None):
+    """
+    Candidates come from the shared pending index once its first snapshot has
+    arrived, and from a direct query before that or if the index has none
+    left. Items whose lease has run out are treated as unclaimed again.
+    Candidates come back in random order (the reviewer's own unexpired lease
+    first), so concurrent sessions spread out instead of fighting over the
+    same document.
 
-    # If there are any documents available
-    if doc_list:
-        # Randomly pick one document
-        random_doc = random.choice(doc_list)
-        doc_id = random_doc.id
-        doc_data = random_doc.to_dict()
+    Parameters:
+        username (str): The reviewer.
+        domain (str): Only return items of this domain, or None for all.
 
-        return doc_id, doc_data
-    else:
-        return None, None
+    Returns:
+        list: (doc_id, document data) pairs.
+    """
+    now = datetime.now(timezone.utc)
+    index = get_pending_index()
+    candidates = index.candidates(username, CLAIM_CANDIDATES, domain) if index.ready else []
+    if not candidates:
+        # Only the lease fields are read here; the full document comes with the claim.
+        # Items leased to others are paged past, so other sessions' bulk pages can't use up the window
+        candidates = store.pending_candidates(CLAIM_CANDIDATES, fields=CANDIDATE_FIELDS, domain=domain, username=username)
+    candidates = [(doc_id, data) for doc_id, data in candidates if lease_is_free(data, username, now)]
+    random.shuffle(candidates)
+    candidates.sort(key=lambda candidate: candidate[1].get("claimed_by") != username)
+    return candidates
+
+# Function to lease one item to the reviewer, returning None if someone else got it first
+def claim_candidate(doc_id, username):
+    return store.claim(doc_id, username, LEASE_SECONDS)
+
+# Function to claim the next review item from the session's prefetch queue
+def load_next_text(username, domain=None):
+    # Switching domains starts a fresh queue
+    if st.session_state.review_queue is None or st.session_state.review_queue_domain != domain:
+        st.session_state.review_queue = PrefetchQueue(
+            fetch=lambda: fetch_claim_candidates(username, domain),
+            claim=lambda doc_id: claim_candidate(doc_id, username),
+            low_water=PREFETCH_LOW_WATER
+        )
+        st.session_state.review_queue_domain = domain
+    return st.session_state.review_queue.next_item()
 
 # Function to save the review decision
 def save_review(doc_id, review_data):
     review_data["Timestamp"] = datetime.utcnow()  # Add a timestamp to the review
-    db.collection("stage_four_reviews").document(doc_id).update(review_data)
+    review_data.update({"claimed_by": None, "lease_expires": None})  # Release the lease
+    store.write_review(doc_id, review_data, lease_holder=review_data["reviewer"])
+    bump_review_count(review_data["reviewer"], 1)
+
+# Function to save a page of review decisions in one batched write
+def save_reviews(reviews, reviewer):
+    """
+    Saves the reviews of a bulk page together. Every review gets its own
+    Timestamp, a microsecond apart in page order, so each one shows up and
+    can be undone on its own in the History page.
+
+    Parameters:
+        reviews (list): (doc_id, review_data) pairs.
+        reviewer (str): The reviewer holding the leases.
+
+    Returns:
+        list: IDs of the reviews not saved because their lease was lost.
+    """
+    timestamp = datetime.utcnow()
+    batch = [
+        (doc_id, {**review_data, "Timestamp": timestamp + timedelta(microseconds=i),
+                  "claimed_by": None, "lease_expires": None})
+        for i, (doc_id, review_data) in enumerate(reviews)
+    ]
+    lost = store.write_reviews(batch, lease_holder=reviewer)
+    bump_review_count(reviewer, len(batch) - len(lost))
+    return lost
+
+# How long the sidebar review counter is trusted before it is re-synced with the store
+REVIEW_COUNT_TTL = 300  # seconds
 
 # Function to get the count of reviews done by the reviewer
 def get_review_count(username):
-    docs = db.collection("stage_four_reviews").where("reviewer", "==", username).stream()
-    return sum(1 for _ in docs)
+    # The count is cached per session and kept current by save_review/undo_review,
+    # so the store is only asked again once the TTL runs out
+    cache = st.session_state.get("review_count")
+    if cache is None or cache["username"] != username or time.time() - cache["synced_at"] > REVIEW_COUNT_TTL:
+        cache = {"username": username, "count": store.count_reviews(username), "synced_at": time.time()}
+        st.session_state.review_count = cache
+    return cache["count"]
+
+# Function to adjust the cached review count after a local write
+def bump_review_count(username, delta):
+    cache = st.session_state.get("review_count")
+    if cache is not None and cache["username"] == username:
+        cache["count"] += delta
+
+# Fields shown on the History page; lease and upload bookkeeping is left out of the reads
+HISTORY_FIELDS = ["OriginalText", "CodeSwitchedText", "reviewed_text", "Status", "Timestamp", "language_tags", "emotions"]
+
+# Function to get one page of the history of prompts reviewed by the user
+def get_review_history(username, limit, start_after=None):
+    """
+    Reads one page of the reviewer's history, newest first. Filtering, ordering
+    and the limit all happen in the store, so a page costs `limit` reads however
+    long the history is. Documents without a Timestamp are left out by the ordering.
+
+    Parameters:
+        username (str): The reviewer.
+        limit (int): Page size.
+        start_after: Cursor returned for the previous page, or None for the first page.
 
-# Function to get the history of prompts reviewed by the user
-def get_review_history(username, limit):
-    docs = db.collection("stage_four_reviews").where("reviewer", "==", username).stream()
+    Returns:
+        tuple: (history records, cursor for the next page or None).
+    """
+    docs, cursor = store.review_history(username, limit, start_after, fields=HISTORY_FIELDS)
     history = []
-    for doc in docs:
-        data = doc.to_dict()
-        if not data.get("pulled", False) and data.get("Timestamp") is not None:  # Filter out documents where "pulled" is True or Timestamp is None
-            history.append({
-                "doc_id": doc.id,
-                "OriginalText": data.get("OriginalText"),
-                "CodeSwitchedText": data.get("CodeSwitchedText"),
-                "reviewed_text": data.get("reviewed_text"),
-                "Status": data.get("Status"),
-                "Timestamp": data.get("Timestamp"),
-                "language_tags":data.get("language_tags"),
-                "emotions": data.get("emotions")
-            })
-    # Sort history by Timestamp in descending order and limit results
-    sorted_history = sorted(history, key=lambda x: x["Timestamp"], reverse=True)
-    return sorted_history[:limit]
+    for doc_id, data in docs:
+        history.append({
+            "doc_id": doc_id,
+            "OriginalText": data.get("OriginalText"),
+            "CodeSwitchedText": data.get("CodeSwitchedText"),
+            "reviewed_text": data.get("reviewed_text"),
+            "Status": data.get("Status"),
+            "Timestamp": data.get("Timestamp"),
+            "language_tags":data.get("language_tags"),
+            "emotions": data.get("emotions")
+        })
+    return history, cursor
 
 # Function to update a specific review
 def update_review(doc_id, edited_text):
-    db.collection("stage_four_reviews").document(doc_id).update({
+    store.write_review(doc_id, {
         "reviewed_text": edited_text,
         "Timestamp": datetime.utcnow(),
         "Status": "edit"
     })
 
 def undo_review(doc_id):
-    db.collection("stage_four_reviews").document(doc_id).update({
+    store.write_review(doc_id, {
         "Timestamp": datetime.utcnow(),
         "Status": "pending",
-        "reviewer": None
+        "reviewer": None,
+        "claimed_by": None,
+        "lease_expires": None
     })
+    bump_review_count(st.session_state.username, -1)
+
+# How long all sessions share one read of the counter shards
+STATS_CACHE_TTL = 30  # seconds
+# Upper bound on how long a rendered Analytics page is reused, even if the data version is unchanged
+ANALYTICS_CACHE_TTL = 60 * 60  # seconds
 
-# Function to fetch review data for analytics
+# Function to fetch review data for analytics from the materialized counters
+@st.cache_data(ttl=STATS_CACHE_TTL, show_spinner=False)
 def fetch_review_data():
-    docs = db.collection("stage_four_reviews").stream()
-    data = []
-    for doc in docs:
-        record = doc.to_dict()
-        if not record["pulled"]:
-            data.append({
-                "reviewer": record.get("reviewer", "unreviewed"),
-                "Status": record["Status"]
-            })
-    data = pd.DataFrame(data)
-    data["reviewer"] = data["reviewer"].str.strip()
-    return data
+    return store.load_stats()
+
+# Function to compute the Analytics tables and chart once per data version, shared across sessions
+@st.cache_data(ttl=ANALYTICS_CACHE_TTL, max_entries=4, show_spinner=False)
+def build_analytics(generation, _counts):
+    # Only the generation is part of the cache key; the counts belong to it
+    status_count, reviewer_counts, unreviewed = analytics_summary(stats_frame(_counts))
+    chart = render_status_chart(status_count) if not status_count.empty else None
+    return status_count, reviewer_counts, unreviewed, chart
+
+# Firestore rejects write batches with more than 500 operations; one is kept for the stats shard
+UPLOAD_BATCH_SIZE = 499
+UPLOAD_BATCHES_IN_FLIGHT = 4
+# The nick name and SET number become the job ID, the processed file's name and the document IDs
+UPLOAD_ID_PART = re.compile(r"[A-Za-z0-9_-]+")
+
+# Errors worth retrying a chunk for before falling back to row-by-row writes
+TRANSIENT_UPLOAD_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+)
+UPLOAD_RETRIES = 5
+UPLOAD_BACKOFF = 1  # seconds, doubled after every retry
+
+# Function to commit one chunk of prompts as a single atomic write
+def commit_upload_chunk(chunk):
+    """
+    Creates a chunk of (doc_id, data) pairs in one transaction, retrying
+    transient errors with exponential backoff. Existing documents are left
+    alone, so re-uploading a set never resets prompts that reviewers have
+    already worked on. If it is still rejected, the
+    rows are retried one at a time so a single bad row does not take the rest
+    of the chunk down with it.
+
+    Returns:
+        tuple: (list of (doc_id, error message) pairs for the rows that failed,
+            number of rows skipped because they already exist).
+    """
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            return [], store.create_prompts(chunk)
+        except TRANSIENT_UPLOAD_ERRORS:
+            # No wait after the last attempt; the row-by-row fallback starts right away
+            if attempt < UPLOAD_RETRIES - 1:
+                time.sleep(UPLOAD_BACKOFF * 2 ** attempt)
+        except Exception:
+            break
+
+    failures = []
+    skipped = 0
+    for row in chunk:
+        try:
+            skipped += store.create_prompts([row])
+        except Exception as e:
+            failures.append((row[0], str(e)))
+    return failures, skipped
+
+# Function to read the saved state of an upload job
+def load_upload_job(job_id):
+    return store.get_upload_job(job_id)
+
+# Function to upload the processed prompts to Firestore in concurrent batches
+def upload_prompts(chunks, total_rows, progress_bar, job_id, job_fields, start_chunk=0):
+    """
+    Uploads the processed prompts chunk by chunk, keeping up to
+    UPLOAD_BATCHES_IN_FLIGHT chunks committing at once. Chunks are pulled from
+    the iterator only as earlier ones finish, so memory stays bounded.
+
+    Progress is checkpointed in `upload_jobs/{job_id}` as `committed_chunks`:
+    the number of leading chunks that are fully written. An interrupted upload
+    can be resumed by passing that back as `start_chunk`. A chunk with failed
+    rows holds the checkpoint back, so resuming retries those rows.
+
+    Parameters:
+        chunks (iterable): Lists of (doc_id, data) pairs of at most UPLOAD_BATCH_SIZE
+            rows, starting at chunk `start_chunk`.
+        total_rows (int): Number of rows in the whole file, for the progress bar.
+        progress_bar: Streamlit progress bar, advanced once per committed chunk.
+        job_id (str): The upload job.
+        job_fields (dict): Stored with the job (e.g. the file fingerprint).
+        start_chunk (int): Index of the first chunk in `chunks`.
+
+    Returns:
+        tuple: (list of (doc_id, error message) pairs for the rows that could not
+            be written, number of rows skipped because they already exist).
+    """
+    store.update_upload_job(job_id, {**job_fields, "status": "running", "total_rows": total_rows,
+                                     "committed_chunks": start_chunk, "updated_at": datetime.utcnow()})
+
+    failures = []
+    skipped = 0
+    done_rows = start_chunk * UPLOAD_BATCH_SIZE
+    finished = set()
+    failed_chunks = set()
+    checkpoint = start_chunk
+    in_flight = {}
+
+    def collect(futures):
+        nonlocal skipped, done_rows, checkpoint
+        for future in futures:
+            index, size = in_flight.pop(future)
+            chunk_failures, chunk_skipped = future.result()
+            failures.extend(chunk_failures)
+            skipped += chunk_skipped
+            done_rows += size
+            if chunk_failures:
+                failed_chunks.add(index)
+            finished.add(index)
+        # Chunks finish out of order; only the contiguous prefix of clean chunks counts as committed
+        previous = checkpoint
+        while checkpoint in finished and checkpoint not in failed_chunks:
+            finished.remove(checkpoint)
+            checkpoint += 1
+        if checkpoint != previous:
+            store.update_upload_job(job_id, {"committed_chunks": checkpoint, "updated_at": datetime.utcnow()})
+        # The progress bar is only touched from the script thread
+        progress_bar.progress(min(int((done_rows / total_rows) * 100), 100))
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_BATCHES_IN_FLIGHT) as executor:
+        for index, chunk in enumerate(chunks, start=start_chunk):
+            if len(in_flight) == UPLOAD_BATCHES_IN_FLIGHT:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            # Run in a copy of the script's context so the writes are counted against this rerun
+            in_flight[executor.submit(contextvars.copy_context().run, commit_upload_chunk, chunk)] = (index, len(chunk))
+
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+
+    store.update_upload_job(job_id, {"status": "incomplete" if failures else "done", "failed_rows": len(failures),
+                                     "updated_at": datetime.utcnow()})
+    progress_bar.progress(100)
+    return failures, skipped
+
+# Function to load the near-duplicate index once per process; it reloads itself after `python dedup.py build/compact`
+@st.cache_resource
+def load_dedup_index():
+    from dedup import DedupIndex
+
+    # A ValueError (index built with other parameters) is not cached, so a rebuilt index is picked up
+    return DedupIndex.load()
+
+# Function to get the near-duplicate index, or None until `python dedup.py build` has created it
+def get_dedup_index():
+    from dedup import DEDUP_INDEX_DIR
+
+    # Checked on every call rather than cached, so an index built while the app runs is found
+    if not os.path.exists(os.path.join(DEDUP_INDEX_DIR, "meta.json")):
+        return None
+    return load_dedup_index()
+
+# Function to add the prompts of a finished upload to the near-duplicate index
+def index_uploaded_prompts(processed_file_path, failures):
+    try:
+        index = get_dedup_index()
+    except ValueError:
+        # Already reported with the preview
+        return
+    if index is None:
+        return
+    from ingest import iter_processed_chunks
+
+    failed = {doc_id for doc_id, _ in failures}
+    for chunk in iter_processed_chunks(processed_file_path, UPLOAD_BATCH_SIZE):
+        index.add((doc_id, data["CodeSwitchedText"]) for doc_id, data in chunk if doc_id not in failed)
 
 def play_audio(file_path):
     """
@@ -120,21 +394,30 @@ def play_audio(file_path):
         st.error(f"An unexpected error occurred: {e}")
 
 
-# Function to display the sentence with color-coding based on language tag
-def display_colored_sentence(word_tags):
-    colored_sentence = ""
-    
-    # Loop through the word-tags and create a color-coded sentence
-    for word, tag in word_tags:
-        if tag == 'en':
-            color = 'blue'  # English - Blue
-        else:
-            color = 'red'   # Yoruba - Red
-        
-        # Add the word to the sentence with the appropriate color
-        colored_sentence += f'<span style="color: {color};">{word}</span> '
-
-    return(colored_sentence)
+# Function to show admins what the backend calls of the last run and of the process cost
+def metrics_panel(last_rerun):
+    with st.sidebar.expander("Backend metrics", expanded=True):
+        if last_rerun is not None:
+            st.write(f"Last run ({last_rerun.page}):")
+            rows = last_rerun.totals()
+            if rows:
+                st.table([{
+                    "call": f"{row['backend']}.{row['operation']}", "calls": row["calls"],
+                    "reads": row["reads"], "writes": row["writes"],
+                    "KB": round(row["bytes"] / 1024, 1), "ms": round(row["seconds"] * 1000, 1)
+                } for row in rows])
+            else:
+                st.write("No backend calls.")
+
+        st.write("This process, per page:")
+        snapshot = metrics.registry.snapshot()
+        if snapshot:
+            st.table([{
+                "page": row["page"], "call": f"{row['backend']}.{row['operation']}", "calls": row["calls"],
+                "reads": row["reads"], "writes": row["writes"], "ms/call": round(row["seconds"] / row["calls"] * 1000, 1)
+            } for row in snapshot])
+        st.download_button("Prometheus text", metrics.registry.prometheus_text(), file_name="metrics.prom")
+        st.download_button("JSON", json.dumps(snapshot, indent=2), file_name="metrics.json")
 
 # Function to dynamically display buttons below the sentence
 def display_buttons(word_tags, num_cols):
@@ -156,11 +439,17 @@ def display_buttons(word_tags, num_cols):
         # Create the button in the corresponding column
         col = cols[i % num_cols]  # Cycle through columns for each word
         with col:
-            button = st.button(button_text, key=button_key)
-
-            # When the button is clicked, toggle the word's tag
-            if button:
-                toggle_tag(i)  # This function will toggle between 'en' and 'yo'
+            # When the button is clicked, toggle the word's tag between 'en' and 'yo'.
+            # The callback runs before the editor re-renders, so no extra rerun is needed
+            st.button(button_text, key=button_key, on_click=toggle_tag, args=(i,))
+
+# Function to render the sentence preview and word buttons as a fragment, so a toggle
+# re-runs only this part of the page instead of the whole script. Tags stay in
+# session state until the review is submitted
+@st.fragment
+def tag_editor(num_cols):
+    st.markdown(f"<h3>{display_colored_sentence(st.session_state.word_tags)}</h3>", unsafe_allow_html=True)
+    display_buttons(st.session_state.word_tags, num_cols)
 
 # Function to toggle language tag when a word is clicked
 def toggle_tag(word_index):
@@ -172,14 +461,99 @@ def toggle_tag(word_index):
     
     # Update the word tag in session state
     st.session_state.word_tags[word_index] = (current_word, new_tag)
-    st.rerun()
     # st.write(f"Tag for '{current_word}' changed to {new_tag}")  # Optional: Show immediate feedback
 
 # Function to update the reflected text when the text area changes
 def update_reflection():
     st.session_state.text_data["CodeSwitchedText"] = st.session_state.edited_text
+    st.session_state.text_data["language_tags"] = None  # The stored tags belong to the old text
     st.session_state.word_tags = None
 
+# Function to claim and render a page of items with per-row controls, submitted as one batched write
+def bulk_review(username, domain, page_size):
+    items = st.session_state.bulk_items
+    # The item claimed in single mode is reviewed on this page rather than left to expire
+    if st.session_state.text_data is not None:
+        items.insert(0, (st.session_state.doc_id, st.session_state.text_data))
+        st.session_state.text_data = None
+        st.session_state.word_tags = None
+    on_page = {doc_id for doc_id, _ in items}
+    while len(items) < page_size:
+        doc_id, text_data = load_next_text(username, domain)
+        if text_data is None:
+            break
+        # Every row's widgets are keyed by doc_id, so a document can only be on the page once
+        if doc_id not in on_page:
+            on_page.add(doc_id)
+            items.append((doc_id, text_data))
+
+    if not items:
+        st.write("No more texts to review.")
+        return
+
+    # A form, so choosing actions and emotions doesn't rerun the page row by row
+    with st.form("bulk_review"):
+        rows = []
+        for doc_id, text_data in items:
+            text = text_data["CodeSwitchedText"].strip('"')
+            stored_tags = text_data.get("language_tags")
+            word_tags = reverse_tag(stored_tags) if stored_tags else light_tagger(text)
+
+            st.write("---")
+            st.markdown(display_colored_sentence(word_tags), unsafe_allow_html=True)
+            st.caption(f"{text_data.get('CreatorName', '')} - {doc_id}")
+            colA, colB, colC = st.columns([2, 3, 4])
+            action = colA.radio("Action", ["Approve", "Edit", "Reject"], key=f"bulk_action_{doc_id}")
+            selected_emotions = colB.multiselect("Emotions", emotions, default=["Neutral"], key=f"bulk_emotions_{doc_id}")
+            english_words = colC.multiselect(
+                "English words (the rest are Yorùbá)", list(range(len(word_tags))),
+                default=[i for i, (_, language) in enumerate(word_tags) if language == "en"],
+                format_func=lambda i, word_tags=word_tags: word_tags[i][0], key=f"bulk_tags_{doc_id}"
+            )
+            edited_text = st.text_input("Edited text (saved when the action is Edit)", text, key=f"bulk_text_{doc_id}")
+            rows.append((doc_id, text, word_tags, action, selected_emotions, set(english_words), edited_text))
+
+        submitted = st.form_submit_button("Submit All Reviews")
+
+    if submitted:
+        reviews = []
+        for doc_id, text, word_tags, action, selected_emotions, english_words, edited_text in rows:
+            reviewed_text = edited_text if action == "Edit" else text
+            if reviewed_text != text:
+                # The word tags belong to the old text
+                word_tags = light_tagger(reviewed_text)
+            else:
+                word_tags = [(word, "en" if i in english_words else "yo") for i, (word, _) in enumerate(word_tags)]
+            reviews.append((doc_id, {
+                "Status": action.lower(),
+                "reviewer": username,
+                "reviewed_text": reviewed_text,
+                "emotions": selected_emotions,
+                "language_tags": tag(word_tags)
+            }))
+        lost = save_reviews(reviews, username)
+        if lost:
+            st.toast(f"{len(lost)} of {len(reviews)} reviews were not saved: your hold on those prompts expired and another reviewer picked them up.")
+        else:
+            st.toast(f"{len(reviews)} reviews submitted!")
+        st.session_state.bulk_items = []
+        st.rerun()  # Claims the next page
+
+# Function to poll the background greeting and rerun the app once its audio is ready
+@st.fragment(run_every=1)
+def wait_for_greeting():
+    greeting = st.session_state.greeting
+    if greeting is None or not greeting.done():
+        return
+    st.session_state.greeting = None
+    try:
+        st.session_state.greeting_audio = greeting.result()
+    except Exception:
+        # No greeting is better than a broken page
+        logger.warning("Could not produce the greeting", exc_info=True)
+        return
+    st.rerun()
+
 # Streamlit App Layout
 if "username" not in st.session_state:
     st.session_state.username = None
@@ -189,8 +563,12 @@ if "upload_started" not in st.session_state:
     st.session_state.upload_started = False
 if "processed_file_path" not in st.session_state:
     st.session_state.processed_file_path = None
-if "dataframe" not in st.session_state:
-    st.session_state.dataframe = None
+if "processed_rows" not in st.session_state:
+    st.session_state.processed_rows = 0
+if "upload_job_id" not in st.session_state:
+    st.session_state.upload_job_id = None
+if "processed_fingerprint" not in st.session_state:
+    st.session_state.processed_fingerprint = None
 if "new_text" not in st.session_state:
     st.session_state.new_text = None
 if "new_emotions" not in st.session_state:
@@ -204,12 +582,42 @@ if "word_tags" not in st.session_state:
 if "text_data" not in st.session_state:
     st.session_state.text_data = None
 
+if "review_queue" not in st.session_state:
+    st.session_state.review_queue = None
+if "review_queue_domain" not in st.session_state:
+    st.session_state.review_queue_domain = None
+
 if "doc_id" not in st.session_state:
     st.session_state.doc_id = None
+# Items claimed for the current bulk review page
+if "bulk_items" not in st.session_state:
+    st.session_state.bulk_items = []
 
 if "max_num_cols" not in st.session_state:
     st.session_state.max_num_cols = 2
 
+if "review_count" not in st.session_state:
+    st.session_state.review_count = None
+
+# Background welcome greeting (a Future) and its audio file once ready
+if "greeting" not in st.session_state:
+    st.session_state.greeting = None
+if "greeting_audio" not in st.session_state:
+    st.session_state.greeting_audio = None
+
+# Cursors for the History page: the last document of every page before the current one
+if "history_cursors" not in st.session_state:
+    st.session_state.history_cursors = [None]
+if "history_page_size" not in st.session_state:
+    st.session_state.history_page_size = None
+
+# Count the backend calls of this script run; the session's previous run is finished and logged first
+previous_rerun = st.session_state.get("metrics_rerun")
+st.session_state.metrics_rerun = metrics.start_rerun(
+    st.session_state.get("page", "Review") if st.session_state.username else "Login",
+    st.session_state.username, previous=previous_rerun
+)
+
 
 if st.session_state.username is None:
     # Prompt user to enter their name
@@ -220,23 +628,24 @@ if st.session_state.username is None:
     if st.button("Start Review Session"):
         if username:
             st.session_state.username = username  # Save the username in session_state
-            from utils import generate_speech, rephrase_text
-            greeting = f"Hey! {username.split()[0]} Welcome back. Happy prompt reviewing. Godspeed"
-            greeting = rephrase_text(openai_api_key,greeting)
-            generate_speech(greeting,openai_api_key=openai_api_key, output_file= "welcome.mp3")
-            play_audio("welcome.mp3")
-            with st.spinner(f"Please hold up {username.split()[0].title()}, I'm setting up things for you!"):
-                time.sleep(10)
-                st.success("Done!")
-                st.rerun()  # Reload the app to proceed to the review section
+            # The greeting is produced in the background while the Review page loads
+            from greetings import request_greeting
+            st.session_state.greeting = request_greeting(username, openai_api_key)
+            st.rerun()  # Reload the app to proceed to the review section
 else:
     # Display the username and review count in the sidebar
     st.sidebar.title("Senior Reviewer")
     st.sidebar.write(f"Username: {st.session_state.username}")
-    
+
+    # Play the welcome greeting once it is ready
+    if st.session_state.greeting_audio:
+        play_audio(st.session_state.greeting_audio)
+        st.session_state.greeting_audio = None
+    elif st.session_state.greeting is not None:
+        wait_for_greeting()
 
     # Navigation Menu
-    page = st.sidebar.radio("Navigate", ["Review", "History", "Analytics", "Upload Prompts"])
+    page = st.sidebar.radio("Navigate", ["Review", "History", "Analytics", "Upload Prompts"], key="page")
     st.session_state.max_num_cols = st.sidebar.slider(
         "Select the number of columns for word buttons",
         min_value=1,
@@ -244,6 +653,8 @@ else:
         value=7,  # Default value
         step=1
     )
+    if st.session_state.username in admin_users and st.sidebar.checkbox("Show backend metrics"):
+        metrics_panel(previous_rerun)
 
     if page == "Review":
         # Get the review count for the current reviewer
@@ -270,94 +681,112 @@ else:
                     """)
 
 
-        # Load the next unreviewed text
-        doc_id, text_data = load_next_text()
-
-        if text_data:
-            if st.session_state.text_data== None:
-                st.session_state.text_data = text_data
-                st.session_state.doc_id = doc_id
-            corrected_tags = []
-            # Display the Original Text, Code-Switched Text, and Creator's Name
-            # st.title("Text Review")
-            # st.write("#### Original Text")
-            # st.write("###### " + text_data["OriginalText"])
-            # st.write("Code-Switched Text")
-            # st.write("##### " + text_data["CodeSwitchedText"])
-            st.session_state.text_data["CodeSwitchedText"] = st.session_state.text_data["CodeSwitchedText"].strip('"')
-            if st.session_state.word_tags==None:
-                tagged_words = light_tagger(st.session_state.text_data["CodeSwitchedText"])
-                st.session_state.word_tags = tagged_words
-            else:
-                tagged_words = st.session_state.word_tags
-                # st.session_state.word_tags = tagged_words
-            
-            # st.write("Click on a word's button below to change its language tag (blue = English, red = Yoruba)")
+        # Let reviewers stick to one domain; the list comes from the shared pending index
+        index = get_pending_index()
+        domains = index.domains()
+        domain = st.sidebar.selectbox("Domain", ["All domains", *domains])
+        domain = None if domain == "All domains" else domain
 
-            # Add the legend or indicator for language tags
-            # st.write("### Legend:")
-            import streamlit as st
+        bulk_mode = st.sidebar.checkbox("Bulk mode", help="Review a page of prompts at once and submit them together")
+        if bulk_mode:
+            page_size = st.sidebar.number_input("Prompts per page", min_value=2, max_value=BULK_MAX_PAGE_SIZE, value=BULK_PAGE_SIZE)
+            bulk_review(st.session_state.username, domain, page_size)
+        else:
+            # Claim the next unreviewed text, keeping the current one until it is submitted
+            if st.session_state.text_data is None:
+                # Items left over from a bulk page are reviewed first
+                if st.session_state.bulk_items:
+                    st.session_state.doc_id, st.session_state.text_data = st.session_state.bulk_items.pop(0)
+                else:
+                    st.session_state.doc_id, st.session_state.text_data = load_next_text(st.session_state.username, domain)
+
+            if st.session_state.text_data:
+                corrected_tags = []
+                # Display the Original Text, Code-Switched Text, and Creator's Name
+                # st.title("Text Review")
+                # st.write("#### Original Text")
+                # st.write("###### " + text_data["OriginalText"])
+                # st.write("Code-Switched Text")
+                # st.write("##### " + text_data["CodeSwitchedText"])
+                st.session_state.text_data["CodeSwitchedText"] = st.session_state.text_data["CodeSwitchedText"].strip('"')
+                if st.session_state.word_tags==None:
+                    # Tags are computed at upload time; only legacy documents are tagged here
+                    stored_tags = st.session_state.text_data.get("language_tags")
+                    if stored_tags:
+                        tagged_words = reverse_tag(stored_tags)
+                    else:
+                        tagged_words = light_tagger(st.session_state.text_data["CodeSwitchedText"])
+                    st.session_state.word_tags = tagged_words
+                else:
+                    tagged_words = st.session_state.word_tags
+                    # st.session_state.word_tags = tagged_words
+            
+                # st.write("Click on a word's button below to change its language tag (blue = English, red = Yoruba)")
 
-            # Create two columns
-            colA, colB = st.columns(2)
+                # Add the legend or indicator for language tags
+                # st.write("### Legend:")
+                import streamlit as st
 
-            # Use the first column for the blue text
-            with colA:
-                st.markdown("<p style='color:blue;'>Blue = English</p>", unsafe_allow_html=True)
+                # Create two columns
+                colA, colB = st.columns(2)
 
-            # Use the second column for the red text
-            with colB:
-                st.markdown("<p style='color:red;'>Red = Yorùbá</p>", unsafe_allow_html=True)
+                # Use the first column for the blue text
+                with colA:
+                    st.markdown("<p style='color:blue;'>Blue = English</p>", unsafe_allow_html=True)
 
-            st.markdown(f"<h3>{display_colored_sentence(st.session_state.word_tags)}</h3>", unsafe_allow_html=True)
+                # Use the second column for the red text
+                with colB:
+                    st.markdown("<p style='color:red;'>Red = Yorùbá</p>", unsafe_allow_html=True)
 
-            # Call the function to display the buttons
-            display_buttons(st.session_state.word_tags,st.session_state.max_num_cols)
+                # Sentence preview and word buttons
+                tag_editor(st.session_state.max_num_cols)
 
-            # with st.expander("More details"):
-            #     (st.write(dict(st.session_state.word_tags)))
-            st.write("#### Creator's Name")
-            st.write(st.session_state.text_data["CreatorName"])
+                # with st.expander("More details"):
+                #     (st.write(dict(st.session_state.word_tags)))
+                st.write("#### Creator's Name")
+                st.write(st.session_state.text_data["CreatorName"])
 
-            st.write("### Review Actions")
-            action = st.radio("Choose Action", ["Approve", "Edit", "Reject"])
+                st.write("### Review Actions")
+                action = st.radio("Choose Action", ["Approve", "Edit", "Reject"])
            
-            # Emotion multi-select dropdown
-            selected_emotions = st.multiselect(
-                        "Select the emotions in which this sentence should be read",
-                        emotions,
-                        default=['Neutral']  # Default to no emotions selected
-                    )
-
-
-            # If the reviewer chooses "Edit", allow them to modify the text
-            if action == "Edit":
-                edited_text = st.text_area("Edited Code-Switched Text", st.session_state.text_data["CodeSwitchedText"],                                
-                                           key="edited_text",
-                               on_change=update_reflection)
-
-            #             # Loop through each word and its current language tag
-            # for word, lang in tagged_words:
-            #     corrected_lang = st.selectbox(f"Correct the language tag for '{word}'", ["en", "yo"], index=["en", "yo"].index(lang))
-            #     corrected_tags.append((word, corrected_lang))
-
-            if st.button("Submit Review"):
-                review_data = {
-                    "Status": action.lower(),
-                    "reviewer": st.session_state.username,
-                    "reviewed_text": edited_text if action == "Edit" else st.session_state.text_data["CodeSwitchedText"],
-                    "emotions": selected_emotions,
-                    "language_tags": tag(st.session_state.word_tags)
-                }
-                save_review(st.session_state.doc_id, review_data)
-
-                # Confirmation and auto-reload to fetch the next item
-                st.success("Review submitted!")
-                st.session_state.word_tags=None
-                st.session_state.text_data = None
-                st.rerun()  # Reloads the app to show the next item
-        else:
-            st.write("No more texts to review.")
+                # Emotion multi-select dropdown
+                selected_emotions = st.multiselect(
+                            "Select the emotions in which this sentence should be read",
+                            emotions,
+                            default=['Neutral']  # Default to no emotions selected
+                        )
+
+
+                # If the reviewer chooses "Edit", allow them to modify the text
+                if action == "Edit":
+                    edited_text = st.text_area("Edited Code-Switched Text", st.session_state.text_data["CodeSwitchedText"],                                
+                                               key="edited_text",
+                                   on_change=update_reflection)
+
+                #             # Loop through each word and its current language tag
+                # for word, lang in tagged_words:
+                #     corrected_lang = st.selectbox(f"Correct the language tag for '{word}'", ["en", "yo"], index=["en", "yo"].index(lang))
+                #     corrected_tags.append((word, corrected_lang))
+
+                if st.button("Submit Review"):
+                    review_data = {
+                        "Status": action.lower(),
+                        "reviewer": st.session_state.username,
+                        "reviewed_text": edited_text if action == "Edit" else st.session_state.text_data["CodeSwitchedText"],
+                        "emotions": selected_emotions,
+                        "language_tags": tag(st.session_state.word_tags)
+                    }
+                    try:
+                        save_review(st.session_state.doc_id, review_data)
+                        # Confirmation and auto-reload to fetch the next item
+                        st.success("Review submitted!")
+                    except LeaseLostError:
+                        st.warning("Your hold on this prompt expired and another reviewer picked it up, so your review was not saved. Loading the next one.")
+                    st.session_state.word_tags=None
+                    st.session_state.text_data = None
+                    st.rerun()  # Reloads the app to show the next item
+            else:
+                st.write("No more texts to review.")
 
     elif page == "History":
         st.title("Review History")
@@ -365,8 +794,14 @@ else:
         # User specifies the number of records to retrieve
         num_records = st.number_input("Number of records to retrieve:", min_value=1, max_value=100, value=10)
 
-        # Fetch and display the review history
-        history = get_review_history(st.session_state.username, num_records)
+        # Changing the page size invalidates the cursors, so start again from the first page
+        if st.session_state.history_page_size != num_records:
+            st.session_state.history_page_size = num_records
+            st.session_state.history_cursors = [None]
+
+        # Fetch and display the current page of the review history
+        history, last_doc = get_review_history(st.session_state.username, num_records, st.session_state.history_cursors[-1])
+        st.write(f"Page {len(st.session_state.history_cursors)}")
 
         if history:
             for record in history:
@@ -414,52 +849,33 @@ else:
         else:
             st.write("No history available.")
 
+        colPrev, colNext = st.columns(2)
+        with colPrev:
+            if st.button("Previous page", disabled=len(st.session_state.history_cursors) == 1):
+                st.session_state.history_cursors.pop()
+                st.rerun()
+        with colNext:
+            # A short page means there is nothing after it
+            if st.button("Next page", disabled=len(history) < num_records):
+                st.session_state.history_cursors.append(last_doc)
+                st.rerun()
+
     elif page == "Analytics":
         st.title("Reviewer Analytics")
 
         # Fetch review data and compute analytics
-        review_data = fetch_review_data()
-        if not review_data.empty:
-            review_data =  review_data.fillna("unreviewed")
-            original_review_data = review_data.copy()
-            review_data = review_data[(review_data["reviewer"] != "unreviewed") & (review_data["Status"] != "reject")]
-            status_count = review_data.groupby(['reviewer', 'Status']).size().unstack(fill_value=0)
-            try:
-                status_count["sum"] = status_count["approve"] + status_count["edit"]
-            except:
-                status_count["sum"] = status_count["approve"]
-            status_count = status_count.sort_values(by="sum").drop("sum", axis=1)
-            
-            # Plotting
-            fig, ax = plt.subplots(figsize=(10, 6))
-            bars = status_count.plot(kind='barh', stacked=True, ax=ax, )
-
-            # # Annotate bars with totals
-            # for bar in bars.patches:
-            #     ax.annotate(str(int(bar.get_height())),
-            #                 (bar.get_x() + bar.get_width() / 2, bar.get_height()),
-            #                 ha='center', va='bottom', fontsize=9)
-
-            # Add titles and labels
-            plt.title("Review Status by Reviewer", fontsize=16)
-            plt.ylabel("Reviewer", fontsize=12)
-            plt.xlabel("Number of Reviews", fontsize=12)
-            plt.xticks(rotation=0)
-            plt.legend(title="Status", fontsize=10)
-            plt.tight_layout()
-
+        counts, generation = fetch_review_data()
+        status_count, reviewer_counts, unreviewed, chart = build_analytics(generation, counts)
+        if not status_count.empty:
             # Display the plot
-            st.pyplot(fig)
+            st.image(chart)
             st.write("\n")
             st.write("Breakdown: Note that I've excluded your rejections, and this is data that has not been uploaded to the speech app")
             st.write(f"Right now, {status_count.index[-1].title()} is on 🔥🔥")
 
-            st.write(review_data["reviewer"].value_counts())
-            # st.write(original_review_data)
-            unreviewed_df = original_review_data[(original_review_data["reviewer"]=="unreviewed") & (original_review_data["Status"] != "reject")]
-            # st.write(unreviewed_df)
-            st.write("Sum total is: ", str(review_data["reviewer"].value_counts().sum()), "prompts")
-            st.write("Unreviwed Prompts: ", str(len(unreviewed_df)), "prompts")
+            st.write(reviewer_counts)
+            st.write("Sum total is: ", str(reviewer_counts.sum()), "prompts")
+            st.write("Unreviwed Prompts: ", str(unreviewed), "prompts")
 
 
         else:
@@ -467,84 +883,121 @@ else:
 
 
     elif page == "Upload Prompts":
+        from ingest import MAX_REPORTED_ERRORS, file_fingerprint, iter_processed_chunks, peek_prompt_rows, process_prompts
+
         st.title("Upload Prompts")
 
         # File uploader
         uploaded_file = st.file_uploader("Upload your prompt CSV file:", type=["csv", "xlsx"])
         
         if uploaded_file:
-            # Read the file based on its extension
-            if uploaded_file.name.endswith(".xlsx"):
-                df = pd.read_excel(uploaded_file, header=None)
-            elif uploaded_file.name.endswith(".csv"):
-                df = pd.read_csv(uploaded_file, header=None)
-
+            # Only the first rows are read for the preview; the file is streamed when processed
             st.write("Preview of Uploaded Data:")
-            st.write(df.head())  # Show a preview of the uploaded file
-
-            # Perform sanity checks
-            errors = []
-            if len(df.columns) < 1:
-                errors.append("The uploaded file must have at least one column for prompts.")
-            elif df.isnull().any().any():
-                errors.append("The file contains missing values. Please clean the data before uploading.")
-
-            # Notify the user of errors
-            if errors:
-                st.error("Sanity checks failed! Please address the following issues:")
-                for error in errors:
-                    st.write(f"- {error}")
-                st.warning("You cannot proceed with processing or uploading until these issues are resolved.")
+            preview = peek_prompt_rows(uploaded_file, uploaded_file.name)
+            try:
+                dedup_index = get_dedup_index()
+            except ValueError as e:
+                dedup_index = None
+                st.warning(f"Near-duplicate checks are off: {e}")
+            else:
+                if dedup_index is None:
+                    st.info("No near-duplicate index found; run `python dedup.py build` to check uploads against existing prompts.")
+            if dedup_index is not None and len(dedup_index):
+                from dedup import DuplicateChecker
+
+                matches = DuplicateChecker(dedup_index).check([(f"preview_{i}", text or "") for i, text in enumerate(preview)])
+                st.dataframe([{"Prompt": text, "Duplicate of": match[0] if match else ""}
+                              for text, match in zip(preview, matches)])
             else:
-                # If sanity checks pass, process the data
-                st.success("Sanity checks passed!")
-                st.warning("Please and Please if you don't understand anything here Ask Victor! Don't Guess! Ask!")
-
-                # Prepare data
-                df.columns = ["code-switched-text"]
-                code_name = st.text_input("Enter the nick name or first name of the Prompt Creator and add the current data and time e.g, Mary140520250115, we use this to generate ID", value="Mary140520250115")
-                set_num = st.text_input("Enter the SET number - Ask Victor if you don't know, this is essentially the batch number", value="4")
-                df["ID"] = [f"{code_name}_Set_{set_num}_{i}" for i in range(len(df))]
-                df["Original Text"] = "unknown"
-                df["Creator's Name"] = st.text_input("Enter the Full Name of the Prompt Creator", value="Mary Magdalene")
-                df["domain"] = st.text_input("Enter the domain for these prompts (e.g., Health):", value="General")
-                df["Status"] = "pending"
-                df["pulled"] = False
-                df["code-switched-text"] = df["code-switched-text"].str.strip('"')
-
-                # Save the processed file
-                if st.button("Process and Save"):
-                    processed_file_path = "processed_prompts.csv"
-                    df.reset_index(drop=True).to_csv(processed_file_path, index=False)
+                st.write(preview)
+
+            st.warning("Please and Please if you don't understand anything here Ask Victor! Don't Guess! Ask!")
+
+            # Prepare data
+            code_name = st.text_input("Enter the nick name or first name of the Prompt Creator and add the current data and time e.g, Mary140520250115, we use this to generate ID", value="Mary140520250115")
+            set_num = st.text_input("Enter the SET number - Ask Victor if you don't know, this is essentially the batch number", value="4")
+            creator_name = st.text_input("Enter the Full Name of the Prompt Creator", value="Mary Magdalene")
+            domain = st.text_input("Enter the domain for these prompts (e.g., Health):", value="General")
+            drop_duplicates = st.checkbox("Leave out near-duplicates of existing prompts", value=False)
+
+            # Validate, assign IDs and tag the file chunk by chunk into the processed CSV
+            process_clicked = st.button("Process and Save")
+            if process_clicked and not (UPLOAD_ID_PART.fullmatch(code_name) and UPLOAD_ID_PART.fullmatch(set_num)):
+                st.error("The nick name and SET number may only contain letters, digits, _ and -.")
+            elif process_clicked:
+                # Uploads are tracked as jobs per set, which is also what the document IDs are built from
+                job_id = f"{code_name}_Set_{set_num}"
+                processed_file_path = f"processed_prompts_{job_id}.csv"
+                check_duplicates = None
+                if dedup_index is not None:
+                    from dedup import DuplicateChecker
+
+                    # Checks each row against the index and the rows of the file before it
+                    check_duplicates = DuplicateChecker(dedup_index).check
+                with st.spinner("Checking and tagging prompts..."):
+                    processed_rows, errors, error_count, duplicates, duplicate_count = process_prompts(
+                        uploaded_file, uploaded_file.name, code_name, set_num, creator_name, domain,
+                        processed_file_path, chunk_size=UPLOAD_BATCH_SIZE,
+                        check_duplicates=check_duplicates, drop_duplicates=drop_duplicates
+                    )
+                uploaded_file.seek(0)
+
+                if duplicate_count:
+                    left_out = " They were left out of the processed file." if drop_duplicates else ""
+                    st.warning(f"{duplicate_count} rows are near-duplicates of existing prompts or of earlier rows.{left_out}")
+                    if duplicate_count > len(duplicates):
+                        st.write(f"Showing the first {MAX_REPORTED_ERRORS}.")
+                    st.dataframe([{"Row": row + 1, "ID": doc_id, "Duplicate of": match_id, "Similarity": round(similarity, 2)}
+                                  for row, doc_id, match_id, similarity in duplicates])
+
+                if error_count:
+                    st.error(f"Sanity checks failed for {error_count} rows. They were left out of the processed file:")
+                    if error_count > len(errors):
+                        st.write(f"Showing the first {MAX_REPORTED_ERRORS}.")
+                    st.dataframe([{"Row": row + 1, "Error": error} for row, error in errors])
+                if processed_rows:
                     st.session_state.processed_file_path = processed_file_path  # Save file path in session_state
-                    st.session_state.dataframe = df  # Save the dataframe in session_state
-                    st.success(f"File processed and saved as {processed_file_path}. Ready for upload.")
-                    st.write("Preview of Uploaded Data:")
-                    st.write(df.head())  # Show a preview of the uploaded file
-
-                # Upload to Firestore
-                if st.session_state.processed_file_path and st.button("Upload to Firestore"):
-                    st.session_state.upload_started = True
-                    with st.spinner("Uploading data to Firestore..."):
-                        progress_bar = st.progress(0)  # Initialize the progress bar
-                        total_rows = len(st.session_state.dataframe)  # Total number of rows to upload
-
-                        for index, row in enumerate(st.session_state.dataframe.iterrows(), start=1):
-                            _, data_row = row
-                            doc_id = data_row["ID"]
-                            data = {
-                                "OriginalText": data_row["Original Text"],
-                                "CodeSwitchedText": data_row["code-switched-text"],
-                                "CreatorName": data_row["Creator's Name"],
-                                "Status": data_row["Status"],
-                                "domain": data_row["domain"],
-                                "pulled": data_row["pulled"]
-                            }
-                            db.collection("stage_four_reviews").document(doc_id).set(data)
-
-                            # Update progress bar
-                            progress = int((index / total_rows) * 100)
-                            progress_bar.progress(progress)
+                    st.session_state.processed_rows = processed_rows
+                    st.session_state.upload_job_id = job_id
+                    st.session_state.processed_fingerprint = file_fingerprint(processed_file_path)
+                    st.success(f"{processed_rows} prompts processed and saved as {processed_file_path}. Ready for upload.")
+                else:
+                    st.session_state.processed_file_path = None
+                    st.warning("There is nothing to upload. Please clean the data and try again.")
+
+            # Upload to Firestore
+            if st.session_state.processed_file_path and st.button("Upload to Firestore"):
+                st.session_state.upload_started = True
+                job_id = st.session_state.upload_job_id
+                job_fields = {
+                    "fingerprint": st.session_state.processed_fingerprint,
+                    "chunk_size": UPLOAD_BATCH_SIZE,
+                    "uploaded_by": st.session_state.username
+                }
+
+                # Pick up where an interrupted upload of the same processed file stopped
+                start_chunk = 0
+                job = load_upload_job(job_id)
+                if (job and job.get("status") != "done" and job.get("fingerprint") == job_fields["fingerprint"]
+                        and job.get("chunk_size") == UPLOAD_BATCH_SIZE):
+                    start_chunk = job.get("committed_chunks", 0)
+                    if start_chunk:
+                        st.info(f"Resuming the earlier upload of this set from row {start_chunk * UPLOAD_BATCH_SIZE + 1}.")
+
+                with st.spinner("Uploading data to Firestore..."):
+                    progress_bar = st.progress(0)  # Initialize the progress bar
+                    failures, skipped = upload_prompts(
+                        iter_processed_chunks(st.session_state.processed_file_path, UPLOAD_BATCH_SIZE, start_chunk),
+                        st.session_state.processed_rows, progress_bar, job_id, job_fields, start_chunk
+                    )
 
+                if skipped:
+                    st.info(f"{skipped} prompts were already in Firestore and were left untouched.")
+                if failures:
+                    st.error(f"{len(failures)} of {st.session_state.processed_rows} rows could not be uploaded. The rest were saved.")
+                    st.dataframe([{"ID": doc_id, "Error": error} for doc_id, error in failures])
+                else:
                     st.success("All data uploaded successfully!")
-                    st.session_state.upload_started = False  # Reset the upload state
\ No newline at end of file
+                # Later uploads are checked against these prompts too
+                index_uploaded_prompts(st.session_state.processed_file_path, failures)
+                st.session_state.upload_started = False  # Reset the upload state
\ No newline at end of file
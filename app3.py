@@ -1,37 +1,81 @@
 import streamlit as st
-from firebase_admin import credentials, firestore, initialize_app, _apps
 import json
 import os
+import random
+import time
+from datetime import datetime, timezone
+import metrics
+from storage import LeaseLostError, lease_is_free, open_store
 
-# Initialize Firebase if it hasn't been initialized yet
-firebase_secrets = json.loads(os.environ['firebase_credentials'])
 openai_api_key = json.loads(os.environ['openai_key'])
-if not _apps:
-    cred = credentials.Certificate(firebase_secrets)
-    initialize_app(cred)
 
-db = firestore.client()
+# Function to open the store of texts once per process; REVIEW_STORE selects Firestore, SQLite or memory
+@st.cache_resource
+def get_review_store():
+    # Texts have no analytics counters
+    return open_store(collection="texts", stats=False)
 
-# Function to load the next text to review
-def load_next_text():
-    docs = db.collection("texts").where("Status", "==", "pending").limit(1).stream()
-    for doc in docs:
-        return doc.id, doc.to_dict()
+store = get_review_store()
+
+# How long a reviewer holds a claimed text before it goes back to the pool
+LEASE_SECONDS = 15 * 60
+CLAIM_CANDIDATES = 50
+# Fields needed to pick candidates; listing queries return nothing else
+CANDIDATE_FIELDS = ["Status", "claimed_by", "lease_expires"]
+
+# Function to claim the next text to review
+def load_next_text(username):
+    now = datetime.now(timezone.utc)
+    # Only the lease fields are read here; the full document comes with the claim
+    candidates = store.pending_candidates(CLAIM_CANDIDATES, fields=CANDIDATE_FIELDS, username=username)
+    candidates = [(doc_id, data) for doc_id, data in candidates if lease_is_free(data, username, now)]
+    # Random order spreads concurrent reviewers out; the reviewer's own lease is reused first
+    random.shuffle(candidates)
+    candidates.sort(key=lambda candidate: candidate[1].get("claimed_by") != username)
+
+    for doc_id, _ in candidates:
+        # None if another session claimed it first
+        data = store.claim(doc_id, username, LEASE_SECONDS)
+        if data is not None:
+            return doc_id, data
     return None, None
 
+# How long the sidebar review counter is trusted before it is re-synced with the store
+REVIEW_COUNT_TTL = 300  # seconds
+
 # Function to save the review
 def save_review(doc_id, review_data):
-    db.collection("texts").document(doc_id).update(review_data)
+    # Only written if the reviewer still holds the lease
+    store.write_review(doc_id, {**review_data, "claimed_by": None, "lease_expires": None},
+                       lease_holder=review_data["reviewer"])
+    if review_data["Status"] in ["approve", "edit"]:
+        bump_review_count(review_data["reviewer"], 1)
 
 # Function to get the count of completed reviews by the user (excluding rejects)
 def get_review_count(username):
-    docs = db.collection("texts").where("reviewer", "==", username).where("Status", "in", ["approve", "edit"]).stream()
-    return sum(1 for _ in docs)
+    # Cached per session and bumped by save_review; re-synced with a server-side count after the TTL
+    cache = st.session_state.get("review_count")
+    if cache is None or cache["username"] != username or time.time() - cache["synced_at"] > REVIEW_COUNT_TTL:
+        cache = {"username": username, "count": store.count_reviews(username, ["approve", "edit"]), "synced_at": time.time()}
+        st.session_state.review_count = cache
+    return cache["count"]
+
+# Function to adjust the cached review count after a local write
+def bump_review_count(username, delta):
+    cache = st.session_state.get("review_count")
+    if cache is not None and cache["username"] == username:
+        cache["count"] += delta
 
 # Check if username is in session_state, if not, prompt for it
 if "username" not in st.session_state:
     st.session_state.username = None
 
+# Count the backend calls of this script run; the session's previous run is finished and logged first
+st.session_state.metrics_rerun = metrics.start_rerun(
+    "Review" if st.session_state.username else "Login", st.session_state.username,
+    previous=st.session_state.get("metrics_rerun")
+)
+
 if st.session_state.username is None:
     # Prompt user to enter their name
     st.title("Welcome to the Code-Switched Text Reviewer")
@@ -68,7 +112,10 @@ else:
     # Main app layout for reviewing
     st.title("Code-Switched Text Reviewer")
 
-    doc_id, text_data = load_next_text()
+    # Claim a text once and keep it in the session until it is submitted
+    if st.session_state.get("text_data") is None:
+        st.session_state.doc_id, st.session_state.text_data = load_next_text(st.session_state.username)
+    doc_id, text_data = st.session_state.doc_id, st.session_state.text_data
     if text_data:
         # Display the Yoruba text and AI code-switched text with increased font size and bold style
         st.markdown("## **Original Yoruba Text**")
@@ -97,9 +144,12 @@ else:
                 "reviewer": st.session_state.username.lower().strip(),
                 "reviewed_text": edited_text if action == "Edit" else text_data["CodeSwitchedText"] if action == "Approve" else None,
             }
-            save_review(doc_id, review_data)
-            
-            st.success("Review submitted!")
+            try:
+                save_review(doc_id, review_data)
+                st.success("Review submitted!")
+            except LeaseLostError:
+                st.warning("Your hold on this text expired and another reviewer picked it up, so your review was not saved.")
+            st.session_state.text_data = None
             st.rerun()  # Reload to get the next text
     else:
         st.write("No more texts to review.")
@@ -0,0 +1,248 @@
+"""
+Microbenchmarks of the tagging, rendering, history and analytics hot paths,
+run on synthetic, seeded data of increasing size:
+
+    light_tagger               utils.light_tagger over N sentences
+    tag_roundtrip              utils.reverse_tag(utils.tag(...)) over N tagged sentences
+    colored_sentence           utils.display_colored_sentence over N tagged sentences
+    history_memory             first history page of every reviewer, MemoryStore with N documents
+    history_sqlite             the same on a SQLiteStore (in-memory database)
+    analytics                  review_stats counters from N documents + analytics_summary
+    langid                     langid scoring of the words of N sentences, one batch
+
+Results are written as JSON. Pass a saved results file as --baseline to compare
+against it; cases slower than the baseline by more than --threshold are
+reported and make the run exit with status 1.
+
+    python benchmarks/bench_hotpaths.py --sizes 1000 100000 --output results.json
+    python benchmarks/bench_hotpaths.py --baseline benchmarks/baseline.json
+
+light_tagger uses the trained language model if there is one and the
+precompiled lexicon (`python lexicon.py`) otherwise, or NLTK's installed corpus
+while that file is missing; --synthetic-lexicon runs it against a generated
+word list instead. The tagger used is recorded in the results. A baseline recorded with another tagger is refused (exit status 2)
+unless --allow-lexicon-mismatch is given, which compares every case but
+light_tagger. The langid case always uses a model trained on the synthetic
+sentences.
+"""
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import langid  # noqa: E402
+import utils  # noqa: E402
+from lexicon import LEXICON_PATH  # noqa: E402
+from review_stats import analytics_summary, stats_frame, stats_key  # noqa: E402
+from storage import MemoryStore, SQLiteStore  # noqa: E402
+
+SEED = 1234
+NUM_REVIEWERS = 50
+HISTORY_PAGE_SIZE = 50
+# Stores are filled in chunks of this many documents
+LOAD_CHUNK_SIZE = 5000
+
+ENGLISH_WORDS = ["the", "market", "is", "very", "busy", "today", "we", "will", "go", "to", "church",
+                 "after", "school", "please", "call", "me", "when", "you", "reach", "home"]
+YORUBA_WORDS = ["mo", "fẹ́", "lọ", "sí", "ọjà", "ní", "àárọ̀", "yìí", "ṣé", "o", "ti", "jẹun",
+                "ẹ", "kú", "iṣẹ́", "àti", "ilé", "wa", "dáadáa", "ọ̀rẹ́"]
+STATUSES = ["approve", "edit", "reject", "pending"]
+
+
+def synthetic_sentences(n, rng):
+    # Code-switched sentences of 5-25 words, roughly half English
+    vocabulary = ENGLISH_WORDS + YORUBA_WORDS
+    return [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 25))) + rng.choice([".", "?", "!"])
+            for _ in range(n)]
+
+
+def synthetic_documents(n, rng):
+    start = datetime(2024, 1, 1)
+    documents = []
+    for i in range(n):
+        status = rng.choice(STATUSES)
+        reviewed = status != "pending"
+        documents.append((f"doc_{i}", {
+            "OriginalText": "unknown",
+            "CodeSwitchedText": f"sentence {i}",
+            "Status": status,
+            "pulled": rng.random() < 0.1,
+            "reviewer": f"reviewer_{rng.randrange(NUM_REVIEWERS)}" if reviewed else None,
+            "Timestamp": start + timedelta(seconds=rng.randrange(10 ** 7)) if reviewed else None,
+        }))
+    return documents
+
+
+def fill_store(store, documents):
+    for i in range(0, len(documents), LOAD_CHUNK_SIZE):
+        store.create_prompts(documents[i:i + LOAD_CHUNK_SIZE])
+    return store
+
+
+def use_synthetic_lexicon():
+    english_words = frozenset(ENGLISH_WORDS) | frozenset(f"word{i}" for i in range(235000))
+    utils.get_language_model = lambda: None
+    utils.get_english_words = lambda: english_words
+
+
+def setup_sentences(n):
+    return synthetic_sentences(n, random.Random(SEED))
+
+
+def setup_tagged(n):
+    return [utils.light_tagger(sentence) for sentence in setup_sentences(n)]
+
+
+def setup_history(store_factory):
+    def setup(n):
+        return fill_store(store_factory(), synthetic_documents(n, random.Random(SEED)))
+    return setup
+
+
+def run_history(store):
+    for reviewer in range(NUM_REVIEWERS):
+        store.review_history(f"reviewer_{reviewer}", HISTORY_PAGE_SIZE)
+
+
+def setup_langid(n):
+    tagged = [[{"word": word, "language": "en" if word in ENGLISH_WORDS else "yo"} for word in sentence.split()]
+              for sentence in synthetic_sentences(1000, random.Random(SEED))]
+    model = langid.train(*langid.word_labels(tagged), bits=langid.DEFAULT_BITS)
+    return model, [word for sentence in setup_sentences(n) for word in sentence.split()]
+
+
+def run_analytics(documents):
+    counts = Counter(stats_key(data) for _, data in documents)
+    analytics_summary(stats_frame(counts))
+
+
+CASES = {
+    "light_tagger": (setup_sentences, lambda sentences: [utils.light_tagger(s) for s in sentences]),
+    "tag_roundtrip": (setup_tagged, lambda tagged: [utils.reverse_tag(utils.tag(t)) for t in tagged]),
+    "colored_sentence": (setup_tagged, lambda tagged: [utils.display_colored_sentence(t) for t in tagged]),
+    "history_memory": (setup_history(MemoryStore), run_history),
+    "history_sqlite": (setup_history(lambda: SQLiteStore(":memory:")), run_history),
+    "analytics": (lambda n: synthetic_documents(n, random.Random(SEED)), run_analytics),
+    "langid": (setup_langid, lambda state: state[0].scores(state[1])),
+}
+
+
+def time_case(setup, run, n, repeats):
+    state = setup(n)
+    run(state)  # Warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+    return {"median_s": statistics.median(timings), "min_s": min(timings), "repeats": repeats}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, skip=()):
+    """
+    Compares median timings with a baseline run, leaving out the cases in `skip`.
+
+    Returns:
+        list: (case, size, baseline median, current median) for every regression.
+    """
+    regressions = []
+    for case, sizes in results["cases"].items():
+        if case in skip:
+            continue
+        for size, result in sizes.items():
+            before = baseline["cases"].get(case, {}).get(size)
+            if before is None:
+                continue
+            ratio = result["median_s"] / before["median_s"]
+            flag = "REGRESSION" if ratio > 1 + threshold else ""
+            print(f"{case:<18} {size:>9} {before['median_s']:10.4f}s -> {result['median_s']:10.4f}s  x{ratio:5.2f} {flag}")
+            if flag:
+                regressions.append((case, size, before["median_s"], result["median_s"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="dataset sizes (default: 1000 10000 100000; up to 1000000)")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown over the baseline reported as a regression (default: 0.10)")
+    parser.add_argument("--synthetic-lexicon", action="store_true",
+                        help="tag against a generated word list instead of the precompiled lexicon")
+    parser.add_argument("--allow-lexicon-mismatch", action="store_true",
+                        help="compare with a baseline recorded with another tagger, leaving out light_tagger")
+    args = parser.parse_args()
+
+    if args.synthetic_lexicon:
+        use_synthetic_lexicon()
+    if args.synthetic_lexicon:
+        lexicon = "synthetic"
+    elif utils.get_language_model() is not None:
+        lexicon = "model"
+    else:
+        # Without the pickle, get_english_words builds the word list from the installed NLTK corpus
+        lexicon = "precompiled" if os.path.exists(LEXICON_PATH) else "nltk"
+
+    baseline = None
+    skip = ()
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # Checked before running anything, so a gate with the wrong baseline fails fast instead of passing
+        if baseline["meta"].get("lexicon") != lexicon:
+            if not args.allow_lexicon_mismatch:
+                print(f"Baseline used the {baseline['meta'].get('lexicon')} tagger, this run the {lexicon} one; "
+                      "pass --allow-lexicon-mismatch to compare the other cases.")
+                sys.exit(2)
+            print("Baseline used another tagger; light_tagger is not compared.")
+            skip = ("light_tagger",)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "lexicon": lexicon,
+            "run_at": datetime.utcnow().isoformat(),
+        },
+        "cases": {},
+    }
+    for case in args.cases:
+        setup, run = CASES[case]
+        for size in args.sizes:
+            result = time_case(setup, run, size, args.repeats)
+            result["us_per_item"] = result["median_s"] / size * 1e6
+            results["cases"].setdefault(case, {})[str(size)] = result
+            print(f"{case:<18} {size:>9}  median {result['median_s']:10.4f}s  {result['us_per_item']:8.2f} us/item")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, skip)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
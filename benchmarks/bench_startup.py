@@ -0,0 +1,114 @@
+"""
+Cold-start cost of the app's imports and of loading the English lexicon used
+by utils.light_tagger.
+
+Each variant runs in a fresh interpreter, so the numbers include imports and
+file/network I/O, like a new Streamlit worker would see them.
+
+--reruns N also times N warm reruns of every page of app.py in one process,
+through Streamlit's AppTest, against a MemoryStore seeded with --prompts
+pending prompts. No Firebase project or OpenAI key is needed for that.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --runs 0 --reruns 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTS = {
+    # What importing utils used to do
+    "nltk download + set(words.words())": (
+        "import nltk\n"
+        "nltk.download('words', quiet=True)\n"
+        "from nltk.corpus import words\n"
+        "english_words = set(words.words())\n"
+    ),
+    "precompiled lexicon": (
+        "from lexicon import get_english_words\n"
+        "english_words = get_english_words()\n"
+    ),
+    # Module-level imports of app.py before pandas/matplotlib moved into the pages that use them
+    "app.py imports, eager": (
+        "import streamlit, firebase_admin.firestore\n"
+        "import pandas, matplotlib.pyplot\n"
+        "import utils, review_stats, review_queue, firebase_setup\n"
+    ),
+    "app.py imports, lazy": (
+        "import streamlit, firebase_admin.firestore\n"
+        "import utils, review_stats, review_queue, firebase_setup\n"
+    ),
+    "interpreter only": "pass\n",
+}
+
+
+def time_variant(code, runs):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def time_reruns(reruns, prompts):
+    """
+    Times warm reruns of every page of app.py, after one untimed run per page.
+
+    Returns:
+        dict: Page name to the list of rerun timings in ms.
+    """
+    sys.path.insert(0, REPO_ROOT)
+    os.environ.setdefault("openai_key", "unused")
+    import storage
+    from streamlit.testing.v1 import AppTest
+
+    words = [("mo", "yo"), ("fẹ́", "yo"), ("lọ", "yo"), ("to", "en"), ("the", "en"), ("market", "en")]
+    store = storage.MemoryStore()
+    # Prompts carry their upload-time tags, so the Review page doesn't tag them again
+    store.create_prompts([
+        (f"bench_{i}", {"OriginalText": "unknown", "CodeSwitchedText": " ".join(word for word, _ in words),
+                        "CreatorName": "bench", "Status": "pending", "pulled": False, "domain": f"domain_{i % 5}",
+                        "language_tags": [{"word": word, "language": language} for word, language in words]})
+        for i in range(prompts)
+    ])
+    # app.py opens its store through storage.open_store on the first run
+    storage.open_store = lambda *args, **kwargs: store
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=60)
+    app.run()
+    app.session_state["username"] = "bench"
+    timings = {}
+    for page in ["Review", "History", "Analytics", "Upload Prompts"]:
+        app.session_state["page"] = page
+        app.run()
+        if app.exception:
+            raise RuntimeError(f"{page} page failed: {app.exception[0].value}")
+        timings[page] = []
+        for _ in range(reruns):
+            start = time.perf_counter()
+            app.run()
+            timings[page].append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reruns", type=int, default=0, help="warm reruns timed per page of app.py (default: 0)")
+    parser.add_argument("--prompts", type=int, default=1000, help="pending prompts in the rerun store (default: 1000)")
+    args = parser.parse_args()
+
+    if args.runs:
+        for name, code in VARIANTS.items():
+            timings = time_variant(code, args.runs)
+            print(f"{name:<40} median {statistics.median(timings):8.1f} ms   min {min(timings):8.1f} ms")
+    if args.reruns:
+        for page, timings in time_reruns(args.reruns, args.prompts).items():
+            print(f"{'rerun, ' + page:<40} median {statistics.median(timings):8.1f} ms   min {min(timings):8.1f} ms")
@@ -0,0 +1,501 @@
+"""
+Near-duplicate detection for uploaded prompts.
+
+Every prompt is reduced to a MinHash signature over the character shingles of
+its normalized text. Signatures are split into bands, and each band is hashed
+into a sorted key table (LSH banding). Looking a prompt up is then a binary
+search per band plus a signature comparison with the few candidates that share
+a band. That costs O(bands x log n) per row instead of comparing against every
+stored prompt.
+
+The index lives in a local directory, DEDUP_INDEX_DIR:
+
+    meta.json          sizes, parameters and which tables are current
+    ids.txt            document ID of every row
+    signatures.u32     row signatures, appended as raw uint32
+    band_keys.<n>.npy  per band, the sorted band hashes of the compacted rows
+    band_rows.<n>.npy  the row each of those keys belongs to
+    delta.npz          band hashes of rows added since the last compaction
+    lock               held by whichever process is writing the index
+
+Everything but the delta is memory-mapped, so only the pages a lookup touches
+are read. Build it from the existing prompts once, then keep it current as
+prompts are uploaded:
+
+    python dedup.py build
+    python dedup.py compact
+
+Both commands are safe to run while the app is up. Every write holds the lock
+file and saves a new generation token in meta.json; an index loaded by another
+process sees the token change and reloads before its next lookup or add.
+Uploads checked while a build is running wait for it to finish.
+"""
+import argparse
+from contextlib import contextmanager
+import glob
+import json
+import os
+import re
+import threading
+import unicodedata
+import uuid
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEDUP_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedup_index")
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+SEED = 20240601
+# Bumped when the layout of the index directory changes
+FORMAT = 2
+# Estimated Jaccard similarity from which two prompts count as near-duplicates
+DUPLICATE_THRESHOLD = 0.7
+# The delta is merged into the sorted tables once it is this large relative to them
+COMPACT_RATIO = 0.1
+
+# Universal hashing modulo the largest 32-bit prime keeps a * x + b within uint64
+_PRIME = np.uint64(4294967291)
+_rng = np.random.default_rng(SEED)
+_A = _rng.integers(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)[:, None]
+# Odd multipliers that fold the rows of a band into one 64-bit key
+_BAND_MIX = _rng.integers(1, 2 ** 63, size=ROWS_PER_BAND, dtype=np.uint64) | np.uint64(1)
+_EMPTY_SIGNATURE = np.full(NUM_PERM, int(_PRIME), dtype=np.uint32)
+
+
+def normalize(text):
+    # Case, punctuation and spacing differences don't make a prompt new; diacritics do
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    text = normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def signature(text):
+    """
+    Returns the MinHash signature of a prompt as NUM_PERM uint32 values.
+    """
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)), dtype=np.uint64)
+    if not len(hashes):
+        return _EMPTY_SIGNATURE.copy()
+    return ((_A * hashes + _B) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def band_keys(signatures):
+    """
+    Folds each band of each signature into one key.
+
+    Parameters:
+        signatures (ndarray): (n, NUM_PERM) uint32.
+
+    Returns:
+        ndarray: (n, BANDS) uint64.
+    """
+    bands = signatures.astype(np.uint64).reshape(len(signatures), BANDS, ROWS_PER_BAND)
+    return (bands * _BAND_MIX).sum(axis=2)
+
+
+def sort_bands(keys, first_row=0):
+    # Per band, the keys in sorted order and the row each one came from
+    order = np.argsort(keys, axis=0, kind="stable")
+    rows = (order + first_row).astype(np.uint32)
+    return np.take_along_axis(keys, order, axis=0).T.copy(), rows.T.copy()
+
+
+def lookup(tables, keys):
+    """
+    Finds, for each query, the rows sharing at least one band key with it.
+
+    Parameters:
+        tables (iterable): (keys, rows) pairs of sorted band tables, each (BANDS, n).
+        keys (ndarray): (n, BANDS) band keys of the queries.
+
+    Returns:
+        list: Per query, an ndarray of row numbers without repeats.
+    """
+    found = [[] for _ in range(len(keys))]
+    for table_keys, table_rows in tables:
+        if not table_keys.shape[1]:
+            continue
+        for band in range(BANDS):
+            # One binary search per band for the whole batch; only the hits are sliced per query
+            left = np.searchsorted(table_keys[band], keys[:, band], side="left")
+            right = np.searchsorted(table_keys[band], keys[:, band], side="right")
+            for i in np.nonzero(right > left)[0]:
+                found[i].append(np.asarray(table_rows[band, left[i]:right[i]]))
+    return [np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.uint32) for rows in found]
+
+
+def best_match(signatures, ids, rows, sig, threshold):
+    # (ID, estimated similarity) of the closest of `rows` to `sig`, or None below `threshold`
+    if not len(rows):
+        return None
+    similarity = (np.asarray(signatures[rows]) == sig).mean(axis=1)
+    best = int(np.argmax(similarity))
+    return (ids[rows[best]], float(similarity[best])) if similarity[best] >= threshold else None
+
+
+def merge_tables(keys, rows, new_keys, new_rows):
+    # Sorted band tables with the (BANDS, n) new keys and their rows added
+    keys = np.concatenate([keys, new_keys], axis=1)
+    rows = np.concatenate([rows, new_rows], axis=1)
+    order = np.argsort(keys, axis=1, kind="stable")
+    return np.take_along_axis(keys, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+
+@contextmanager
+def directory_lock(directory):
+    """
+    Holds an exclusive lock on an index directory, across processes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_from(path, offset, data):
+    # Replaces whatever the file holds from `offset` on with `data`
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        f.truncate()
+        f.write(data)
+
+
+class DedupIndex:
+    """
+    The near-duplicate index. Load it with DedupIndex.load(); an index
+    directory that doesn't exist yet gives an empty index.
+
+    Parameters:
+        directory (str): Where the index is kept.
+    """
+
+    def __init__(self, directory=DEDUP_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self._known = set()
+        # Bytes of ids.txt that hold the saved rows
+        self._ids_size = 0
+        self.compacted = 0
+        # Version of the band tables in use, see _compact
+        self.tables = 0
+        # Token of the saved state this copy matches; None until it was loaded or saved
+        self.generation = None
+        self._signatures = np.empty((0, NUM_PERM), dtype=np.uint32)
+        self._keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._rows = np.empty((BANDS, 0), dtype=np.uint32)
+        self._delta_keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._delta_rows = np.empty((BANDS, 0), dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @classmethod
+    def load(cls, directory=DEDUP_INDEX_DIR):
+        index = cls(directory)
+        index._refresh()
+        return index
+
+    def _refresh(self):
+        # Picks up writes made by other processes since this copy was loaded or saved
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        with directory_lock(self.directory):
+            self._reload()
+
+    def _reload(self):
+        # Call with the directory lock held
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = None
+        generation = meta.get("generation", "") if meta is not None else None
+        if generation == self.generation:
+            return
+        self._reset()
+        if meta is None:
+            return
+        if (meta.get("format"), meta["num_perm"], meta["bands"], meta["shingle_size"], meta["seed"]) != (
+                FORMAT, NUM_PERM, BANDS, SHINGLE_SIZE, SEED):
+            raise ValueError(f"{self.directory} was built with other parameters; rebuild it with `python dedup.py build`")
+
+        count = meta["count"]
+        with open(self._path("ids.txt"), encoding="utf-8") as f:
+            self.ids = [line.rstrip("\n") for line in f][:count]
+        self._known = set(self.ids)
+        self._ids_size = sum(len(doc_id.encode("utf-8")) + 1 for doc_id in self.ids)
+        if count:
+            self._signatures = np.memmap(self._path("signatures.u32"), dtype=np.uint32, mode="r", shape=(count, NUM_PERM))
+        self.compacted = meta["compacted"]
+        self.tables = meta["tables"]
+        if self.compacted:
+            self._keys = np.load(self._path(f"band_keys.{self.tables}.npy"), mmap_mode="r")
+            self._rows = np.load(self._path(f"band_rows.{self.tables}.npy"), mmap_mode="r")
+        if count > self.compacted:
+            with np.load(self._path("delta.npz")) as delta:
+                self._delta_keys, self._delta_rows = delta["keys"], delta["rows"]
+        self.generation = generation
+
+    def query(self, signatures, threshold=DUPLICATE_THRESHOLD):
+        """
+        Finds the closest stored prompt of every query signature.
+
+        Returns:
+            list: (document ID, estimated similarity) of the best match at or
+                above `threshold`, or None, per signature.
+        """
+        with self._lock:
+            self._refresh()
+            # Rows sharing at least one band with a query, from the sorted tables and the delta
+            candidates = lookup(((self._keys, self._rows), (self._delta_keys, self._delta_rows)), band_keys(signatures))
+            # Tables saved by an add that crashed before meta.json can name rows past the saved ones
+            return [best_match(self._signatures, self.ids, rows[rows < len(self.ids)], sig, threshold)
+                    for sig, rows in zip(signatures, candidates)]
+
+    def add(self, pairs):
+        """
+        Adds (doc_id, text) pairs and saves them. Documents already in the
+        index are skipped. The sorted tables are rebuilt once the unsorted delta
+        grows past COMPACT_RATIO of them.
+        """
+        pairs = list(dict(pairs).items())
+        if not pairs:
+            return
+        signatures = np.stack([signature(text) for _, text in pairs])
+        with self._lock, directory_lock(self.directory):
+            self._reload()
+            self._add(pairs, signatures)
+
+    def _add(self, pairs, signatures):
+        # Call with the directory lock held and this copy reloaded
+        # Checked under the lock, so two uploads adding the same document don't both add it
+        new = [i for i, (doc_id, _) in enumerate(pairs) if doc_id not in self._known]
+        if not new:
+            return
+        pairs = [pairs[i] for i in new]
+        signatures = signatures[new]
+        first_row = len(self.ids)
+        ids = "".join(f"{doc_id}\n" for doc_id, _ in pairs).encode("utf-8")
+        # Written from the end of the saved rows rather than appended: rows left by an add
+        # that crashed before saving meta.json are overwritten, so signatures and IDs stay aligned
+        write_from(self._path("signatures.u32"), first_row * NUM_PERM * 4, signatures.tobytes())
+        write_from(self._path("ids.txt"), self._ids_size, ids)
+        self._ids_size += len(ids)
+        self.ids.extend(doc_id for doc_id, _ in pairs)
+        self._known.update(doc_id for doc_id, _ in pairs)
+        self._signatures = np.memmap(self._path("signatures.u32"), dtype=np.uint32, mode="r",
+                                     shape=(len(self.ids), NUM_PERM))
+
+        keys, rows = sort_bands(band_keys(signatures), first_row)
+        # Re-sort the small delta so it can be binary searched too
+        self._delta_keys, self._delta_rows = merge_tables(self._delta_keys, self._delta_rows, keys, rows)
+
+        if self._delta_keys.shape[1] > COMPACT_RATIO * self.compacted:
+            self._compact()
+        else:
+            with open(self._path("delta.npz.tmp"), "wb") as f:
+                np.savez(f, keys=self._delta_keys, rows=self._delta_rows)
+            os.replace(self._path("delta.npz.tmp"), self._path("delta.npz"))
+            self._save_meta()
+
+    def compact(self):
+        with self._lock, directory_lock(self.directory):
+            self._reload()
+            self._compact()
+
+    def _compact(self):
+        # Call with the directory lock held and this copy reloaded
+        keys, rows = merge_tables(self._keys, self._rows, self._delta_keys, self._delta_rows)
+        # Both tables go to new files that only meta.json switches to, so a crash at
+        # any point leaves meta.json naming a matching pair of keys and rows
+        tables = self.tables + 1
+        np.save(self._path(f"band_keys.{tables}.npy"), keys)
+        np.save(self._path(f"band_rows.{tables}.npy"), rows)
+        self._keys = np.load(self._path(f"band_keys.{tables}.npy"), mmap_mode="r")
+        self._rows = np.load(self._path(f"band_rows.{tables}.npy"), mmap_mode="r")
+        self._delta_keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._delta_rows = np.empty((BANDS, 0), dtype=np.uint32)
+        self.compacted = len(self.ids)
+        self.tables = tables
+        # delta.npz is only read for rows past `compacted`, so it needn't be cleared
+        self._save_meta()
+        for path in glob.glob(self._path("band_*.npy")):
+            if not path.endswith(f".{tables}.npy"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still mapped by another process on Windows; removed by a later compaction
+                    pass
+
+    def _save_meta(self):
+        self.generation = uuid.uuid4().hex
+        meta = {"count": len(self.ids), "compacted": self.compacted, "tables": self.tables,
+                "generation": self.generation, "format": FORMAT, "num_perm": NUM_PERM,
+                "bands": BANDS, "shingle_size": SHINGLE_SIZE, "seed": SEED}
+        with open(self._path("meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self._path("meta.json.tmp"), self._path("meta.json"))
+
+
+class DuplicateChecker:
+    """
+    Checks the rows of one upload against the index and against the rows of
+    the same upload checked before them.
+
+    The upload's rows are kept like the index keeps its own: signatures in one
+    uint32 buffer and band keys in sorted numpy tables, with a small sorted
+    delta merged in once it passes COMPACT_RATIO of them. That is about 1 KB
+    per row, so checking a large upload chunk by chunk stays close to the
+    bounded memory of process_prompts.
+
+    Parameters:
+        index (DedupIndex): Stored prompts.
+        threshold (float): Estimated similarity from which rows are flagged.
+    """
+
+    def __init__(self, index, threshold=DUPLICATE_THRESHOLD):
+        self.index = index
+        self.threshold = threshold
+        self._ids = []
+        # Grows by half when full
+        self._signatures = np.empty((1024, NUM_PERM), dtype=np.uint32)
+        self._keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._rows = np.empty((BANDS, 0), dtype=np.uint32)
+        self._delta_keys = np.empty((BANDS, 0), dtype=np.uint64)
+        self._delta_rows = np.empty((BANDS, 0), dtype=np.uint32)
+
+    def _remember(self, ids, signatures, keys):
+        first_row = len(self._ids)
+        needed = first_row + len(ids)
+        if needed > len(self._signatures):
+            grown = np.empty((max(needed, len(self._signatures) * 3 // 2), NUM_PERM), dtype=np.uint32)
+            grown[:first_row] = self._signatures[:first_row]
+            self._signatures = grown
+        self._signatures[first_row:needed] = signatures
+        self._ids.extend(ids)
+        keys, rows = sort_bands(keys, first_row)
+        self._delta_keys, self._delta_rows = merge_tables(self._delta_keys, self._delta_rows, keys, rows)
+        if self._delta_keys.shape[1] > COMPACT_RATIO * self._keys.shape[1]:
+            self._keys, self._rows = merge_tables(self._keys, self._rows, self._delta_keys, self._delta_rows)
+            self._delta_keys = np.empty((BANDS, 0), dtype=np.uint64)
+            self._delta_rows = np.empty((BANDS, 0), dtype=np.uint32)
+
+    def check(self, pairs):
+        """
+        Parameters:
+            pairs (list): (doc_id, text) pairs of new prompts.
+
+        Returns:
+            list: (matching document ID, estimated similarity) or None, per pair.
+                Matches on the same document ID (a re-upload of the same set)
+                are not reported.
+        """
+        if not pairs:
+            return []
+        signatures = np.stack([signature(text) for _, text in pairs])
+        keys = band_keys(signatures)
+        ids = [doc_id for doc_id, _ in pairs]
+        earlier_rows = lookup(((self._keys, self._rows), (self._delta_keys, self._delta_rows)), keys)
+        # Rows of this call only join the tables at the end; until then they are found through
+        # per-band dicts, which hold no more than one call's rows
+        chunk_bands = [{} for _ in range(BANDS)]
+        matches = []
+        for i, (doc_id, sig, row_keys, stored, rows) in enumerate(zip(ids, signatures, keys.tolist(),
+                                                                      self.index.query(signatures, self.threshold),
+                                                                      earlier_rows)):
+            in_chunk = sorted({row for band, key in enumerate(row_keys) for row in chunk_bands[band].get(key, ())})
+            earlier = best_match(self._signatures, self._ids, rows, sig, self.threshold)
+            in_chunk = best_match(signatures, ids, in_chunk, sig, self.threshold)
+            candidates = [match for match in (stored, earlier, in_chunk) if match is not None and match[0] != doc_id]
+            matches.append(max(candidates, key=lambda match: match[1]) if candidates else None)
+            for band, key in enumerate(row_keys):
+                chunk_bands[band].setdefault(key, []).append(i)
+        self._remember(ids, signatures, keys)
+        return matches
+
+
+def build_index(records, directory=DEDUP_INDEX_DIR, batch_size=10000):
+    """
+    Builds a fresh index from (doc_id, text) pairs, a batch at a time.
+
+    Returns:
+        DedupIndex: The new index.
+    """
+    def add(batch):
+        pairs = list(dict(batch).items())
+        if pairs:
+            index._add(pairs, np.stack([signature(text) for _, text in pairs]))
+
+    # Held throughout, so an app using the directory waits and then reloads the new index
+    with directory_lock(directory):
+        paths = [os.path.join(directory, name) for name in ("meta.json", "ids.txt", "signatures.u32", "delta.npz")]
+        for path in paths + glob.glob(os.path.join(directory, "band_*.npy")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        index = DedupIndex(directory)
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                add(batch)
+                batch = []
+        add(batch)
+        index._compact()
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "compact"])
+    parser.add_argument("--dir", default=DEDUP_INDEX_DIR, help="index directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from firebase_setup import get_db
+        from review_stats import REVIEWS_COLLECTION
+
+        docs = get_db().collection(REVIEWS_COLLECTION).select(["CodeSwitchedText"]).stream()
+        records = ((doc.id, doc.to_dict().get("CodeSwitchedText") or "") for doc in docs)
+        index = build_index(records, args.dir)
+        print(f"Indexed {len(index)} prompts into {args.dir}")
+    else:
+        index = DedupIndex.load(args.dir)
+        index.compact()
+        print(f"Compacted {len(index)} prompts in {args.dir}")
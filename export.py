@@ -0,0 +1,298 @@
+"""
+Streaming export of reviewed prompts.
+
+Pages through the approved and edited `stage_four_reviews` documents that have
+not been pulled yet, ordered by document ID with query cursors, and writes them
+to numbered shard files in an output directory:
+
+    python export.py exports/2024-06 --format jsonl --shard-size 100000
+
+Each shard is written to a temporary file, fsynced and renamed into place, and
+recorded in `manifest.json` before any of its documents are touched. Only then
+are its documents marked `pulled = True`, in transactions that also move them
+to the pulled counters of review_stats. Memory stays bounded by one page of
+documents whatever the size of the collection.
+
+The export is resumable: running the same command again first finishes marking
+any shard the manifest lists as written but not yet pulled, then carries on
+with the documents that are still unpulled. Marking checks each document
+first, so a shard that was half marked before a crash is not counted twice.
+Documents that were undone or reviewed again after their shard was written
+are not marked either; the review in the shard is no longer theirs, so they
+stay unpulled and the next export picks up the new review.
+"""
+import argparse
+import json
+import os
+from itertools import islice
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from ingest import iter_chunks
+from review_stats import REVIEWS_COLLECTION, apply_stats_delta, stats_delta
+from storage import time_key
+
+EXPORT_STATUSES = ["approve", "edit"]
+EXPORT_FIELDS = ["reviewed_text", "language_tags", "emotions", "reviewer", "domain", "Status", "Timestamp"]
+PAGE_SIZE = 1000
+# Every marked document is read and updated in the transaction, plus one write for the counter shard
+MARK_BATCH_SIZE = 400
+MANIFEST_NAME = "manifest.json"
+
+
+def export_record(doc_id, data):
+    record = {"id": doc_id, **{field: data.get(field) for field in EXPORT_FIELDS}}
+    # Written as a UTC string, which marking compares to tell whether the review changed since
+    record["Timestamp"] = time_key(record["Timestamp"])
+    return record
+
+
+def iter_unpulled(db, page_size=PAGE_SIZE):
+    """
+    Yields (doc_id, data) for every reviewed document that has not been pulled,
+    one page of `page_size` documents at a time.
+    """
+    query = (
+        db.collection(REVIEWS_COLLECTION)
+        .where("Status", "in", EXPORT_STATUSES)
+        .where("pulled", "==", False)
+        .order_by(FieldPath.document_id())
+        .select(EXPORT_FIELDS)
+        .limit(page_size)
+    )
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        docs = list(page.stream())
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+
+def fsync_directory(directory):
+    # The rename is only durable once the directory entry is
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ShardWriter:
+    """
+    Writes one shard to a temporary file and moves it into place on commit().
+
+    Parameters:
+        path (str): Final path of the shard.
+        file_format (str): "jsonl" or "parquet".
+    """
+
+    def __init__(self, path, file_format):
+        self.path = path
+        self.file_format = file_format
+        self.tmp_path = f"{path}.tmp"
+        self.rows = 0
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            self._file = open(self.tmp_path, "wb")
+            self._writer = pq.ParquetWriter(self._file, parquet_schema())
+        else:
+            self._file = open(self.tmp_path, "w", encoding="utf-8")
+
+    def write(self, records):
+        if self.file_format == "parquet":
+            import pyarrow as pa
+
+            # Each page becomes one row group
+            self._writer.write_table(pa.Table.from_pylist(records, schema=parquet_schema()))
+        else:
+            for record in records:
+                self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.rows += len(records)
+
+    def commit(self):
+        if self.file_format == "parquet":
+            self._writer.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.string()),
+        ("reviewed_text", pa.string()),
+        ("language_tags", pa.list_(pa.struct([("word", pa.string()), ("language", pa.string())]))),
+        ("emotions", pa.list_(pa.string())),
+        ("reviewer", pa.string()),
+        ("domain", pa.string()),
+        ("Status", pa.string()),
+        ("Timestamp", pa.string()),
+    ])
+
+
+def iter_shard_entries(path, file_format):
+    """
+    Reads (document ID, exported Timestamp) back from a written shard, without
+    loading it whole. Raises ValueError for a shard without the Timestamps, as
+    there is no telling which of its documents still hold the exported review.
+    """
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+
+        shard = pq.ParquetFile(path)
+        if "Timestamp" not in shard.schema_arrow.names:
+            raise ValueError(f"{path} has no Timestamp column; export into a new directory")
+        for batch in shard.iter_batches(columns=["id", "Timestamp"]):
+            yield from zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if "Timestamp" not in record:
+                        raise ValueError(f"{path} has records without a Timestamp; export into a new directory")
+                    yield record["id"], record["Timestamp"]
+
+
+def still_exported(before, exported_timestamp):
+    """
+    Whether a document still holds the review that was written to the shard:
+    it is approved or edited, not pulled yet, and its Timestamp is the exported
+    one. An undo or a new review changes both.
+    """
+    if before.get("pulled") or before.get("Status") not in EXPORT_STATUSES:
+        return False
+    return time_key(before.get("Timestamp")) == exported_timestamp
+
+
+@firestore.transactional
+def mark_pulled(transaction, db, entries):
+    """
+    Sets pulled = True on the documents of (doc_id, exported Timestamp) entries
+    and moves them to the pulled counters. Documents that are gone, already
+    pulled, or no longer hold the exported review are left alone.
+
+    Returns:
+        int: Number of documents marked.
+    """
+    collection = db.collection(REVIEWS_COLLECTION)
+    exported = dict(entries)
+    changes = []
+    for snapshot in transaction.get_all([collection.document(doc_id) for doc_id in exported]):
+        if not snapshot.exists:
+            continue
+        before = snapshot.to_dict()
+        if not still_exported(before, exported[snapshot.id]):
+            continue
+        transaction.update(snapshot.reference, {"pulled": True})
+        changes.append((before, {**before, "pulled": True}))
+    apply_stats_delta(transaction, db, stats_delta(changes))
+    return len(changes)
+
+
+def mark_shard(db, path, file_format):
+    marked = 0
+    for entries in iter_chunks(iter_shard_entries(path, file_format), MARK_BATCH_SIZE):
+        marked += mark_pulled(db.transaction(), db, entries)
+    return marked
+
+
+def load_manifest(output_dir, file_format):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"format": file_format, "shards": []}
+    if manifest["format"] != file_format:
+        raise ValueError(f"{output_dir} holds a {manifest['format']} export; use the same format to resume it")
+    return manifest
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(output_dir)
+
+
+def export_reviews(db, output_dir, file_format="jsonl", shard_size=100000, page_size=PAGE_SIZE):
+    """
+    Exports every reviewed, unpulled document and marks it pulled.
+
+    Parameters:
+        db: Firestore client.
+        output_dir (str): Directory for the shards and the manifest. Reuse it to resume.
+        file_format (str): "jsonl" or "parquet" (needs pyarrow).
+        shard_size (int): Documents per shard file.
+        page_size (int): Documents read per query.
+
+    Returns:
+        tuple: (number of documents exported, number of documents marked pulled).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir, file_format)
+    exported = 0
+    marked = 0
+
+    def finish_shard(shard):
+        nonlocal marked
+        marked += mark_shard(db, os.path.join(output_dir, shard["file"]), file_format)
+        shard["status"] = "pulled"
+        save_manifest(output_dir, manifest)
+
+    # Shards written before an interruption still need their documents marked
+    for shard in manifest["shards"]:
+        if shard["status"] == "written":
+            finish_shard(shard)
+
+    # Marked documents drop out of the query, so a resumed export just starts from the beginning again
+    documents = iter_unpulled(db, page_size)
+    while True:
+        index = len(manifest["shards"])
+        name = f"reviews-{index:05d}.{file_format}"
+        writer = None
+        while writer is None or writer.rows < shard_size:
+            page = list(islice(documents, min(page_size, shard_size - (writer.rows if writer else 0))))
+            if not page:
+                break
+            writer = writer or ShardWriter(os.path.join(output_dir, name), file_format)
+            writer.write([export_record(doc_id, data) for doc_id, data in page])
+        if writer is None:
+            break
+
+        writer.commit()
+        shard = {"file": name, "rows": writer.rows, "status": "written"}
+        manifest["shards"].append(shard)
+        save_manifest(output_dir, manifest)
+        exported += writer.rows
+        finish_shard(shard)
+        print(f"Wrote {name} ({writer.rows} documents)")
+
+    return exported, marked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir", help="directory for the shards and manifest; reuse it to resume")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="shard file format (parquet needs pyarrow)")
+    parser.add_argument("--shard-size", type=int, default=100000, help="documents per shard (default: 100000)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE, help=f"documents per query (default: {PAGE_SIZE})")
+    args = parser.parse_args()
+
+    from firebase_setup import get_db
+
+    exported, marked = export_reviews(get_db(), args.output_dir, args.format, args.shard_size, args.page_size)
+    print(f"Exported {exported} documents and marked {marked} as pulled into {args.output_dir}")
@@ -0,0 +1,17 @@
+from firebase_admin import credentials, firestore, initialize_app, _apps
+import json
+import os
+
+
+def get_db():
+    """
+    Initializes Firebase from the `firebase_credentials` environment variable
+    (if it hasn't been initialized yet) and returns a Firestore client.
+
+    Returns:
+        google.cloud.firestore.Client: The Firestore client.
+    """
+    if not _apps:
+        cred = credentials.Certificate(json.loads(os.environ['firebase_credentials']))
+        initialize_app(cred)
+    return firestore.client()
@@ -0,0 +1,153 @@
+"""
+Background production of the spoken welcome greeting.
+
+The greeting is rephrased and turned into speech on a worker thread, so logging
+in no longer waits on two OpenAI round trips. Finished audio goes into a
+content-addressed cache on disk keyed by (reviewer, text, model, voice), so a
+returning reviewer gets their greeting straight from the cache. The cache is
+bounded in size and evicts the least recently played files first.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+from utils import generate_speech, rephrase_text
+
+GREETING_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "greeting_cache")
+GREETING_CACHE_MAX_BYTES = 50 * 1024 * 1024
+TTS_MODEL = "tts-1"
+TTS_VOICE = "alloy"
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """
+    Directory of audio files named by the hash of what produced them.
+
+    Parameters:
+        directory (str): Where the files are kept.
+        max_bytes (int): Total size above which the oldest files are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def temp_path(self):
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp")
+
+    def get(self, key):
+        """
+        Returns the cached file for a key, or None. A hit refreshes the file's
+        modification time, which is what eviction goes by.
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_file(self, key, file_path):
+        """
+        Moves a finished file into the cache and evicts old entries if needed.
+
+        Returns:
+            str: Path of the cached file.
+        """
+        path = self.path(key)
+        os.replace(file_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_cache = None
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="greeting")
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def get_greeting_cache():
+    global _cache
+    if _cache is None:
+        _cache = AudioCache(GREETING_CACHE_DIR, GREETING_CACHE_MAX_BYTES)
+    return _cache
+
+
+def greeting_text(username):
+    return f"Hey! {username.split()[0]} Welcome back. Happy prompt reviewing. Godspeed"
+
+
+def produce_greeting(key, text, openai_api_key, cache, client=None):
+    try:
+        spoken_text = rephrase_text(openai_api_key, text, client=client)
+    except Exception:
+        # The plain greeting is still worth saying
+        logger.warning("Could not rephrase the greeting; using the plain text", exc_info=True)
+        spoken_text = text
+    tmp_path = cache.temp_path()
+    generate_speech(spoken_text, openai_api_key, output_file=tmp_path, model=TTS_MODEL, voice=TTS_VOICE, client=client)
+    return cache.put_file(key, tmp_path)
+
+
+def request_greeting(username, openai_api_key, client=None, cache=None):
+    """
+    Starts producing the reviewer's greeting in the background.
+
+    Parameters:
+        username (str): The reviewer.
+        openai_api_key (str): Your OpenAI API key.
+        client: OpenAI client to use instead of the shared one (e.g. a local stub).
+        cache (AudioCache): Cache to use instead of the shared one.
+
+    Returns:
+        Future: Resolves to the path of the greeting audio. Already resolved on a cache hit.
+    """
+    cache = cache or get_greeting_cache()
+    text = greeting_text(username)
+    key = cache.key(username, text, TTS_MODEL, TTS_VOICE)
+
+    path = cache.get(key)
+    if path is not None:
+        future = Future()
+        future.set_result(path)
+        return future
+
+    # A reviewer logging in from two tabs at once shares one request
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = _executor.submit(produce_greeting, key, text, openai_api_key, cache, client)
+            _in_flight[key] = future
+            future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return future
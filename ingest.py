@@ -0,0 +1,188 @@
+"""
+Streaming ingestion of prompt files for the "Upload Prompts" page.
+
+Uploaded CSV/XLSX files are read a row at a time (csv module, openpyxl
+read-only mode), validated, given their IDs, tagged and appended to the
+processed CSV in chunks. The upload then streams the processed CSV back in
+chunks. No step holds more than one chunk of prompts in memory.
+"""
+import codecs
+from contextlib import closing
+import csv
+import hashlib
+import json
+import os
+from itertools import islice
+
+from utils import light_tag_many, tag
+
+PROCESSED_COLUMNS = ["ID", "code-switched-text", "Original Text", "Creator's Name", "domain", "Status", "pulled", "language_tags"]
+# Row errors beyond this are counted but not kept, so a broken file can't fill memory with them
+MAX_REPORTED_ERRORS = 1000
+
+
+def iter_prompt_rows(file, name, column=0, skip_header=False):
+    """
+    Yields (row number, value) for every row of a CSV or XLSX prompt file.
+    Row numbers start at 0 and count every row, so blank rows keep their place.
+    Empty cells come back as None.
+
+    Parameters:
+        file: Binary file object (a path's open file or a Streamlit upload).
+        name (str): File name, used to tell the format.
+        column (int): Column holding the prompt.
+        skip_header (bool): Skip the first row.
+    """
+    extension = os.path.splitext(name)[1].lower()
+    workbook = None
+    if extension == ".csv":
+        # Decoding line by line leaves the caller's file open, unlike a TextIOWrapper
+        rows = csv.reader(codecs.iterdecode(file, "utf-8-sig"))
+    elif extension == ".xlsx":
+        from openpyxl import load_workbook
+
+        # Read-only mode streams rows instead of loading the whole sheet
+        workbook = load_workbook(file, read_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        raise ValueError(f"Unsupported file type: {name}")
+
+    try:
+        if skip_header:
+            next(rows, None)
+        for row_number, row in enumerate(rows):
+            value = row[column] if len(row) > column else None
+            if value is not None and value != "":
+                yield row_number, str(value)
+            else:
+                yield row_number, None
+    finally:
+        # Read-only workbooks keep the archive open until closed
+        if workbook is not None:
+            workbook.close()
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def peek_prompt_rows(file, name, n=5):
+    """
+    Returns the first n prompts of a file for the preview and rewinds it.
+    """
+    # Closing the generator closes the workbook without reading the rest of it
+    with closing(iter_prompt_rows(file, name)) as rows:
+        preview = [value for _, value in islice(rows, n)]
+    file.seek(0)
+    return preview
+
+
+def process_prompts(file, name, code_name, set_num, creator_name, domain, output_path, chunk_size=500,
+                    check_duplicates=None, drop_duplicates=False):
+    """
+    Validates, assigns IDs to and tags every prompt of an uploaded file,
+    writing the result to a CSV one chunk at a time.
+
+    Parameters:
+        file, name: See iter_prompt_rows.
+        code_name, set_num (str): Used to build the IDs, `{code_name}_Set_{set_num}_{row}`.
+        creator_name, domain (str): Stored with every prompt.
+        output_path (str): Processed CSV to write.
+        chunk_size (int): Rows processed at a time.
+        check_duplicates (callable): Optional. Takes a chunk of (doc_id, text)
+            pairs and returns a (matching doc_id, similarity) or None for each,
+            e.g. dedup.DuplicateChecker.check.
+        drop_duplicates (bool): Leave near-duplicates out of the processed file.
+
+    Returns:
+        tuple: (number of rows written, list of (row number, error) for skipped
+            rows, capped at MAX_REPORTED_ERRORS, total number of skipped rows,
+            list of (row number, doc_id, matching doc_id, similarity) for
+            near-duplicates, capped at MAX_REPORTED_ERRORS, total number of
+            near-duplicates).
+    """
+    written = 0
+    errors = []
+    error_count = 0
+    duplicates = []
+    duplicate_count = 0
+
+    with open(output_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(PROCESSED_COLUMNS)
+
+        for chunk in iter_chunks(iter_prompt_rows(file, name), chunk_size):
+            prompts = []
+            for row_number, value in chunk:
+                text = value.strip('"') if value is not None else ""
+                if not text.strip():
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append((row_number, "Missing prompt"))
+                    continue
+                prompts.append((row_number, f"{code_name}_Set_{set_num}_{row_number}", text))
+
+            matches = check_duplicates([(doc_id, text) for _, doc_id, text in prompts]) if check_duplicates else [None] * len(prompts)
+            kept = []
+            for (row_number, doc_id, text), match in zip(prompts, matches):
+                if match is not None:
+                    duplicate_count += 1
+                    if len(duplicates) < MAX_REPORTED_ERRORS:
+                        duplicates.append((row_number, doc_id, *match))
+                    if drop_duplicates:
+                        continue
+                kept.append((doc_id, text))
+
+            # Tag every prompt once here, a chunk at a time, so reviewers don't pay for it on the Review page
+            word_tags = light_tag_many([text for _, text in kept])
+            records = [
+                [doc_id, text, "unknown", creator_name,
+                 domain, "pending", False, json.dumps(tag(tags), ensure_ascii=False)]
+                for (doc_id, text), tags in zip(kept, word_tags)
+            ]
+            writer.writerows(records)
+            written += len(records)
+
+    return written, errors, error_count, duplicates, duplicate_count
+
+
+def file_fingerprint(path):
+    """
+    Returns the SHA-256 of a file, read in blocks. Used to check that a resumed
+    upload is working from the same processed file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_processed_chunks(path, chunk_size, start_chunk=0):
+    """
+    Streams a processed CSV back as chunks of (doc_id, Firestore document) pairs,
+    starting at chunk `start_chunk`. Skipped rows are still read by the CSV
+    reader, but their documents are not built and their tags are not decoded.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        records = csv.DictReader(f)
+        for _ in islice(records, start_chunk * chunk_size):
+            pass
+        for chunk in iter_chunks(records, chunk_size):
+            yield [
+                (record["ID"], {
+                    "OriginalText": record["Original Text"],
+                    "CodeSwitchedText": record["code-switched-text"],
+                    "CreatorName": record["Creator's Name"],
+                    "Status": record["Status"],
+                    "domain": record["domain"],
+                    "pulled": record["pulled"] == "True",
+                    "language_tags": json.loads(record["language_tags"])
+                })
+                for record in chunk
+            ]
@@ -0,0 +1,258 @@
+"""
+Character n-gram language identifier for English/Yorùbá word tagging.
+
+Each word is normalized (NFC, lowercased, punctuation dropped, tone marks
+kept), wrapped in boundary markers and cut into character n-grams of 1 to 4
+characters. The n-grams are hashed into 2^BITS buckets, and a logistic
+regression over the buckets gives the probability that the word is English.
+Scoring a batch is a handful of NumPy operations over all characters of all
+words at once, with no Python loop per word, so whole chunks of prompts are
+tagged in one call.
+
+The model is trained offline from the reviewer-corrected language_tags of
+approved and edited reviews, and saved as a single .npy file of float32
+weights (the last one is the bias) that is memory-mapped on load:
+
+    python langid.py train
+    python langid.py train --output langid_model.npy --bits 18 --epochs 8
+"""
+import argparse
+from collections import Counter, defaultdict
+import os
+import random
+import unicodedata
+
+import numpy as np
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "langid_model.npy")
+# Consecutive sizes from 1: each n-gram hash is built from the one before it
+NGRAM_SIZES = (1, 2, 3, 4)
+DEFAULT_BITS = 18
+# Batches are scored per distinct word when this many leading words show repetition
+DEDUPLICATE_SAMPLE = 4096
+# Words are joined with this character, which also marks where each word starts and ends
+_BOUNDARY = "\x1f"
+_FNV_PRIME = np.uint32(0x01000193)
+_MIX = np.uint32(0x85EBCA6B)
+
+
+def _kept_characters():
+    # Letters, digits and combining marks (Yorùbá tone marks) of the Basic Multilingual Plane
+    keep = np.array([chr(c).isalnum() for c in range(0x10000)])
+    keep[0x0300:0x0370] = True
+    keep[ord(_BOUNDARY)] = True
+    return keep
+
+
+_KEEP = _kept_characters()
+
+
+def featurize(words, bits):
+    """
+    Hashes the character n-grams of a batch of words. The words are joined
+    into one string, so normalizing and hashing are whole-batch operations.
+
+    Parameters:
+        words (list): The words, as written.
+        bits (int): log2 of the number of hash buckets.
+
+    Returns:
+        tuple: (word index per character position, bucket and mask arrays of
+            shape (len(NGRAM_SIZES), positions)); mask is False where the n-gram
+            starting at a position would run past the end of its word.
+    """
+    if not words:
+        # Joining no words would give the same string as one empty word
+        return (np.empty(0, dtype=np.intp), np.empty((len(NGRAM_SIZES), 0), dtype=np.uint32),
+                np.empty((len(NGRAM_SIZES), 0), dtype=bool))
+    text = unicodedata.normalize("NFC", _BOUNDARY.join(words)).lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    # Punctuation, symbols and anything outside the BMP are dropped
+    codes = codes[_KEEP[np.minimum(codes, 0xFFFF)] & (codes <= 0xFFFF)]
+    boundary = np.uint32(ord(_BOUNDARY))
+    # n-grams start anywhere but on the closing boundary, which belongs to no word;
+    # the extra boundaries after it only pad the longest n-grams, which are masked
+    starts = len(codes) + 1
+    codes = np.concatenate([[boundary], codes, [boundary] * max(NGRAM_SIZES)]).astype(np.uint32)
+
+    # Every word runs from the boundary before it to the boundary after it, both included
+    is_boundary = codes[:starts + 1] == boundary
+    word_of = np.cumsum(is_boundary[:starts], dtype=np.intp) - 1
+    remaining = np.flatnonzero(is_boundary)[1:][word_of] - np.arange(starts) + 1
+
+    buckets = np.empty((len(NGRAM_SIZES), starts), dtype=np.uint32)
+    masks = np.empty((len(NGRAM_SIZES), starts), dtype=bool)
+    # The n-gram hash at a position extends the (n-1)-gram hash by one character
+    prefix = codes[:starts].copy()
+    for row, n in enumerate(NGRAM_SIZES):
+        if n > 1:
+            prefix *= _FNV_PRIME
+            prefix ^= codes[n - 1:starts + n - 1]
+        h = prefix ^ np.uint32(n)
+        h ^= h >> np.uint32(16)
+        h *= _MIX
+        np.right_shift(h, np.uint32(32 - bits), out=buckets[row])
+        np.greater_equal(remaining, n, out=masks[row])
+    return word_of, buckets, masks
+
+
+class LanguageModel:
+    """
+    Hashed character n-gram logistic regression.
+
+    Parameters:
+        weights (ndarray): 2^bits bucket weights followed by the bias.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.bits = int(len(weights) - 1).bit_length() - 1
+        if len(weights) != 2 ** self.bits + 1:
+            raise ValueError(f"Expected 2^bits + 1 weights, got {len(weights)}")
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        return cls(np.load(path, mmap_mode="r"))
+
+    def save(self, path=MODEL_PATH):
+        # Write to a temporary file first so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(self.weights, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    def scores(self, words):
+        """
+        Returns:
+            ndarray: Log-odds of being English, one per word.
+        """
+        if not words:
+            return np.empty(0, dtype=np.float32)
+        # Running text repeats most of its words, and then each distinct word is scored once
+        sample = words[:DEDUPLICATE_SAMPLE]
+        if len(set(sample)) > len(sample) / 2:
+            return self._score_distinct(words)
+        distinct = {word: i for i, word in enumerate(dict.fromkeys(words))}
+        inverse = np.fromiter(map(distinct.__getitem__, words), dtype=np.intp, count=len(words))
+        return self._score_distinct(list(distinct))[inverse]
+
+    def _score_distinct(self, words):
+        word_of, buckets, masks = featurize(words, self.bits)
+        contributions = np.where(masks, np.asarray(self.weights)[buckets], 0).sum(axis=0)
+        return np.bincount(word_of, weights=contributions, minlength=len(words)) + self.weights[-1]
+
+    def predict(self, words):
+        """
+        Returns:
+            list: "en" or "yo" for every word.
+        """
+        return np.where(self.scores(words) > 0, "en", "yo").tolist()
+
+
+_models = {}
+
+
+def get_language_model(path=MODEL_PATH):
+    """
+    Loads the model on first use and keeps it for the life of the process.
+    Only a loaded model is kept: while the file is missing it is looked for
+    again on every call, so a model trained while the app runs is picked up.
+
+    Returns:
+        LanguageModel: The model, or None if it has not been trained yet.
+    """
+    model = _models.get(path)
+    if model is None:
+        try:
+            model = _models[path] = LanguageModel.load(path)
+        except FileNotFoundError:
+            return None
+    return model
+
+
+def word_labels(tagged_sentences):
+    """
+    Folds tagged sentences into per-word training examples. A word tagged
+    both ways gets the share of its English tags as a soft label.
+
+    Parameters:
+        tagged_sentences: Iterable of language_tags lists ({"word", "language"} dicts).
+
+    Returns:
+        tuple: (words, share English, number of occurrences).
+    """
+    counts = defaultdict(Counter)
+    for tags in tagged_sentences:
+        for entry in tags or ():
+            counts[entry["word"].lower()][entry["language"]] += 1
+    words = list(counts)
+    totals = np.array([sum(counts[word].values()) for word in words], dtype=np.float64)
+    english = np.array([counts[word]["en"] for word in words], dtype=np.float64)
+    return words, english / totals, totals
+
+
+def train(words, labels, counts, bits=DEFAULT_BITS, epochs=8, batch_size=4096, learning_rate=0.5, seed=0):
+    """
+    Fits the model with AdaGrad over shuffled mini-batches. Examples are
+    weighted by log(1 + occurrences), so common words count more without
+    drowning out the rest.
+
+    Returns:
+        LanguageModel: The trained model.
+    """
+    weights = np.zeros(2 ** bits + 1, dtype=np.float64)
+    squares = np.full_like(weights, 1e-8)
+    sample_weights = np.log1p(counts)
+    order = list(range(len(words)))
+    rng = random.Random(seed)
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            word_of, buckets, masks = featurize([words[i] for i in batch], bits)
+            contributions = np.where(masks, weights[buckets], 0).sum(axis=0)
+            scores = np.bincount(word_of, weights=contributions, minlength=len(batch)) + weights[-1]
+            errors = (1 / (1 + np.exp(-scores)) - labels[batch]) * sample_weights[batch]
+            gradient = np.zeros_like(weights)
+            gradient[:-1] = np.bincount(buckets.ravel(), weights=(errors[word_of] * masks).ravel(), minlength=2 ** bits)
+            gradient[-1] = errors.sum()
+            gradient /= len(batch)
+            squares += gradient ** 2
+            weights -= learning_rate * gradient / np.sqrt(squares)
+    return LanguageModel(weights.astype(np.float32))
+
+
+def accuracy(model, words, labels, counts):
+    # Share of word occurrences tagged with their majority label
+    predicted = model.scores(words) > 0
+    return float(((predicted == (labels >= 0.5)) * counts).sum() / counts.sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["train"])
+    parser.add_argument("--output", default=MODEL_PATH)
+    parser.add_argument("--bits", type=int, default=DEFAULT_BITS)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--holdout", type=float, default=0.1, help="share of words kept out to measure accuracy")
+    args = parser.parse_args()
+
+    from firebase_setup import get_db
+    from review_stats import REVIEWS_COLLECTION
+
+    # Only reviewed documents: their tags have been checked and corrected by a reviewer
+    docs = (get_db().collection(REVIEWS_COLLECTION).where("Status", "in", ["approve", "edit"])
+            .select(["language_tags"]).stream())
+    words, labels, counts = word_labels(doc.to_dict().get("language_tags") for doc in docs)
+    print(f"{len(words)} distinct words, {int(counts.sum())} occurrences")
+
+    held_out = np.random.default_rng(0).random(len(words)) < args.holdout
+    train_idx, test_idx = np.flatnonzero(~held_out), np.flatnonzero(held_out)
+    model = train([words[i] for i in train_idx], labels[train_idx], counts[train_idx], args.bits, args.epochs)
+    if len(test_idx):
+        print(f"Held-out accuracy: {accuracy(model, [words[i] for i in test_idx], labels[test_idx], counts[test_idx]):.3f}")
+
+    # The shipped model is trained on every word
+    model = train(words, labels, counts, args.bits, args.epochs)
+    model.save(args.output)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) // 1024} KB)")
@@ -0,0 +1,66 @@
+from functools import lru_cache
+import os
+import pickle
+
+# Precompiled English word list used by utils.light_tagger
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "english_words.pkl")
+
+
+def build_lexicon(path=LEXICON_PATH, download=True):
+    """
+    Builds the precompiled lexicon from NLTK's `words` corpus. This is the only
+    place that touches NLTK; run it once (`python lexicon.py`) when building the
+    image or before deploying, and ship the output file.
+
+    Parameters:
+        path (str): Where to write the pickled frozenset.
+        download (bool): Download the corpus if needed. Without it, a corpus
+            that isn't installed raises LookupError.
+
+    Returns:
+        frozenset: The English words.
+    """
+    import nltk
+    from nltk.corpus import words
+
+    if download:
+        nltk.download('words', quiet=True)
+    english_words = frozenset(words.words())
+
+    # Write to a temporary file first so concurrent readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(english_words, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return english_words
+
+
+@lru_cache(maxsize=None)
+def get_english_words(path=LEXICON_PATH):
+    """
+    Loads the precompiled lexicon on first use and keeps it for the life of the
+    process, so every Streamlit session served by the process shares one copy.
+    If the file has not been generated it is built from an NLTK corpus that is
+    already installed, but never downloaded while serving.
+
+    Returns:
+        frozenset: The English words.
+
+    Raises:
+        FileNotFoundError: If there is neither the file nor an installed corpus.
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    try:
+        return build_lexicon(path, download=False)
+    except LookupError:
+        raise FileNotFoundError(
+            f"{path} is missing; run `python lexicon.py` once before starting the app to build it"
+        ) from None
+
+
+if __name__ == "__main__":
+    print(f"Wrote {len(build_lexicon())} words to {LEXICON_PATH}")
@@ -0,0 +1,257 @@
+"""
+Lightweight instrumentation of Firestore and OpenAI calls.
+
+Every backend call is wrapped in `track(backend, operation)`, which measures
+its wall-clock latency and records the documents read and written and the
+bytes moved. Each record goes to two places:
+
+- the process-wide `registry`, aggregated per page, backend and operation,
+  which can be rendered as Prometheus text;
+- the current rerun, so the admin panel can show what the last script run
+  cost. The rerun is held in a context variable; work handed to other threads
+  is attributed to it only if it is run with `contextvars.copy_context()`,
+  otherwise it is counted under the "background" page.
+
+Set METRICS_LOG to a file path to also append every finished rerun to it as
+one JSON line.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+import json
+import os
+import threading
+import time
+
+METRICS_LOG = os.environ.get("METRICS_LOG")
+METRIC_PREFIX = "promptcorrector"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BACKGROUND_PAGE = "background"
+
+_current_rerun = ContextVar("current_rerun", default=None)
+_log_lock = threading.Lock()
+
+
+def value_size(value):
+    """
+    Approximate storage size of a Firestore value, following Firestore's
+    document size rules.
+    """
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime, date)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key.encode("utf-8")) + 1 + value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) for item in value)
+    return len(str(value).encode("utf-8")) + 1
+
+
+def document_size(doc_id, data):
+    # Document name + fields + 32 bytes of overhead
+    return len(doc_id.encode("utf-8")) + 1 + (value_size(data) if data else 0) + 32
+
+
+class Operation:
+    """
+    One backend call. The caller fills in what the call cost while it runs.
+    """
+
+    __slots__ = ("backend", "operation", "reads", "writes", "bytes", "seconds", "error")
+
+    def __init__(self, backend, operation):
+        self.backend = backend
+        self.operation = operation
+        self.reads = 0
+        self.writes = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error = False
+
+
+class Rerun:
+    """
+    The operations of one script run of one session.
+
+    Parameters:
+        page (str): Page being rendered.
+        username (str): The signed-in reviewer, if any.
+    """
+
+    def __init__(self, page, username=None):
+        self.page = page
+        self.username = username
+        self.started_at = time.time()
+        self.finished_at = None
+        self.operations = []
+        self._lock = threading.Lock()
+
+    def add(self, operation):
+        with self._lock:
+            self.operations.append(operation)
+
+    def totals(self):
+        """
+        Returns:
+            list: One dict per (backend, operation) with calls, reads, writes,
+                bytes and seconds summed.
+        """
+        with self._lock:
+            operations = list(self.operations)
+        totals = {}
+        for op in operations:
+            row = totals.setdefault((op.backend, op.operation), {
+                "backend": op.backend, "operation": op.operation,
+                "calls": 0, "reads": 0, "writes": 0, "bytes": 0, "seconds": 0.0, "errors": 0,
+            })
+            row["calls"] += 1
+            row["reads"] += op.reads
+            row["writes"] += op.writes
+            row["bytes"] += op.bytes
+            row["seconds"] += op.seconds
+            row["errors"] += op.error
+        return list(totals.values())
+
+    def as_dict(self):
+        return {
+            "page": self.page,
+            "username": self.username,
+            "started_at": self.started_at,
+            "duration": (self.finished_at or time.time()) - self.started_at,
+            "operations": self.totals(),
+        }
+
+
+class Registry:
+    """
+    Process-wide totals per (page, backend, operation).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = defaultdict(lambda: {
+            "calls": 0, "reads": 0, "writes": 0, "bytes": 0, "errors": 0,
+            "seconds": 0.0, "buckets": [0] * len(LATENCY_BUCKETS),
+        })
+
+    def record(self, page, operation):
+        with self._lock:
+            series = self._series[(page, operation.backend, operation.operation)]
+            series["calls"] += 1
+            series["reads"] += operation.reads
+            series["writes"] += operation.writes
+            series["bytes"] += operation.bytes
+            series["errors"] += operation.error
+            series["seconds"] += operation.seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if operation.seconds <= bound:
+                    series["buckets"][i] += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            list: One dict per (page, backend, operation) with the running totals.
+        """
+        with self._lock:
+            return [
+                {"page": page, "backend": backend, "operation": operation,
+                 **{key: value for key, value in series.items() if key != "buckets"}}
+                for (page, backend, operation), series in sorted(self._series.items())
+            ]
+
+    def prometheus_text(self):
+        """
+        Renders the totals in the Prometheus text exposition format.
+        """
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._series.items())
+
+        def labels(page, backend, operation, **extra):
+            pairs = {"page": page, "backend": backend, "operation": operation, **extra}
+            return ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs.items())
+
+        lines = []
+        for name, field, help_text in (
+            ("operations_total", "calls", "Backend calls."),
+            ("document_reads_total", "reads", "Documents read (billed reads)."),
+            ("document_writes_total", "writes", "Documents written."),
+            ("bytes_total", "bytes", "Approximate bytes moved."),
+            ("errors_total", "errors", "Backend calls that raised."),
+        ):
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for key, value in series:
+                lines.append(f"{metric}{{{labels(*key)}}} {value[field]}")
+
+        metric = f"{METRIC_PREFIX}_latency_seconds"
+        lines += [f"# HELP {metric} Wall-clock latency of backend calls.", f"# TYPE {metric} histogram"]
+        for key, value in series:
+            for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                lines.append(f"{metric}_bucket{{{labels(*key, le=bound)}}} {count}")
+            lines.append(f"{metric}_bucket{{{labels(*key, le='+Inf')}}} {value['calls']}")
+            lines.append(f"{metric}_sum{{{labels(*key)}}} {value['seconds']}")
+            lines.append(f"{metric}_count{{{labels(*key)}}} {value['calls']}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+
+
+@contextmanager
+def track(backend, operation):
+    """
+    Times a backend call and records it. The caller sets `reads`, `writes`
+    and `bytes` on the yielded Operation.
+
+        with track("firestore", "count_reviews") as op:
+            ...
+            op.reads = 1
+    """
+    op = Operation(backend, operation)
+    start = time.perf_counter()
+    try:
+        yield op
+    except BaseException:
+        op.error = True
+        raise
+    finally:
+        op.seconds = time.perf_counter() - start
+        rerun = _current_rerun.get()
+        if rerun is not None:
+            rerun.add(op)
+        registry.record(rerun.page if rerun is not None else BACKGROUND_PAGE, op)
+
+
+def start_rerun(page, username=None, previous=None):
+    """
+    Starts recording a new script run in the current context. The session's
+    previous run, if given, is finished and logged first; it is done by now
+    even if it ended with st.rerun() or st.stop().
+
+    Returns:
+        Rerun: The new run.
+    """
+    if previous is not None and previous.finished_at is None:
+        finish_rerun(previous)
+    rerun = Rerun(page, username)
+    _current_rerun.set(rerun)
+    return rerun
+
+
+def finish_rerun(rerun):
+    rerun.finished_at = time.time()
+    if METRICS_LOG:
+        line = json.dumps(rerun.as_dict())
+        with _log_lock, open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
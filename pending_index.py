@@ -0,0 +1,94 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import random
+import threading
+
+from storage import lease_is_free
+
+# Fields kept per pending item; enough to pick and filter candidates
+INDEX_FIELDS = ("Status", "claimed_by", "lease_expires", "domain")
+
+
+class PendingIndex:
+    """
+    Process-wide index of the pending review items.
+
+    One watch on the store (a Firestore snapshot listener in production)
+    keeps the index current, and every session picks its candidates from it
+    instead of querying the store itself. Reads then grow with the number of
+    changes to pending items, not with the number of sessions and reruns.
+
+    Only the fields in INDEX_FIELDS are kept, so the index stays small; the
+    full document is read when an item is claimed.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._by_domain = defaultdict(dict)  # Insertion-ordered sets of doc IDs
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = None
+
+    def start(self, store, limit=None):
+        """
+        Starts following the store's pending items.
+
+        Parameters:
+            store (ReviewStore): The review store.
+            limit (int): Follow at most this many pending items.
+        """
+        self._stop = store.watch_pending(self.apply, limit)
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop()
+            self._stop = None
+
+    @property
+    def ready(self):
+        # True once the first snapshot has arrived
+        return self._ready.is_set()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def apply(self, changes):
+        """
+        Applies a list of (doc_id, data) changes; data is None for items that
+        are no longer pending.
+        """
+        with self._lock:
+            for doc_id, data in changes:
+                before = self._items.pop(doc_id, None)
+                if before is not None:
+                    self._by_domain[before.get("domain")].pop(doc_id, None)
+                if data is not None and data.get("Status") == "pending":
+                    item = {field: data.get(field) for field in INDEX_FIELDS}
+                    self._items[doc_id] = item
+                    self._by_domain[item["domain"]][doc_id] = None
+        self._ready.set()
+
+    def domains(self):
+        with self._lock:
+            return sorted(domain for domain, doc_ids in self._by_domain.items() if domain and doc_ids)
+
+    def candidates(self, username, limit, domain=None):
+        """
+        Returns up to `limit` items the reviewer could claim, picked at random
+        so concurrent sessions spread out.
+
+        Parameters:
+            username (str): The reviewer.
+            limit (int): Number of candidates.
+            domain (str): Only return items of this domain.
+
+        Returns:
+            list: (doc_id, data) pairs.
+        """
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            doc_ids = self._by_domain.get(domain, {}) if domain is not None else self._items
+            free = [(doc_id, dict(self._items[doc_id])) for doc_id in doc_ids
+                    if lease_is_free(self._items[doc_id], username, now)]
+        return random.sample(free, min(limit, len(free)))
@@ -0,0 +1,104 @@
+from collections import deque
+import contextvars
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchQueue:
+    """
+    Per-session buffer of pending review items.
+
+    Candidates are fetched a batch at a time and handed out from memory. Each
+    item is claimed just before it is served, which is also where items that
+    another reviewer took in the meantime get dropped. When the buffer runs
+    below `low_water` it is refilled on a background thread, so the next item
+    is usually ready by the time the reviewer submits.
+
+    Candidates that still carry a lease (`claimed_by`) and were already handed
+    out by this queue are dropped: they are the reviewer's own leases on items
+    that are on screen, not new work. Once a review or undo releases the lease,
+    the item can be served again.
+
+    Parameters:
+        fetch (callable): Returns a list of (doc_id, data) candidates.
+        claim (callable): Takes a doc_id and returns the claimed data, or None if
+            the item is no longer available.
+        low_water (int): Buffer size below which a background refill starts.
+    """
+
+    # Synchronous refills tried before giving up when every candidate is taken
+    MAX_FILLS = 3
+
+    def __init__(self, fetch, claim, low_water=5):
+        self._fetch = fetch
+        self._claim = claim
+        self._low_water = low_water
+        self._items = deque()
+        # IDs handed out by next_item
+        self._served = set()
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def next_item(self):
+        """
+        Claims and returns the next item.
+
+        Returns:
+            tuple: (doc_id, data) or (None, None) if nothing is left to review.
+        """
+        fills = 0
+        while True:
+            with self._lock:
+                doc_id = self._items.popleft()[0] if self._items else None
+                if doc_id is not None:
+                    self._served.add(doc_id)
+
+            if doc_id is None:
+                if fills == self.MAX_FILLS or not self._fill():
+                    return None, None
+                fills += 1
+                continue
+
+            data = self._claim(doc_id)
+            if data is not None:
+                self._maybe_refill()
+                return doc_id, data
+
+    def _fill(self):
+        # Wait for a refill that is already running rather than issuing a second query
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+            with self._lock:
+                if self._items:
+                    return True
+        return self._add(self._fetch()) > 0
+
+    def _add(self, candidates):
+        with self._lock:
+            queued = {doc_id for doc_id, _ in self._items}
+            new = [(doc_id, data) for doc_id, data in candidates if doc_id not in queued
+                   and not (doc_id in self._served and data.get("claimed_by") is not None)]
+            self._items.extend(new)
+            return len(new)
+
+    def _refill(self):
+        try:
+            self._add(self._fetch())
+        except Exception:
+            # The next synchronous fill will surface the error to the page
+            logger.warning("Prefetch refill failed", exc_info=True)
+
+    def _maybe_refill(self):
+        if len(self) >= self._low_water:
+            return
+        if self._refill_thread is not None and self._refill_thread.is_alive():
+            return
+        # The refill runs in a copy of the caller's context, so its reads are counted against the page that caused it
+        self._refill_thread = threading.Thread(target=contextvars.copy_context().run, args=(self._refill,), daemon=True)
+        self._refill_thread.start()
@@ -0,0 +1,193 @@
+"""
+Materialized review counts for the Analytics page.
+
+Counts of `stage_four_reviews` documents are kept per reviewer x Status x pulled
+in a handful of shard documents under `review_stats`. Every write that changes
+one of those three fields applies its +1/-1 to one randomly picked shard in the
+same transaction, so the Analytics page only has to read NUM_SHARDS documents
+and no single counter document becomes a write hot spot. Each shard also keeps
+a `generation` counter that goes up with every write; their sum is a cheap
+version of the data for caching.
+
+Run `python review_stats.py rebuild` to recompute the shards from the raw
+collection (e.g. after the first deploy, or if they ever drift).
+"""
+import argparse
+import random
+from collections import Counter
+
+from firebase_admin import firestore
+
+REVIEWS_COLLECTION = "stage_four_reviews"
+STATS_COLLECTION = "review_stats"
+NUM_SHARDS = 10
+
+
+def shard_ref(db, shard):
+    return db.collection(STATS_COLLECTION).document(f"shard_{shard}")
+
+
+def stats_key(record):
+    """
+    Returns the counter key for a review document, or None if there is no document.
+    Missing reviewers are counted as "unreviewed", like the Analytics page always did.
+    """
+    if record is None:
+        return None
+    reviewer = (record.get("reviewer") or "unreviewed").strip()
+    return f"{reviewer}|{record.get('Status')}|{bool(record.get('pulled', False))}"
+
+
+def parse_stats_key(key):
+    reviewer, status, pulled = key.rsplit("|", 2)
+    return reviewer, status, pulled == "True"
+
+
+def stats_delta(changes):
+    """
+    Computes the counter changes for a set of document writes.
+
+    Parameters:
+        changes (iterable): (before, after) pairs of document dicts, where before
+            is None for a new document.
+
+    Returns:
+        Counter: counter key -> change in count.
+    """
+    delta = Counter()
+    for before, after in changes:
+        before_key, after_key = stats_key(before), stats_key(after)
+        if before_key == after_key:
+            continue
+        if before_key is not None:
+            delta[before_key] -= 1
+        if after_key is not None:
+            delta[after_key] += 1
+    return delta
+
+
+def apply_stats_delta(writer, db, delta):
+    """
+    Adds a counter delta to one random shard.
+
+    Parameters:
+        writer: The transaction or write batch the document writes are part of.
+        db: Firestore client.
+        delta (Counter): Output of stats_delta.
+    """
+    increments = {key: firestore.Increment(change) for key, change in delta.items() if change}
+    if increments:
+        writer.set(shard_ref(db, random.randrange(NUM_SHARDS)),
+                   {"counts": increments, "generation": firestore.Increment(1)}, merge=True)
+
+
+def load_stats(db):
+    """
+    Sums the counter shards.
+
+    Returns:
+        tuple: (Counter of counter key -> number of documents, data generation).
+    """
+    counts = Counter()
+    generation = 0
+    for shard in db.collection(STATS_COLLECTION).stream():
+        data = shard.to_dict()
+        counts.update(data.get("counts", {}))
+        generation += data.get("generation", 0)
+    return counts, generation
+
+
+def stats_frame(counts):
+    """
+    Turns the output of load_stats into a DataFrame with reviewer, Status,
+    pulled and count columns.
+    """
+    import pandas as pd
+
+    rows = [(*parse_stats_key(key), count) for key, count in counts.items() if count > 0]
+    frame = pd.DataFrame(rows, columns=["reviewer", "Status", "pulled", "count"])
+    return frame.astype({"pulled": bool, "count": int})
+
+
+def rebuild_stats(db):
+    """
+    Recomputes the counter shards from the raw review collection. Reviews
+    saved while the rebuild is running may be missed, so run it when nobody
+    is reviewing.
+
+    Returns:
+        Counter: The recomputed counts.
+    """
+    counts = Counter()
+    docs = db.collection(REVIEWS_COLLECTION).select(["reviewer", "Status", "pulled"]).stream()
+    for doc in docs:
+        counts[stats_key(doc.to_dict())] += 1
+
+    # All of the counts go on the first shard; the others are reset.
+    # Generations keep counting up so cached renders of the old data are not reused
+    batch = db.batch()
+    for shard in range(NUM_SHARDS):
+        batch.set(shard_ref(db, shard),
+                  {"counts": dict(counts) if shard == 0 else {}, "generation": firestore.Increment(1)},
+                  merge=["counts"])
+    batch.commit()
+    return counts
+
+
+def analytics_summary(frame):
+    """
+    Computes the Analytics page tables from the output of stats_frame.
+    Pulled documents and rejections are left out.
+
+    Returns:
+        tuple: (approve/edit/... counts per reviewer sorted by approves + edits,
+            total per reviewer, number of unreviewed prompts).
+    """
+    frame = frame[~frame["pulled"]]
+    reviewed = frame[(frame["reviewer"] != "unreviewed") & (frame["Status"] != "reject")]
+    status_count = reviewed.pivot_table(index="reviewer", columns="Status", values="count", aggfunc="sum", fill_value=0)
+    progress = status_count[[status for status in ("approve", "edit") if status in status_count]].sum(axis=1)
+    status_count = status_count.loc[progress.sort_values(kind="stable").index]
+
+    reviewer_counts = reviewed.groupby("reviewer")["count"].sum().sort_values(ascending=False)
+    unreviewed = frame[(frame["reviewer"] == "unreviewed") & (frame["Status"] != "reject")]["count"].sum()
+    return status_count, reviewer_counts, int(unreviewed)
+
+
+def render_status_chart(status_count):
+    """
+    Draws the stacked "Review Status by Reviewer" bar chart.
+
+    Returns:
+        bytes: The chart as a PNG.
+    """
+    import io
+    # A bare Figure is never registered with pyplot, so nothing is left open after rendering
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    status_count.plot(kind='barh', stacked=True, ax=ax)
+
+    # Add titles and labels
+    ax.set_title("Review Status by Reviewer", fontsize=16)
+    ax.set_ylabel("Reviewer", fontsize=12)
+    ax.set_xlabel("Number of Reviews", fontsize=12)
+    ax.tick_params(axis="x", labelrotation=0)
+    ax.legend(title="Status", fontsize=10)
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the materialized review stats.")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    from firebase_setup import get_db
+
+    counts = rebuild_stats(get_db())
+    print(f"Rebuilt review stats from {sum(counts.values())} documents")
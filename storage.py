@@ -0,0 +1,848 @@
+"""
+Storage backends for review documents.
+
+The apps talk to a ReviewStore instead of Firestore directly. Three backends
+implement it:
+
+- FirestoreStore: the production backend (one Firestore collection).
+- SQLiteStore: a local database file with indexes on Status, reviewer and
+  Timestamp, for offline runs, load tests and benchmarks.
+- MemoryStore: plain dicts with the same secondary indexes, for tests and
+  throwaway sessions.
+
+The backend is picked with the REVIEW_STORE environment variable:
+
+    REVIEW_STORE=firestore            (default)
+    REVIEW_STORE=sqlite:///reviews.db
+    REVIEW_STORE=memory
+
+Documents are plain dicts with the Firestore field names (Status, reviewer,
+pulled, Timestamp, ...). Every store keeps the review_stats counters current
+on writes when `stats` is on.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import json
+import os
+import sqlite3
+import threading
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from metrics import document_size, track
+from review_stats import NUM_SHARDS, apply_stats_delta, load_stats, stats_delta
+
+DEFAULT_STORE_URL = "firestore"
+
+
+class LeaseLostError(Exception):
+    """Raised when a review is submitted for an item that is no longer leased to the reviewer."""
+
+
+# Function to check whether a pending item can be claimed by the reviewer
+def lease_is_free(data, username, now):
+    expires = data.get("lease_expires")
+    return data.get("claimed_by") in (None, username) or expires is None or expires < now
+
+
+def check_lease(doc_id, before, lease_holder):
+    # A submit only counts if the item is still pending and nobody else has claimed it since.
+    # Without a lease to check, a missing document is a plain KeyError in every store
+    if lease_holder is None:
+        if before is None:
+            raise KeyError(doc_id)
+        return
+    if before is None or before.get("Status") != "pending" or before.get("claimed_by") != lease_holder:
+        raise LeaseLostError(doc_id)
+
+
+def with_lease_fields(fields):
+    # The fields lease_is_free needs, added to a projection
+    return list(dict.fromkeys([*fields, "claimed_by", "lease_expires"]))
+
+
+def project(data, fields):
+    # Same shape as a Firestore select(): only the requested fields that the document has
+    if fields is None:
+        return dict(data)
+    return {field: data[field] for field in fields if field in data}
+
+
+def time_key(value):
+    """
+    Sortable UTC ISO string for a timestamp. Naive datetimes are taken as UTC,
+    which is what datetime.utcnow() gives.
+    """
+    if value is None:
+        return None
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    return value.isoformat(timespec="microseconds")
+
+
+class ReviewStore:
+    """
+    Interface of the review document stores.
+
+    Cursors returned by review_history are opaque; pass them back unchanged to
+    get the next page.
+    """
+
+    def pending_candidates(self, limit, fields=None, domain=None, username=None):
+        """
+        Parameters:
+            limit (int): Number of candidates.
+            fields (list): Fields to return, or None for whole documents.
+            domain (str): Only return items of this domain.
+            username (str): Only return items this reviewer could claim (see
+                lease_is_free). Items leased to others are paged past, so they
+                don't use up `limit`.
+
+        Returns:
+            list: Up to `limit` (doc_id, data) pairs with Status "pending".
+        """
+        raise NotImplementedError
+
+    def claim(self, doc_id, username, lease_seconds):
+        """
+        Leases a pending item to the reviewer.
+
+        Returns:
+            dict: The document with the lease applied, or None if the item is no
+                longer pending, leased to someone else, or lost to a concurrent claim.
+        """
+        raise NotImplementedError
+
+    def write_review(self, doc_id, changes, lease_holder=None):
+        """
+        Applies `changes` to a document and updates the counters.
+
+        Parameters:
+            lease_holder (str): If given, the write only happens if the item is
+                still pending and leased to this reviewer; LeaseLostError otherwise.
+
+        Raises:
+            KeyError: If the document doesn't exist and no lease_holder is given.
+        """
+        raise NotImplementedError
+
+    def write_reviews(self, reviews, lease_holder=None):
+        """
+        Applies several reviews in one atomic write, with one counter update.
+
+        Parameters:
+            reviews (list): (doc_id, changes) pairs.
+            lease_holder (str): If given, reviews of items that are no longer
+                pending and leased to this reviewer are left out.
+
+        Returns:
+            list: IDs of the reviews left out because their lease was lost.
+
+        Raises:
+            KeyError: If a document doesn't exist and no lease_holder is given;
+                nothing is written then.
+        """
+        raise NotImplementedError
+
+    def count_reviews(self, username, statuses=None):
+        """
+        Returns:
+            int: Number of documents reviewed by `username`, optionally only those
+                with a Status in `statuses`.
+        """
+        raise NotImplementedError
+
+    def review_history(self, username, limit, start_after=None, fields=None):
+        """
+        One page of the reviewer's unpulled documents, newest Timestamp first.
+        Documents without a Timestamp are left out. `fields` limits the returned
+        fields as for pending_candidates.
+
+        Returns:
+            tuple: (list of (doc_id, data) pairs, cursor for the next page or None).
+        """
+        raise NotImplementedError
+
+    def load_stats(self):
+        """
+        Returns:
+            tuple: (Counter of review_stats counter key -> count, data generation).
+        """
+        raise NotImplementedError
+
+    def create_prompts(self, chunk):
+        """
+        Creates the (doc_id, data) pairs of a chunk that don't exist yet, all or nothing.
+
+        Returns:
+            int: Number of rows skipped because their document already exists.
+        """
+        raise NotImplementedError
+
+    def get_upload_job(self, job_id):
+        """
+        Returns:
+            dict: The saved upload job, or None.
+        """
+        raise NotImplementedError
+
+    def watch_pending(self, callback, limit=None):
+        """
+        Follows the pending items. `callback` is first called with every
+        pending item and then with every change, as a list of (doc_id, data)
+        pairs where data is None for an item that is no longer pending. It may
+        be called from another thread.
+
+        Parameters:
+            callback (callable): Takes the list of changes.
+            limit (int): Follow at most this many pending items.
+
+        Returns:
+            callable: Stops watching.
+        """
+        raise NotImplementedError
+
+    def update_upload_job(self, job_id, fields):
+        """Merges `fields` into the upload job, creating it if needed."""
+        raise NotImplementedError
+
+
+# Function to claim a pending item for the reviewer in a transaction
+@firestore.transactional
+def claim_text(transaction, doc_ref, username, lease_seconds):
+    data = doc_ref.get(transaction=transaction).to_dict()
+    now = datetime.now(timezone.utc)
+    if data is None or data.get("Status") != "pending" or not lease_is_free(data, username, now):
+        return None
+    lease = {"claimed_by": username, "lease_expires": now + timedelta(seconds=lease_seconds)}
+    transaction.update(doc_ref, lease)
+    data.update(lease)
+    return data
+
+
+# Function to update a review document and, optionally, the analytics counters in one transaction
+@firestore.transactional
+def write_review(transaction, db, doc_ref, changes, lease_holder=None, stats=True):
+    before = doc_ref.get(transaction=transaction).to_dict()
+    check_lease(doc_ref.id, before, lease_holder)
+    transaction.update(doc_ref, changes)
+    if stats:
+        apply_stats_delta(transaction, db, stats_delta([(before, {**before, **changes})]))
+
+
+# Function to update several review documents and the analytics counters in one transaction
+@firestore.transactional
+def write_reviews(transaction, db, collection, reviews, lease_holder=None, stats=True):
+    refs = [collection.document(doc_id) for doc_id, _ in reviews]
+    before = {snapshot.id: snapshot.to_dict() for snapshot in transaction.get_all(refs)}
+    lost = []
+    changed = []
+    for ref, (doc_id, changes) in zip(refs, reviews):
+        try:
+            check_lease(doc_id, before.get(doc_id), lease_holder)
+        except LeaseLostError:
+            lost.append(doc_id)
+            continue
+        transaction.update(ref, changes)
+        changed.append((before[doc_id], {**before[doc_id], **changes}))
+    if stats and changed:
+        apply_stats_delta(transaction, db, stats_delta(changed))
+    return lost
+
+
+# Function to create the documents of a chunk that don't exist yet, with their counters, in one transaction
+@firestore.transactional
+def write_prompts(transaction, db, collection, chunk, stats=True):
+    refs = [collection.document(doc_id) for doc_id, _ in chunk]
+    existing = {snapshot.id for snapshot in transaction.get_all(refs) if snapshot.exists}
+    for ref, (doc_id, data) in zip(refs, chunk):
+        if doc_id not in existing:
+            transaction.create(ref, data)
+    if stats:
+        apply_stats_delta(transaction, db, stats_delta((None, data) for doc_id, data in chunk if doc_id not in existing))
+    return len(existing)
+
+
+class FirestoreStore(ReviewStore):
+    """
+    Parameters:
+        db: Firestore client.
+        collection (str): Collection of review documents.
+        stats (bool): Keep the review_stats counter shards current on writes.
+    """
+
+    def __init__(self, db, collection="stage_four_reviews", stats=True):
+        self.db = db
+        self.collection = collection
+        self.stats = stats
+
+    def _ref(self, doc_id):
+        return self.db.collection(self.collection).document(doc_id)
+
+    def pending_candidates(self, limit, fields=None, domain=None, username=None):
+        with track("firestore", "pending_candidates") as op:
+            query = self.db.collection(self.collection).where("Status", "==", "pending")
+            if domain is not None:
+                query = query.where("domain", "==", domain)
+            # Ordered by ID so pages of leased items can be skipped with a cursor
+            query = query.order_by(FieldPath.document_id()).limit(limit)
+            if fields is not None:
+                query = query.select(with_lease_fields(fields) if username is not None else fields)
+            now = datetime.now(timezone.utc)
+            candidates = []
+            op.reads = 0
+            last_doc = None
+            while True:
+                docs = list((query.start_after(last_doc) if last_doc is not None else query).stream())
+                # A query is billed at least one read even when it returns nothing
+                op.reads += max(len(docs), 1)
+                page = [(doc.id, doc.to_dict()) for doc in docs]
+                if username is not None:
+                    page = [(doc_id, project(data, fields)) for doc_id, data in page if lease_is_free(data, username, now)]
+                candidates.extend(page)
+                if username is None or len(candidates) >= limit or len(docs) < limit:
+                    break
+                last_doc = docs[-1]
+            candidates = candidates[:limit]
+            op.bytes = sum(document_size(doc_id, data) for doc_id, data in candidates)
+        return candidates
+
+    def claim(self, doc_id, username, lease_seconds):
+        with track("firestore", "claim") as op:
+            op.reads = 1
+            try:
+                # A claim that loses a race is abandoned rather than retried
+                data = claim_text(self.db.transaction(max_attempts=1), self._ref(doc_id), username, lease_seconds)
+            except ValueError:
+                return None
+            if data is not None:
+                op.writes = 1
+                op.bytes = document_size(doc_id, data)
+            return data
+
+    def write_review(self, doc_id, changes, lease_holder=None):
+        with track("firestore", "write_review") as op:
+            op.reads = 1
+            write_review(self.db.transaction(), self.db, self._ref(doc_id), changes, lease_holder, self.stats)
+            op.writes = 2 if self.stats else 1
+            op.bytes = document_size(doc_id, changes)
+
+    def write_reviews(self, reviews, lease_holder=None):
+        with track("firestore", "write_reviews") as op:
+            op.reads = len(reviews)
+            lost = write_reviews(self.db.transaction(), self.db, self.db.collection(self.collection),
+                                 reviews, lease_holder, self.stats)
+            written = len(reviews) - len(lost)
+            op.writes = written + (1 if self.stats and written else 0)
+            op.bytes = sum(document_size(doc_id, changes) for doc_id, changes in reviews)
+        return lost
+
+    def count_reviews(self, username, statuses=None):
+        with track("firestore", "count_reviews") as op:
+            # Server-side aggregation: Firestore returns the count, not the documents
+            query = self.db.collection(self.collection).where("reviewer", "==", username)
+            if statuses is not None:
+                query = query.where("Status", "in", list(statuses))
+            count = query.count().get()[0][0].value
+            # Aggregations are billed one read per 1000 index entries counted
+            op.reads = max((count + 999) // 1000, 1)
+        return count
+
+    def review_history(self, username, limit, start_after=None, fields=None):
+        with track("firestore", "review_history") as op:
+            # Filtering, ordering and the limit all happen in Firestore, so a page costs `limit` reads
+            query = (
+                self.db.collection(self.collection)
+                .where("reviewer", "==", username)
+                .where("pulled", "==", False)
+                .order_by("Timestamp", direction=firestore.Query.DESCENDING)
+                .limit(limit)
+            )
+            if fields is not None:
+                # The Timestamp is kept so the snapshot can serve as the next page's cursor
+                query = query.select(list(dict.fromkeys([*fields, "Timestamp"])))
+            if start_after is not None:
+                query = query.start_after(start_after)
+            docs = list(query.stream())
+            history = [(doc.id, doc.to_dict()) for doc in docs]
+            op.reads = max(len(history), 1)
+            op.bytes = sum(document_size(doc_id, data) for doc_id, data in history)
+        return history, (docs[-1] if docs else None)
+
+    def load_stats(self):
+        with track("firestore", "load_stats") as op:
+            op.reads = NUM_SHARDS
+            return load_stats(self.db)
+
+    def create_prompts(self, chunk):
+        with track("firestore", "create_prompts") as op:
+            op.reads = len(chunk)
+            skipped = write_prompts(self.db.transaction(), self.db, self.db.collection(self.collection), chunk, self.stats)
+            created = len(chunk) - skipped
+            op.writes = created + (1 if self.stats and created else 0)
+            op.bytes = sum(document_size(doc_id, data) for doc_id, data in chunk)
+        return skipped
+
+    def get_upload_job(self, job_id):
+        with track("firestore", "get_upload_job") as op:
+            op.reads = 1
+            snapshot = self.db.collection("upload_jobs").document(job_id).get()
+            return snapshot.to_dict() if snapshot.exists else None
+
+    def update_upload_job(self, job_id, fields):
+        with track("firestore", "update_upload_job") as op:
+            op.writes = 1
+            op.bytes = document_size(job_id, fields)
+            self.db.collection("upload_jobs").document(job_id).set(fields, merge=True)
+
+    def watch_pending(self, callback, limit=None):
+        query = self.db.collection(self.collection).where("Status", "==", "pending")
+        if limit is not None:
+            # Items that leave the window are backfilled by the listener
+            query = query.limit(limit)
+
+        def on_snapshot(docs, changes, read_time):
+            # Runs on the listener's thread; every changed document is one billed read
+            with track("firestore", "pending_snapshot") as op:
+                op.reads = len(changes)
+                callback([
+                    (change.document.id, None if change.type.name == "REMOVED" else change.document.to_dict())
+                    for change in changes
+                ])
+
+        return query.on_snapshot(on_snapshot).unsubscribe
+
+
+class MemoryStore(ReviewStore):
+    """
+    Keeps everything in dicts, with secondary indexes on Status and reviewer so
+    the pending and per-reviewer queries don't scan every document.
+
+    Parameters:
+        stats (bool): Keep review counters (see review_stats) on writes.
+    """
+
+    def __init__(self, stats=True):
+        self.stats = stats
+        self._docs = {}
+        self._by_status = defaultdict(dict)  # Insertion-ordered sets of doc IDs
+        self._by_reviewer = defaultdict(dict)
+        self._counts = Counter()
+        self._generation = 0
+        self._jobs = {}
+        self._watchers = []
+        self._lock = threading.RLock()
+
+    def _put(self, doc_id, data):
+        before = self._docs.get(doc_id)
+        if before is not None:
+            self._by_status[before.get("Status")].pop(doc_id, None)
+            self._by_reviewer[before.get("reviewer")].pop(doc_id, None)
+        self._docs[doc_id] = data
+        self._by_status[data.get("Status")][doc_id] = None
+        self._by_reviewer[data.get("reviewer")][doc_id] = None
+        if self._watchers and (before is not None and before.get("Status") == "pending" or data.get("Status") == "pending"):
+            change = [(doc_id, dict(data) if data.get("Status") == "pending" else None)]
+            for watcher in self._watchers:
+                watcher(change)
+
+    def _apply_stats(self, changes):
+        if self.stats:
+            self._counts.update(stats_delta(changes))
+            self._generation += 1
+
+    def pending_candidates(self, limit, fields=None, domain=None, username=None):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            pending = (doc_id for doc_id in self._by_status["pending"]
+                       if (domain is None or self._docs[doc_id].get("domain") == domain)
+                       and (username is None or lease_is_free(self._docs[doc_id], username, now)))
+            return [(doc_id, project(self._docs[doc_id], fields)) for doc_id in islice(pending, limit)]
+
+    def claim(self, doc_id, username, lease_seconds):
+        with self._lock:
+            data = self._docs.get(doc_id)
+            now = datetime.now(timezone.utc)
+            if data is None or data.get("Status") != "pending" or not lease_is_free(data, username, now):
+                return None
+            data = {**data, "claimed_by": username, "lease_expires": now + timedelta(seconds=lease_seconds)}
+            self._put(doc_id, data)
+            return dict(data)
+
+    def write_review(self, doc_id, changes, lease_holder=None):
+        with self._lock:
+            before = self._docs.get(doc_id)
+            check_lease(doc_id, before, lease_holder)
+            after = {**before, **changes}
+            self._put(doc_id, after)
+            self._apply_stats([(before, after)])
+
+    def write_reviews(self, reviews, lease_holder=None):
+        with self._lock:
+            lost = []
+            changed = []
+            for doc_id, changes in reviews:
+                before = self._docs.get(doc_id)
+                try:
+                    check_lease(doc_id, before, lease_holder)
+                except LeaseLostError:
+                    lost.append(doc_id)
+                    continue
+                changed.append((doc_id, before, {**before, **changes}))
+            # Checked in full before anything is written, so a missing document leaves no partial batch
+            for doc_id, _, after in changed:
+                self._put(doc_id, after)
+            if changed:
+                self._apply_stats([(before, after) for _, before, after in changed])
+            return lost
+
+    def count_reviews(self, username, statuses=None):
+        with self._lock:
+            doc_ids = self._by_reviewer.get(username, {})
+            if statuses is None:
+                return len(doc_ids)
+            return sum(1 for doc_id in doc_ids if self._docs[doc_id].get("Status") in statuses)
+
+    def review_history(self, username, limit, start_after=None, fields=None):
+        with self._lock:
+            entries = [
+                ((time_key(data.get("Timestamp")), doc_id), data)
+                for doc_id, data in ((doc_id, self._docs[doc_id]) for doc_id in self._by_reviewer.get(username, {}))
+                if data.get("Timestamp") is not None and not data.get("pulled", False)
+            ]
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        if start_after is not None:
+            entries = [entry for entry in entries if entry[0] < start_after]
+        page = entries[:limit]
+        return [(key[1], project(data, fields)) for key, data in page], (page[-1][0] if page else None)
+
+    def load_stats(self):
+        with self._lock:
+            return Counter(self._counts), self._generation
+
+    def create_prompts(self, chunk):
+        with self._lock:
+            new = [(doc_id, dict(data)) for doc_id, data in chunk if doc_id not in self._docs]
+            for doc_id, data in new:
+                self._put(doc_id, data)
+            self._apply_stats([(None, data) for _, data in new])
+            return len(chunk) - len(new)
+
+    def get_upload_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update_upload_job(self, job_id, fields):
+        with self._lock:
+            self._jobs.setdefault(job_id, {}).update(fields)
+
+    def watch_pending(self, callback, limit=None):
+        with self._lock:
+            callback([(doc_id, dict(self._docs[doc_id])) for doc_id in islice(self._by_status["pending"], limit)])
+            self._watchers.append(callback)
+
+        def stop():
+            with self._lock:
+                self._watchers.remove(callback)
+        return stop
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def decode_object(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def dumps(data):
+    return json.dumps(data, default=encode_value, ensure_ascii=False)
+
+
+def loads(text):
+    return json.loads(text, object_hook=decode_object)
+
+
+class SQLiteStore(ReviewStore):
+    """
+    Stores documents as JSON in a SQLite file. Status, reviewer, pulled and
+    Timestamp are copied into indexed columns so the app's queries are index
+    lookups.
+
+    Parameters:
+        path (str): Database file, or ":memory:".
+        collection (str): Collection of review documents; one file can hold several.
+        stats (bool): Keep review counters (see review_stats) on writes.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS documents (
+        collection TEXT NOT NULL,
+        id TEXT NOT NULL,
+        status TEXT,
+        reviewer TEXT,
+        pulled INTEGER NOT NULL DEFAULT 0,
+        timestamp TEXT,
+        data TEXT NOT NULL,
+        PRIMARY KEY (collection, id)
+    );
+    CREATE INDEX IF NOT EXISTS documents_status ON documents (collection, status);
+    CREATE INDEX IF NOT EXISTS documents_reviewer ON documents (collection, reviewer, status);
+    CREATE INDEX IF NOT EXISTS documents_history ON documents (collection, reviewer, pulled, timestamp, id);
+    CREATE TABLE IF NOT EXISTS stats (
+        collection TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (collection, key)
+    );
+    CREATE TABLE IF NOT EXISTS stats_generation (
+        collection TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS upload_jobs (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path, collection="stage_four_reviews", stats=True):
+        self.collection = collection
+        self.stats = stats
+        # Watchers only see writes made through this store object, i.e. by this process
+        self._watchers = []
+        self._changes = []
+        # One connection shared by all sessions of the process; the lock serializes its use
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.RLock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._changes.clear()
+                raise
+            self._conn.execute("COMMIT")
+            # Watchers hear about pending items only once the write is committed
+            changes, self._changes = self._changes, []
+            if changes:
+                for watcher in self._watchers:
+                    watcher(changes)
+
+    def _get(self, conn, doc_id):
+        row = conn.execute("SELECT data FROM documents WHERE collection = ? AND id = ?",
+                           (self.collection, doc_id)).fetchone()
+        return loads(row[0]) if row else None
+
+    def _put(self, conn, doc_id, data, before=None):
+        if self._watchers and (before is not None and before.get("Status") == "pending" or data.get("Status") == "pending"):
+            self._changes.append((doc_id, dict(data) if data.get("Status") == "pending" else None))
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (collection, id, status, reviewer, pulled, timestamp, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.collection, doc_id, data.get("Status"), data.get("reviewer"), int(bool(data.get("pulled", False))),
+             time_key(data.get("Timestamp")), dumps(data))
+        )
+
+    def _apply_stats(self, conn, changes):
+        if not self.stats:
+            return
+        for key, change in stats_delta(changes).items():
+            if change:
+                conn.execute(
+                    "INSERT INTO stats (collection, key, count) VALUES (?, ?, ?) "
+                    "ON CONFLICT (collection, key) DO UPDATE SET count = count + excluded.count",
+                    (self.collection, key, change)
+                )
+        conn.execute(
+            "INSERT INTO stats_generation (collection, generation) VALUES (?, 1) "
+            "ON CONFLICT (collection) DO UPDATE SET generation = generation + 1",
+            (self.collection,)
+        )
+
+    def _data_sql(self, fields):
+        """
+        Returns the SQL expression for a document's data and its parameters.
+        With fields, only those are extracted from the JSON, so the rest is
+        never decoded.
+        """
+        if fields is None:
+            return "data", []
+        pairs = ", ".join("?, json_extract(data, ?)" for _ in fields)
+        params = [value for field in fields for value in (field, f'$."{field}"')]
+        # Fields the document doesn't have come back as null; they are dropped below
+        return f"json_object({pairs})", params
+
+    def _project(self, data, fields):
+        data = loads(data)
+        if fields is None:
+            return data
+        return {field: value for field, value in data.items() if value is not None}
+
+    def pending_candidates(self, limit, fields=None, domain=None, username=None):
+        query_fields = with_lease_fields(fields) if username is not None and fields is not None else fields
+        data_sql, params = self._data_sql(query_fields)
+        sql = f"SELECT id, {data_sql} FROM documents WHERE collection = ? AND status = 'pending'"
+        params += [self.collection]
+        if domain is not None:
+            sql += " AND json_extract(data, '$.domain') = ?"
+            params.append(domain)
+        if username is None:
+            with self._lock:
+                rows = self._conn.execute(sql + " LIMIT ?", (*params, limit)).fetchall()
+            return [(doc_id, self._project(data, fields)) for doc_id, data in rows]
+
+        # Leases live in the JSON, so pages of items leased to others are skipped by ID
+        now = datetime.now(timezone.utc)
+        candidates = []
+        last_id = ""
+        while len(candidates) < limit:
+            with self._lock:
+                rows = self._conn.execute(sql + " AND id > ? ORDER BY id LIMIT ?", (*params, last_id, limit)).fetchall()
+            for doc_id, data in rows:
+                data = self._project(data, query_fields)
+                if lease_is_free(data, username, now):
+                    candidates.append((doc_id, project(data, fields)))
+            if len(rows) < limit:
+                break
+            last_id = rows[-1][0]
+        return candidates[:limit]
+
+    def claim(self, doc_id, username, lease_seconds):
+        with self._transaction() as conn:
+            data = self._get(conn, doc_id)
+            now = datetime.now(timezone.utc)
+            if data is None or data.get("Status") != "pending" or not lease_is_free(data, username, now):
+                return None
+            data.update({"claimed_by": username, "lease_expires": now + timedelta(seconds=lease_seconds)})
+            self._put(conn, doc_id, data)
+            return data
+
+    def write_review(self, doc_id, changes, lease_holder=None):
+        with self._transaction() as conn:
+            before = self._get(conn, doc_id)
+            check_lease(doc_id, before, lease_holder)
+            after = {**before, **changes}
+            self._put(conn, doc_id, after, before)
+            self._apply_stats(conn, [(before, after)])
+
+    def write_reviews(self, reviews, lease_holder=None):
+        with self._transaction() as conn:
+            lost = []
+            changed = []
+            for doc_id, changes in reviews:
+                before = self._get(conn, doc_id)
+                try:
+                    check_lease(doc_id, before, lease_holder)
+                except LeaseLostError:
+                    lost.append(doc_id)
+                    continue
+                after = {**before, **changes}
+                self._put(conn, doc_id, after, before)
+                changed.append((before, after))
+            if changed:
+                self._apply_stats(conn, changed)
+            return lost
+
+    def count_reviews(self, username, statuses=None):
+        sql = "SELECT COUNT(*) FROM documents WHERE collection = ? AND reviewer = ?"
+        params = [self.collection, username]
+        if statuses is not None:
+            statuses = list(statuses)
+            sql += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params += statuses
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def review_history(self, username, limit, start_after=None, fields=None):
+        data_sql, params = self._data_sql(fields)
+        sql = (f"SELECT id, timestamp, {data_sql} FROM documents "
+               "WHERE collection = ? AND reviewer = ? AND pulled = 0 AND timestamp IS NOT NULL")
+        params += [self.collection, username]
+        if start_after is not None:
+            sql += " AND (timestamp, id) < (?, ?)"
+            params += list(start_after)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        history = [(doc_id, self._project(data, fields)) for doc_id, _, data in rows]
+        return history, ((rows[-1][1], rows[-1][0]) if rows else None)
+
+    def load_stats(self):
+        with self._lock:
+            counts = Counter(dict(self._conn.execute(
+                "SELECT key, count FROM stats WHERE collection = ?", (self.collection,))))
+            row = self._conn.execute(
+                "SELECT generation FROM stats_generation WHERE collection = ?", (self.collection,)).fetchone()
+        return counts, (row[0] if row else 0)
+
+    def create_prompts(self, chunk):
+        with self._transaction() as conn:
+            new = [(doc_id, data) for doc_id, data in chunk if self._get(conn, doc_id) is None]
+            for doc_id, data in new:
+                self._put(conn, doc_id, data)
+            self._apply_stats(conn, [(None, data) for _, data in new])
+            return len(chunk) - len(new)
+
+    def get_upload_job(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+        return loads(row[0]) if row else None
+
+    def update_upload_job(self, job_id, fields):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM upload_jobs WHERE id = ?", (job_id,)).fetchone()
+            job = {**(loads(row[0]) if row else {}), **fields}
+            conn.execute("INSERT OR REPLACE INTO upload_jobs (id, data) VALUES (?, ?)", (job_id, dumps(job)))
+
+    def watch_pending(self, callback, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, data FROM documents WHERE collection = ? AND status = 'pending' LIMIT ?",
+                (self.collection, -1 if limit is None else limit)
+            ).fetchall()
+            callback([(doc_id, loads(data)) for doc_id, data in rows])
+            self._watchers.append(callback)
+
+        def stop():
+            with self._lock:
+                self._watchers.remove(callback)
+        return stop
+
+
+def open_store(url=None, collection="stage_four_reviews", stats=True):
+    """
+    Opens the store named by `url`, or by the REVIEW_STORE environment variable.
+
+    Parameters:
+        url (str): "firestore", "sqlite:///<path>" or "memory".
+        collection (str): Collection of review documents.
+        stats (bool): Keep the review counters current on writes.
+
+    Returns:
+        ReviewStore: The store.
+    """
+    url = url or os.environ.get("REVIEW_STORE", DEFAULT_STORE_URL)
+    if url == "firestore":
+        from firebase_setup import get_db
+
+        return FirestoreStore(get_db(), collection, stats)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], collection, stats)
+    if url == "memory":
+        return MemoryStore(stats)
+    raise ValueError(f"Unknown REVIEW_STORE: {url}")
@@ -0,0 +1,125 @@
+"""
+Bulk language tagging of prompt sets.
+
+Streams sentences from a CSV, XLSX or JSONL file, tags them with
+utils.light_tagger in batches spread over a process pool, and writes one JSON
+line per sentence with the `tag()`-format language tags:
+
+    {"row": 0, "text": "...", "language_tags": [{"word": "...", "language": "en"}, ...]}
+
+`row` is the sentence's row in the input file, counted from 0 the way the
+Upload Prompts page counts them: blank rows and lines keep their number but
+produce no output line, and a skipped header is not counted.
+
+Only a bounded number of batches is in flight at any time, so memory stays
+flat however large the input is. Output lines are written in input order.
+
+    python tag_corpus.py prompts.xlsx tagged.jsonl --workers 8
+"""
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from ingest import iter_chunks, iter_prompt_rows
+from langid import get_language_model
+from lexicon import get_english_words
+from utils import light_tag_many, tag
+
+
+def iter_sentences(input_path, column=0, field="text", skip_header=False):
+    """
+    Yields (row number, sentence) for the sentences of a prompt file, one at a time.
+
+    Parameters:
+        input_path (str): .csv, .xlsx or .jsonl file.
+        column (int): Column holding the sentence (CSV/XLSX).
+        field (str): Key holding the sentence (JSONL).
+        skip_header (bool): Skip the first row (CSV/XLSX).
+    """
+    extension = os.path.splitext(input_path)[1].lower()
+    if extension in (".csv", ".xlsx"):
+        with open(input_path, "rb") as f:
+            for row, value in iter_prompt_rows(f, input_path, column, skip_header):
+                if value is not None:
+                    yield row, value
+    elif extension == ".jsonl":
+        with open(input_path, encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                if line.strip():
+                    yield row, json.loads(line)[field]
+    else:
+        raise ValueError(f"Unsupported file type: {input_path}")
+
+
+def init_worker():
+    # Forked workers inherit the parent's model and lexicon; spawned ones load them once here
+    if get_language_model() is None:
+        get_english_words()
+
+
+def tag_batch(batch):
+    return [tag(word_tags) for word_tags in light_tag_many(batch)]
+
+
+def tag_corpus(input_path, output_path, column=0, field="text", skip_header=False, workers=None, batch_size=1000):
+    """
+    Tags every sentence of a prompt file and writes the results as JSON lines.
+
+    Parameters:
+        input_path (str): .csv, .xlsx or .jsonl file.
+        output_path (str): JSONL file to write.
+        column, field, skip_header: See iter_sentences.
+        workers (int): Number of worker processes (default: number of CPUs).
+        batch_size (int): Sentences per task sent to a worker.
+
+    Returns:
+        int: Number of sentences tagged.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Loaded before the pool starts so forked workers share the parent's copy
+    init_worker()
+
+    # Sentences are cleaned the same way as on the Upload Prompts page
+    sentences = ((row, sentence.strip('"')) for row, sentence in iter_sentences(input_path, column, field, skip_header))
+    batches = iter_chunks(sentences, batch_size)
+    in_flight = deque()
+    tagged = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor, \
+            open(output_path, "w", encoding="utf-8") as out:
+
+        def write_oldest():
+            nonlocal tagged
+            batch, future = in_flight.popleft()
+            for (row, sentence), language_tags in zip(batch, future.result()):
+                out.write(json.dumps({"row": row, "text": sentence, "language_tags": language_tags}, ensure_ascii=False) + "\n")
+            tagged += len(batch)
+
+        for batch in batches:
+            # Only the sentences go to the workers; the row numbers stay here
+            in_flight.append((batch, executor.submit(tag_batch, [sentence for _, sentence in batch])))
+            # Two batches per worker keeps every process busy without reading ahead unboundedly
+            if len(in_flight) >= 2 * workers:
+                write_oldest()
+        while in_flight:
+            write_oldest()
+
+    return tagged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_path", help=".csv, .xlsx or .jsonl file of sentences")
+    parser.add_argument("output_path", help="JSONL file to write")
+    parser.add_argument("--column", type=int, default=0, help="sentence column for CSV/XLSX (default: 0)")
+    parser.add_argument("--field", default="text", help="sentence key for JSONL (default: text)")
+    parser.add_argument("--skip-header", action="store_true", help="skip the first CSV/XLSX row")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="sentences per worker task")
+    args = parser.parse_args()
+
+    count = tag_corpus(args.input_path, args.output_path, args.column, args.field,
+                       args.skip_header, args.workers, args.batch_size)
+    print(f"Tagged {count} sentences into {args.output_path}")
@@ -0,0 +1,145 @@
+import random
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from dedup import DedupIndex, DuplicateChecker, band_keys, build_index, lookup, signature
+
+
+def random_prompts(n, seed=0):
+    # Twelve words drawn from a few thousand made-up ones: unrelated prompts, like a real upload
+    rng = random.Random(seed)
+    words = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8))) for _ in range(5000)]
+    return [" ".join(rng.choice(words) for _ in range(12)) for _ in range(n)]
+
+
+def test_check_flags_stored_and_earlier_rows(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    index.add([("stored_1", "Ẹ kú àárọ̀, how was your morning today?")])
+    checker = DuplicateChecker(index)
+
+    first = checker.check([
+        ("new_1", "Ẹ kú àárọ̀ — how was your morning today"),
+        ("new_2", "Something else entirely, about the weather in Ibadan"),
+    ])
+    second = checker.check([
+        ("new_3", "something else entirely about the weather in Ibadan!"),
+        ("new_4", "A third prompt with nothing in common"),
+    ])
+
+    assert first[0][0] == "stored_1" and first[0][1] >= 0.7
+    assert first[1] is None
+    assert second[0][0] == "new_2"
+    assert second[1] is None
+
+
+def test_check_skips_matches_on_the_same_id(tmp_path):
+    index = DedupIndex(str(tmp_path))
+    index.add([("Set_1_0", "the very same prompt uploaded again")])
+    checker = DuplicateChecker(index)
+
+    assert checker.check([("Set_1_0", "the very same prompt uploaded again")]) == [None]
+
+
+def test_check_stays_linear_in_the_upload_size():
+    checker = DuplicateChecker(DedupIndex(directory=None))
+    texts = random_prompts(8000)
+    rows = [(f"row_{i}", text) for i, text in enumerate(texts)]
+
+    matches = []
+    for start in range(0, len(rows), 500):
+        matches.extend(checker.check(rows[start:start + 500]))
+
+    assert matches == [None] * len(rows)
+    assert checker.check([("again", texts[4321])]) == [("row_4321", 1.0)]
+    # Every row is filed once per band, in the sorted tables or the delta
+    assert checker._keys.shape[1] + checker._delta_keys.shape[1] == len(rows) + 1
+    # Unrelated rows rarely share a band, so a lookup compares against a handful of rows
+    candidates = lookup(((checker._keys, checker._rows), (checker._delta_keys, checker._delta_rows)),
+                        band_keys(np.stack([signature(text) for text in texts[:500]])))
+    assert max(len(rows) for rows in candidates) <= 10
+
+
+def test_check_keeps_memory_per_row_bounded():
+    texts = random_prompts(6000, seed=5)
+    rows = [(f"row_{i}", text) for i, text in enumerate(texts)]
+    tracemalloc.start()
+    try:
+        checker = DuplicateChecker(DedupIndex(directory=None))
+        for start in range(0, len(rows), 500):
+            checker.check(rows[start:start + 500])
+        used, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # A signature is 512 bytes and a row's band keys another 384, plus the buffer's spare room;
+    # per-band dicts of Python lists took about 5.8 KB
+    assert used / len(rows) < 1536
+
+
+def crash():
+    raise RuntimeError("crashed before saving meta.json")
+
+
+def test_add_after_a_crashed_add_keeps_rows_and_ids_aligned(tmp_path):
+    directory = str(tmp_path)
+    texts = random_prompts(3, seed=1)
+    DedupIndex.load(directory).add([("saved", texts[0])])
+    # An add that wrote its rows but crashed before saving meta.json
+    crashed = DedupIndex.load(directory)
+    crashed._save_meta = crash
+    with pytest.raises(RuntimeError):
+        crashed.add([("lost_1", random_prompts(1, seed=2)[0]), ("lost_2", texts[2])])
+
+    index = DedupIndex.load(directory)
+    index.add([("next", texts[1])])
+
+    reloaded = DedupIndex.load(directory)
+    assert reloaded.ids == ["saved", "next"]
+    assert reloaded.query(np.stack([signature(text) for text in texts])) == [("saved", 1.0), ("next", 1.0), None]
+
+
+def test_compaction_that_crashed_between_the_tables_keeps_them_matched(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    texts = random_prompts(43, seed=3)
+    index = DedupIndex.load(directory)
+    index.add([(f"doc_{i}", text) for i, text in enumerate(texts[:40])])
+    # Small enough to stay in the delta until the compaction below
+    index.add([(f"doc_{i}", text) for i, text in enumerate(texts[40:], 40)])
+    save = np.save
+
+    def save_keys_then_crash(file, array):
+        # The keys table is written, the rows table never is
+        if "band_rows" in str(file):
+            crash()
+        save(file, array)
+
+    monkeypatch.setattr(np, "save", save_keys_then_crash)
+    with pytest.raises(RuntimeError):
+        DedupIndex.load(directory).compact()
+    monkeypatch.setattr(np, "save", save)
+
+    reloaded = DedupIndex.load(directory)
+    signatures = np.stack([signature(text) for text in texts])
+    assert reloaded.query(signatures) == [(f"doc_{i}", 1.0) for i in range(43)]
+    reloaded.compact()
+    assert DedupIndex.load(directory).query(signatures) == [(f"doc_{i}", 1.0) for i in range(43)]
+
+
+def test_a_loaded_index_picks_up_a_rebuild_by_another_process(tmp_path):
+    directory = str(tmp_path)
+    texts = random_prompts(4, seed=4)
+    # The app's cached copy, loaded before the rebuild
+    cached = DedupIndex.load(directory)
+    cached.add([("old", texts[0])])
+
+    build_index([("built_1", texts[1]), ("built_2", texts[2])], directory)
+    cached.add([("added", texts[3])])
+
+    reloaded = DedupIndex.load(directory)
+    assert reloaded.ids == ["built_1", "built_2", "added"]
+    signatures = np.stack([signature(text) for text in texts])
+    expected = [None, ("built_1", 1.0), ("built_2", 1.0), ("added", 1.0)]
+    assert reloaded.query(signatures) == expected
+    assert cached.query(signatures) == expected
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+import json
+
+import pytest
+
+from export import ShardWriter, export_record, iter_shard_entries, still_exported
+
+REVIEWED_AT = datetime(2024, 6, 1, 12, 30, tzinfo=timezone.utc)
+REVIEW = {"reviewed_text": "mo fẹ́ lọ", "language_tags": [{"word": "mo", "language": "yo"}], "emotions": ["Happy"],
+          "reviewer": "ada", "domain": "General", "Status": "approve", "pulled": False, "Timestamp": REVIEWED_AT}
+
+
+@pytest.mark.parametrize("file_format", ["jsonl", "parquet"])
+def test_shards_keep_the_exported_timestamp(tmp_path, file_format):
+    writer = ShardWriter(str(tmp_path / f"shard.{file_format}"), file_format)
+    writer.write([export_record("doc_1", REVIEW)])
+    writer.commit()
+    entries = list(iter_shard_entries(writer.path, file_format))
+    assert entries == [("doc_1", "2024-06-01T12:30:00.000000+00:00")]
+
+
+def test_only_the_exported_review_is_marked():
+    exported = export_record("doc_1", REVIEW)["Timestamp"]
+    assert still_exported(REVIEW, exported)
+
+    undone = {**REVIEW, "Status": "pending", "Timestamp": REVIEWED_AT + timedelta(minutes=5)}
+    assert not still_exported(undone, exported)
+    reviewed_again = {**REVIEW, "Status": "edit", "Timestamp": REVIEWED_AT + timedelta(minutes=5)}
+    assert not still_exported(reviewed_again, exported)
+    assert not still_exported({**REVIEW, "pulled": True}, exported)
+
+
+@pytest.mark.parametrize("file_format", ["jsonl", "parquet"])
+def test_shards_without_timestamps_are_refused(tmp_path, file_format):
+    path = str(tmp_path / f"shard.{file_format}")
+    if file_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.table({"id": ["doc_1"]}), path)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "doc_1", "Status": "approve"}) + "\n")
+
+    with pytest.raises(ValueError):
+        list(iter_shard_entries(path, file_format))
+
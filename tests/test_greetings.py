@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import greetings
+import utils
+from greetings import AudioCache, request_greeting
+
+
+class StubClient:
+    """
+    Local stand-in for the OpenAI client: counts calls, answers rephrase
+    requests with a fixed text and writes the spoken text as the audio file.
+    """
+
+    def __init__(self, rephrase_error=None, speech_gate=None):
+        self.rephrase_calls = 0
+        self.speech_inputs = []
+        self.rephrase_error = rephrase_error
+        self.speech_gate = speech_gate
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._rephrase))
+        self.audio = SimpleNamespace(speech=SimpleNamespace(create=self._speech))
+
+    def _rephrase(self, model, messages, temperature):
+        self.rephrase_calls += 1
+        if self.rephrase_error is not None:
+            raise self.rephrase_error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=" Hello there! "))])
+
+    def _speech(self, model, voice, input):
+        if self.speech_gate is not None:
+            self.speech_gate.wait(timeout=5)
+        self.speech_inputs.append(input)
+
+        def stream_to_file(path):
+            with open(path, "wb") as f:
+                f.write(input.encode("utf-8"))
+        return SimpleNamespace(stream_to_file=stream_to_file)
+
+
+@pytest.fixture(autouse=True)
+def fresh_rephrase_cache(monkeypatch):
+    monkeypatch.setattr(utils, "rephrase_cache", utils.TTLCache(maxsize=16, ttl=60))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AudioCache(str(tmp_path / "greetings"), max_bytes=1024 * 1024)
+
+
+def test_second_request_is_a_cache_hit(cache):
+    client = StubClient()
+    path = request_greeting("ada lovelace", "key", client=client, cache=cache).result(timeout=5)
+    assert open(path, encoding="utf-8").read() == "Hello there!"
+
+    again = request_greeting("ada lovelace", "key", client=client, cache=cache)
+    assert again.done() and again.result() == path
+    assert client.rephrase_calls == 1
+    assert len(client.speech_inputs) == 1
+
+
+def test_evict_removes_least_recently_used_file(tmp_path):
+    cache = AudioCache(str(tmp_path), max_bytes=25)
+    for i, name in enumerate(["old", "used", "new"]):
+        path = cache.path(name)
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        os.utime(path, (1000 + i, 1000 + i))
+    # A hit makes "used" the most recent entry, so "old" and then "new" are older
+    os.utime(cache.path("used"), (2000, 2000))
+
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ["new.mp3", "used.mp3"]
+
+
+def test_concurrent_requests_share_one_production(cache):
+    gate = threading.Event()
+    client = StubClient(speech_gate=gate)
+    first = request_greeting("grace hopper", "key", client=client, cache=cache)
+    second = request_greeting("grace hopper", "key", client=client, cache=cache)
+    assert first is second
+
+    gate.set()
+    assert first.result(timeout=5) == second.result(timeout=5)
+    assert client.rephrase_calls == 1
+    assert len(client.speech_inputs) == 1
+
+
+def test_plain_text_is_spoken_when_rephrase_fails(cache, caplog):
+    client = StubClient(rephrase_error=RuntimeError("rate limited"))
+    with caplog.at_level(logging.WARNING, logger="greetings"):
+        request_greeting("alan turing", "key", client=client, cache=cache).result(timeout=5)
+
+    assert client.speech_inputs == [greetings.greeting_text("alan turing")]
+    assert any(record.exc_info for record in caplog.records)
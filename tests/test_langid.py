@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+import langid
+import utils
+from langid import NGRAM_SIZES, LanguageModel, featurize, get_language_model
+
+BITS = 10
+SENTENCES = [
+    "Ẹ kú àárọ̀ my friend, how was the night?",
+    "!!! ... ???",
+    "Mo fẹ́ lọ 😀 to the market 𝐧𝐨𝐰",
+    "",
+    "   ",
+    "ok ok ok ok ok ok ok ok",
+]
+
+
+@pytest.fixture
+def model():
+    # Fixed synthetic weights: the tests check the plumbing, not the quality of a trained model
+    weights = np.random.default_rng(0).normal(size=2 ** BITS + 1).astype(np.float32)
+    return LanguageModel(weights)
+
+
+@pytest.fixture
+def with_model(model, monkeypatch):
+    monkeypatch.setattr(utils, "get_language_model", lambda: model)
+    return model
+
+
+def one_by_one(model, words):
+    return np.array([model.scores([word])[0] for word in words])
+
+
+def test_featurize_empty_batch():
+    word_of, buckets, masks = featurize([], BITS)
+
+    assert word_of.shape == (0,)
+    assert buckets.shape == masks.shape == (len(NGRAM_SIZES), 0)
+
+
+def test_all_punctuation_word_keeps_its_place(model):
+    words = ["hello", "!!!", "…", "world"]
+
+    word_of, _, _ = featurize(words, BITS)
+    scores = model.scores(words)
+
+    assert set(word_of.tolist()) == {0, 1, 2, 3}
+    np.testing.assert_allclose(scores, one_by_one(model, words), rtol=1e-5)
+    # Nothing is left of a word made of punctuation, so it scores like an empty word
+    assert scores[1] == pytest.approx(model.scores([""])[0])
+    assert scores[2] == pytest.approx(scores[1])
+
+
+def test_characters_outside_the_bmp_are_dropped(model):
+    scores = model.scores(["a😀b", "ab", "𝐧𝐨𝐰", "", "ọ̀mọ🙂"])
+
+    assert scores[0] == pytest.approx(scores[1])
+    assert scores[2] == pytest.approx(scores[3])
+    assert scores[4] == pytest.approx(model.scores(["ọ̀mọ"])[0])
+
+
+def test_batch_scores_match_word_by_word(model):
+    words = " ".join(SENTENCES).split()
+    # Repetitive enough that the batch is scored per distinct word
+    repeated = words * 20
+
+    np.testing.assert_allclose(model.scores(words), one_by_one(model, words), rtol=1e-5)
+    np.testing.assert_allclose(model.scores(repeated), np.tile(model.scores(words), 20), rtol=1e-5)
+    assert model.predict([]) == []
+
+
+def test_predict_keeps_the_word_count_of_every_sentence(with_model):
+    tagged = utils.light_tag_many(SENTENCES)
+
+    assert [[word for word, _ in tags] for tags in tagged] == [text.split() for text in SENTENCES]
+    assert all(language in ("en", "yo") for tags in tagged for _, language in tags)
+    assert utils.light_tag_many([]) == []
+
+
+def test_light_tagger_and_light_tag_many_agree(with_model):
+    assert utils.light_tag_many(SENTENCES) == [utils.light_tagger(text) for text in SENTENCES]
+
+
+def test_light_tagger_and_light_tag_many_agree_without_a_model(monkeypatch):
+    monkeypatch.setattr(utils, "get_language_model", lambda: None)
+    monkeypatch.setattr(utils, "get_english_words", lambda: {"my", "friend", "how", "was", "the", "to", "market", "ok"})
+
+    tagged = utils.light_tag_many(SENTENCES)
+
+    assert tagged == [utils.light_tagger(text) for text in SENTENCES]
+    assert ("friend,", "en") in tagged[0] and ("Mo", "yo") in tagged[2]
+
+
+def test_missing_model_is_looked_for_again(model, tmp_path, monkeypatch):
+    monkeypatch.setattr(langid, "_models", {})
+    path = str(tmp_path / "langid_model.npy")
+
+    assert get_language_model(path) is None
+    model.save(path)
+    loaded = get_language_model(path)
+
+    assert loaded is not None and get_language_model(path) is loaded
+    np.testing.assert_array_equal(loaded.weights, model.weights)
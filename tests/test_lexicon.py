@@ -0,0 +1,26 @@
+import pickle
+
+import nltk
+import pytest
+
+from lexicon import get_english_words
+
+
+def test_the_precompiled_lexicon_is_loaded(tmp_path):
+    path = str(tmp_path / "english_words.pkl")
+    with open(path, "wb") as f:
+        pickle.dump(frozenset({"hello", "world"}), f)
+
+    assert get_english_words(path) == frozenset({"hello", "world"})
+
+
+def test_a_missing_lexicon_is_never_downloaded_while_serving(tmp_path, monkeypatch):
+    def download(*args, **kwargs):
+        raise AssertionError("downloaded the corpus")
+
+    monkeypatch.setattr(nltk, "download", download)
+    # No NLTK corpus installed either
+    monkeypatch.setattr(nltk.data, "path", [str(tmp_path / "nltk_data")])
+
+    with pytest.raises(FileNotFoundError, match="python lexicon.py"):
+        get_english_words(str(tmp_path / "english_words.pkl"))
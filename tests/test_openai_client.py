@@ -0,0 +1,127 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import openai
+import pytest
+
+import utils
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    """
+    Local HTTP server answering /chat/completions like the OpenAI API:
+    the reply is "rephrased: <text>". It can fail the first requests with a
+    500, reject texts containing "bad" with a 400, and records how many
+    requests were in flight at once.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.requests = 0
+        self.fail_first = 0
+        self.delay = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = body["messages"][-1]["content"].split("\n", 1)[1]
+        with server.lock:
+            server.requests += 1
+            attempt = server.requests
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            if attempt <= server.fail_first:
+                self.reply(500, {"error": {"message": "try again", "type": "server_error"}})
+            elif "bad" in text:
+                self.reply(400, {"error": {"message": "rejected", "type": "invalid_request_error"}})
+            else:
+                self.reply(200, {
+                    "id": f"chatcmpl-{attempt}", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": f"rephrased: {text}"}}],
+                })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeOpenAI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(utils, "OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setattr(utils, "rephrase_cache", utils.TTLCache(maxsize=16, ttl=60))
+    utils.get_openai_client.cache_clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+    utils.get_openai_client.cache_clear()
+
+
+def test_repeated_rephrase_is_served_from_memory(server):
+    assert utils.rephrase_text("key", "hello") == "rephrased: hello"
+    assert utils.rephrase_text("key", "hello") == "rephrased: hello"
+    assert server.requests == 1
+
+
+def test_memo_is_not_shared_between_api_keys(server):
+    utils.rephrase_text("key-a", "hello")
+    utils.rephrase_text("key-b", "hello")
+    assert server.requests == 2
+
+
+def test_memo_entries_expire(server, monkeypatch):
+    monkeypatch.setattr(utils, "rephrase_cache", utils.TTLCache(maxsize=16, ttl=0.05))
+    utils.rephrase_text("key", "hello")
+    time.sleep(0.1)
+    utils.rephrase_text("key", "hello")
+    assert server.requests == 2
+
+
+def test_server_errors_are_retried(server):
+    server.fail_first = 2
+    assert utils.rephrase_text("key", "hello") == "rephrased: hello"
+    assert server.requests == 3
+
+
+def test_rephrase_many_respects_concurrency(server):
+    server.delay = 0.05
+    texts = [f"text {i}" for i in range(12)]
+    assert utils.rephrase_many("key", texts, concurrency=3) == [f"rephrased: {text}" for text in texts]
+    assert server.max_in_flight == 3
+
+
+def test_rephrase_many_returns_exceptions_in_place(server):
+    results = utils.rephrase_many("key", ["good", "bad", "fine"], return_exceptions=True)
+    assert results[0] == "rephrased: good" and results[2] == "rephrased: fine"
+    assert isinstance(results[1], openai.BadRequestError)
+
+    with pytest.raises(openai.BadRequestError):
+        utils.rephrase_many("key", ["bad again"])
@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+
+from review_queue import PrefetchQueue
+from storage import MemoryStore, lease_is_free
+
+
+def own_leases_first(store, username, limit):
+    # Like the app's fetch_claim_candidates: a small window, the reviewer's own leases first
+    def fetch():
+        now = datetime.now(timezone.utc)
+        candidates = [(doc_id, data) for doc_id, data in store.pending_candidates(limit, username=username)
+                      if lease_is_free(data, username, now)]
+        candidates.sort(key=lambda candidate: candidate[1].get("claimed_by") != username)
+        return candidates
+    return fetch
+
+
+def test_a_page_refilled_midway_has_no_repeated_ids():
+    store = MemoryStore()
+    store.create_prompts([(f"doc_{i:03d}", {"Status": "pending"}) for i in range(12)])
+    # Every fetch sees the whole pending set, so it includes the leases taken for this page
+    queue = PrefetchQueue(fetch=own_leases_first(store, "alice", 50),
+                          claim=lambda doc_id: store.claim(doc_id, "alice", 900), low_water=5)
+
+    page = []
+    while len(page) < 20:
+        doc_id, data = queue.next_item()
+        if doc_id is None:
+            break
+        page.append(doc_id)
+        # The background refill lands while the page is still being filled
+        if queue._refill_thread is not None:
+            queue._refill_thread.join()
+
+    assert sorted(page) == [f"doc_{i:03d}" for i in range(12)]
+
+
+def test_an_undone_item_can_be_served_again():
+    store = MemoryStore()
+    store.create_prompts([("doc_000", {"Status": "pending"})])
+    queue = PrefetchQueue(fetch=own_leases_first(store, "alice", 8),
+                          claim=lambda doc_id: store.claim(doc_id, "alice", 900))
+
+    assert queue.next_item()[0] == "doc_000"
+    store.write_review("doc_000", {"Status": "approve", "reviewer": "alice", "claimed_by": None})
+    assert queue.next_item() == (None, None)
+    store.write_review("doc_000", {"Status": "pending", "reviewer": None})
+    assert queue.next_item()[0] == "doc_000"
@@ -0,0 +1,207 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import LeaseLostError, MemoryStore, SQLiteStore, check_lease
+
+CANDIDATE_FIELDS = ["Status", "claimed_by", "lease_expires"]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    store = MemoryStore() if request.param == "memory" else SQLiteStore(":memory:")
+    store.create_prompts([
+        (f"doc_{i:03d}", {"CodeSwitchedText": f"text {i}", "Status": "pending", "domain": "General", "pulled": False})
+        for i in range(120)
+    ])
+    return store
+
+
+def test_pending_candidates_page_past_items_leased_to_others(store):
+    # A bulk page elsewhere holds more leases than one window of candidates
+    for i in range(60):
+        assert store.claim(f"doc_{i:03d}", "bulk", 900) is not None
+
+    candidates = store.pending_candidates(50, fields=CANDIDATE_FIELDS, domain="General", username="alice")
+
+    assert len(candidates) == 50
+    assert all(data.get("claimed_by") is None for _, data in candidates)
+
+
+def test_pending_candidates_keep_the_reviewers_own_leases(store):
+    store.claim("doc_005", "alice", 900)
+    store.claim("doc_006", "bob", 900)
+
+    candidates = dict(store.pending_candidates(200, fields=["Status"], username="alice"))
+
+    assert "doc_005" in candidates and "doc_006" not in candidates
+    assert len(candidates) == 119
+    # Only the requested fields come back, even though the leases were read to filter
+    assert candidates["doc_005"] == {"Status": "pending"}
+
+
+def review(reviewer, status="approved", timestamp=None):
+    return {"Status": status, "reviewer": reviewer, "Timestamp": timestamp or datetime(2026, 1, 1),
+            "claimed_by": None, "lease_expires": None}
+
+
+def test_write_review_without_lease_holder_applies_the_changes(store):
+    store.write_review("doc_001", review("alice"))
+
+    assert store.count_reviews("alice") == 1
+
+
+def test_write_review_with_the_lease_holder(store):
+    store.claim("doc_001", "alice", 900)
+
+    store.write_review("doc_001", review("alice"), lease_holder="alice")
+
+    assert store.count_reviews("alice") == 1
+
+
+def test_write_review_raises_when_the_lease_was_taken(store):
+    store.claim("doc_001", "bob", 900)
+
+    with pytest.raises(LeaseLostError):
+        store.write_review("doc_001", review("alice"), lease_holder="alice")
+    assert store.count_reviews("alice") == 0
+
+
+def test_write_review_raises_when_the_item_is_no_longer_pending(store):
+    store.claim("doc_001", "alice", 900)
+    store.write_review("doc_001", {**review("bob"), "claimed_by": "alice"})
+
+    with pytest.raises(LeaseLostError):
+        store.write_review("doc_001", review("alice"), lease_holder="alice")
+    assert store.count_reviews("alice") == 0
+
+
+def test_create_prompts_skips_existing_ids(store):
+    store.write_review("doc_001", review("alice"))
+
+    skipped = store.create_prompts([
+        ("doc_001", {"CodeSwitchedText": "new text", "Status": "pending"}),
+        ("doc_500", {"CodeSwitchedText": "text 500", "Status": "pending"}),
+    ])
+
+    assert skipped == 1
+    # The existing document is left as it was
+    assert store.count_reviews("alice") == 1
+    assert "doc_500" in dict(store.pending_candidates(200))
+
+
+def test_count_reviews_with_and_without_statuses(store):
+    store.write_review("doc_001", review("alice", "approved"))
+    store.write_review("doc_002", review("alice", "rejected"))
+    store.write_review("doc_003", review("alice", "edit"))
+    store.write_review("doc_004", review("bob", "approved"))
+
+    assert store.count_reviews("alice") == 3
+    assert store.count_reviews("alice", statuses=["approved", "rejected"]) == 2
+    assert store.count_reviews("alice", statuses=["approved"]) == 1
+    assert store.count_reviews("carol") == 0
+
+
+def test_review_history_pages_newest_first_through_ties(store):
+    base = datetime(2026, 1, 1)
+    for i in range(6):
+        # Pairs of reviews share a Timestamp
+        store.write_review(f"doc_{i:03d}", review("alice", timestamp=base + timedelta(seconds=i // 2)))
+    # No Timestamp: left out of the history
+    store.write_review("doc_050", {"Status": "approved", "reviewer": "alice"})
+    store.write_review("doc_051", review("bob"))
+
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = store.review_history("alice", 4, cursor, fields=["Status"])
+        if not page:
+            break
+        pages.append([doc_id for doc_id, _ in page])
+
+    assert pages == [["doc_005", "doc_004", "doc_003", "doc_002"], ["doc_001", "doc_000"]]
+
+
+def test_review_history_returns_only_the_requested_fields(store):
+    store.write_review("doc_001", review("alice"))
+
+    page, _ = store.review_history("alice", 10, fields=["Status", "CodeSwitchedText"])
+
+    assert page == [("doc_001", {"Status": "approved", "CodeSwitchedText": "text 1"})]
+
+
+def test_load_stats_follows_writes_and_undo(store):
+    counts, generation = store.load_stats()
+    assert +counts == Counter({"unreviewed|pending|False": 120})
+
+    store.write_review("doc_001", review("alice"))
+    store.write_review("doc_002", review("alice", "rejected"))
+    counts, after_reviews = store.load_stats()
+    assert +counts == Counter({"unreviewed|pending|False": 118, "alice|approved|False": 1, "alice|rejected|False": 1})
+    assert after_reviews > generation
+
+    # Undo, as the History page does it
+    store.write_review("doc_001", {"Status": "pending", "reviewer": None, "Timestamp": datetime(2026, 1, 2)})
+    counts, after_undo = store.load_stats()
+    assert +counts == Counter({"unreviewed|pending|False": 119, "alice|rejected|False": 1})
+    assert after_undo > after_reviews
+
+
+def test_write_reviews_leaves_out_only_the_rows_whose_lease_was_taken(store):
+    for doc_id in ["doc_001", "doc_002", "doc_003"]:
+        store.claim(doc_id, "alice", 900)
+    # Alice's lease on doc_002 ran out and Bob picked it up
+    store.write_review("doc_002", {"claimed_by": "bob"})
+    counts_before, _ = store.load_stats()
+
+    lost = store.write_reviews([(doc_id, review("alice")) for doc_id in ["doc_001", "doc_002", "doc_003"]],
+                               lease_holder="alice")
+
+    assert lost == ["doc_002"]
+    assert store.count_reviews("alice") == 2
+    counts, _ = store.load_stats()
+    assert +(counts - counts_before) == Counter({"alice|approved|False": 2})
+    assert counts_before["unreviewed|pending|False"] - counts["unreviewed|pending|False"] == 2
+
+
+def test_write_reviews_of_a_missing_document_write_nothing(store):
+    counts_before, generation_before = store.load_stats()
+
+    with pytest.raises(KeyError):
+        store.write_reviews([("doc_001", review("alice")), ("doc_999", review("alice")), ("doc_002", review("alice"))])
+
+    assert store.count_reviews("alice") == 0
+    assert store.review_history("alice", 10) == ([], None)
+    assert store.load_stats() == (counts_before, generation_before)
+
+
+def test_write_reviews_keep_one_history_entry_per_row(store):
+    base = datetime(2026, 1, 1)
+    # Timestamps a microsecond apart in page order, as save_reviews gives them
+    store.write_reviews([(f"doc_{i:03d}", review("alice", timestamp=base + timedelta(microseconds=i))) for i in range(3)])
+
+    page, _ = store.review_history("alice", 10, fields=["Timestamp"])
+    assert [doc_id for doc_id, _ in page] == ["doc_002", "doc_001", "doc_000"]
+    assert [data["Timestamp"] for _, data in page] == [base + timedelta(microseconds=i) for i in (2, 1, 0)]
+
+    # Undoing one row leaves the others in the history
+    store.write_review("doc_001", {"Status": "pending", "reviewer": None, "Timestamp": base + timedelta(seconds=1)})
+    page, _ = store.review_history("alice", 10)
+    assert [doc_id for doc_id, _ in page] == ["doc_002", "doc_000"]
+    assert store.count_reviews("alice") == 2
+
+
+def test_write_review_of_a_missing_document(store):
+    with pytest.raises(KeyError):
+        store.write_review("doc_999", review("alice"))
+    with pytest.raises(LeaseLostError):
+        store.write_review("doc_999", review("alice"), lease_holder="alice")
+
+
+def test_check_lease_on_a_missing_snapshot():
+    # What FirestoreStore gets for a document that doesn't exist
+    with pytest.raises(KeyError):
+        check_lease("doc_999", None, None)
+    with pytest.raises(LeaseLostError):
+        check_lease("doc_999", None, "alice")
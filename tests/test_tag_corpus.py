@@ -0,0 +1,17 @@
+import json
+
+from tag_corpus import iter_sentences
+
+
+def test_sentences_keep_their_input_row(tmp_path):
+    path = tmp_path / "prompts.csv"
+    path.write_text("Prompt\nfirst one\n\nthird one\n", encoding="utf-8")
+
+    assert list(iter_sentences(str(path), skip_header=True)) == [(0, "first one"), (2, "third one")]
+
+
+def test_jsonl_sentences_keep_their_line(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text("\n".join([json.dumps({"text": "a"}), "", json.dumps({"text": "b"})]) + "\n", encoding="utf-8")
+
+    assert list(iter_sentences(str(path))) == [(0, "a"), (2, "b")]
@@ -1,18 +1,92 @@
-import librosa
-from openai import OpenAI
-import sounddevice as sd
-import nltk
-from nltk.corpus import words
+from collections import OrderedDict
+from functools import lru_cache
+import asyncio
+import os
+import threading
+import time
 
-# Ensure that the NLTK word list is downloaded
-nltk.download('words')
+from langid import get_language_model
+from lexicon import get_english_words
+from metrics import track
 
-# Get the list of English words (using NLTK's word corpus)
-english_words = set(words.words())
+# The audio and OpenAI libraries are imported inside the functions that use them,
+# so the tagging helpers can be imported cheaply (e.g. by tag_corpus worker processes)
 
+# Point this at a local fake server to run without the real API
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL")
+# The SDK retries connection errors, 429s and 5xx responses with exponential backoff
+OPENAI_MAX_RETRIES = 3
+OPENAI_TIMEOUT = 30  # seconds
+OPENAI_MAX_CONNECTIONS = 20
 
+REPHRASE_MODEL = "gpt-4o-mini"
+REPHRASE_SYSTEM_PROMPT = "You are an assistant that specializes in rephrasing text in a playful and friendly way, while retaining its original meaning."
 
-def generate_speech(text, openai_api_key, output_file="output_speech.mp3", model="tts-1", voice="alloy"):
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Parameters:
+        maxsize (int): Number of entries kept.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+# Identical rephrase requests within an hour are answered from memory
+rephrase_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(api_key):
+    """
+    Returns the process-wide OpenAI client for an API key. The client keeps
+    HTTP connections alive between calls and retries transient failures.
+
+    Parameters:
+        api_key (str): Your OpenAI API key.
+    """
+    import httpx
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        max_retries=OPENAI_MAX_RETRIES,
+        timeout=OPENAI_TIMEOUT,
+        http_client=httpx.Client(limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        )),
+    )
+
+
+def generate_speech(text, openai_api_key, output_file="output_speech.mp3", model="tts-1", voice="alloy", client=None):
     """
     Converts text to speech using OpenAI's TTS API and saves it to a file.
 
@@ -21,11 +95,14 @@ def generate_speech(text, openai_api_key, output_file="output_speech.mp3", model
         output_file (str): Path to save the output audio file.
         model (str): The TTS model to use (default: "tts-1").
         voice (str): The voice to use for speech synthesis (default: "alloy").
+        client: OpenAI client to use instead of the shared one (e.g. a local stub).
+
+    Raises:
+        openai.OpenAIError: If the request still fails after retries.
     """
-    try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=openai_api_key)
+    client = client or get_openai_client(openai_api_key)
 
+    with track("openai", "speech") as op:
         # Create speech from text
         response = client.audio.speech.create(
             model=model,
@@ -35,9 +112,7 @@ def generate_speech(text, openai_api_key, output_file="output_speech.mp3", model
 
         # Stream the response to the specified output file
         response.stream_to_file(output_file)
-        print(f"Speech successfully saved to {output_file}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        op.bytes = os.path.getsize(output_file)
 
 
 def play_audio(file_path):
@@ -47,6 +122,9 @@ def play_audio(file_path):
     Parameters:
         file_path (str): The path to the audio file to be played.
     """
+    import librosa
+    import sounddevice as sd
+
     try:
         # Load the audio file
         audio_data, sample_rate = librosa.load(file_path, sr=None)  # sr=None preserves original sample rate
@@ -59,48 +137,126 @@ def play_audio(file_path):
     except Exception as e:
         print(f"An error occurred during playback: {e}")
 
-def rephrase_text(api_key, text_to_rephrase):
+
+def rephrase_messages(text_to_rephrase):
+    return [
+        {"role": "system", "content": REPHRASE_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Please rephrase the following text:\n{text_to_rephrase}"},
+    ]
+
+
+def rephrase_cache_key(client, text_to_rephrase):
+    # Answers are only shared between requests to the same endpoint and account with the same model and prompt
+    return (str(getattr(client, "base_url", None)), getattr(client, "api_key", None),
+            REPHRASE_MODEL, REPHRASE_SYSTEM_PROMPT, text_to_rephrase)
+
+
+def rephrase_text(api_key, text_to_rephrase, client=None):
     """
-    Rephrases the input text using OpenAI's GPT-4 model.
+    Rephrases the input text using OpenAI's GPT-4 model. Repeated requests for
+    the same text to the same endpoint are served from `rephrase_cache`.
 
     Parameters:
         api_key (str): Your OpenAI API key.
         text_to_rephrase (str): The text to be rephrased.
+        client: OpenAI client to use instead of the shared one (e.g. a local stub).
 
     Returns:
         str: The rephrased text.
+
+    Raises:
+        openai.OpenAIError: If the request still fails after retries.
     """
-    client = OpenAI(api_key=api_key)
+    client = client or get_openai_client(api_key)
+    cache_key = rephrase_cache_key(client, text_to_rephrase)
+    cached = rephrase_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    try:
+    with track("openai", "rephrase") as op:
         response = client.chat.completions.create(
-            model= "gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an assistant that specializes in rephrasing text in a playful and friendly way, while retaining its original meaning."},
-                {"role": "user", "content": f"Please rephrase the following text:\n{text_to_rephrase}"},
-                # {"role": "assistant", "content": f"the rephrased text is: "}
-            ],
+            model=REPHRASE_MODEL,
+            messages=rephrase_messages(text_to_rephrase),
             temperature=1
         )
 
         # Extract the rephrased text from the response
         rephrased_text = response.choices[0].message.content.strip()
-        # print(rephrased_text)
+        op.bytes = len(rephrased_text.encode("utf-8"))
+    rephrase_cache.put(cache_key, rephrased_text)
+    return rephrased_text
+
+
+async def _rephrase_many(api_key, texts, concurrency, return_exceptions):
+    import httpx
+    from openai import AsyncOpenAI
+
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncOpenAI(
+        api_key=api_key,
+        base_url=OPENAI_BASE_URL,
+        max_retries=OPENAI_MAX_RETRIES,
+        timeout=OPENAI_TIMEOUT,
+        http_client=httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=concurrency,
+            max_keepalive_connections=concurrency,
+        )),
+    )
+
+    async def rephrase_one(text):
+        cache_key = rephrase_cache_key(client, text)
+        cached = rephrase_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            with track("openai", "rephrase") as op:
+                response = await client.chat.completions.create(
+                    model=REPHRASE_MODEL,
+                    messages=rephrase_messages(text),
+                    temperature=1
+                )
+                rephrased_text = response.choices[0].message.content.strip()
+                op.bytes = len(rephrased_text.encode("utf-8"))
+        rephrase_cache.put(cache_key, rephrased_text)
         return rephrased_text
 
-    except Exception as e:
-        print(f"An error occurred {e}")
+    async with client:
+        return await asyncio.gather(*(rephrase_one(text) for text in texts), return_exceptions=return_exceptions)
 
 
+def rephrase_many(api_key, texts, concurrency=8, return_exceptions=False):
+    """
+    Rephrases many texts concurrently over one pooled async client, for
+    offline jobs. Must not be called from a running event loop.
+
+    Parameters:
+        api_key (str): Your OpenAI API key.
+        texts (list): The texts to be rephrased.
+        concurrency (int): Maximum number of requests in flight.
+        return_exceptions (bool): Put the exception in place of a failed
+            text's result instead of raising the first one.
+
+    Returns:
+        list: The rephrased texts, in input order.
+    """
+    return asyncio.run(_rephrase_many(api_key, list(texts), concurrency, return_exceptions))
 
 
 def light_tagger(text):
     # Split the sentence into words
     words_in_sentence = text.split()
-    
+
+    # The trained character n-gram model (`python langid.py train`) when there is one
+    model = get_language_model()
+    if model is not None:
+        return list(zip(words_in_sentence, model.predict(words_in_sentence)))
+
     # List to hold the word and language pairs
     word_language_tags = []
 
+    # English word list, loaded from the precompiled lexicon on first use
+    english_words = get_english_words()
+
     # Process each word in the sentence
     for word in words_in_sentence:
         # Clean the word: remove punctuation and convert to lowercase
@@ -114,10 +270,27 @@ def light_tagger(text):
 
     return word_language_tags
 
+# Function to tag many sentences at once; the model scores all their words in one batch
+def light_tag_many(texts):
+    model = get_language_model()
+    if model is None:
+        return [light_tagger(text) for text in texts]
+    sentences = [text.split() for text in texts]
+    languages = iter(model.predict([word for words in sentences for word in words]))
+    return [[(word, next(languages)) for word in words] for words in sentences]
+
 # Function to convert a list of tuples into a list of dictionaries
 def tag(data):
     return [{"word": word, "language": language} for word, language in data]
 
 # Function to convert a list of dictionaries back into a list of tuples
 def reverse_tag(data):
-    return [(entry["word"], entry["language"]) for entry in data]
\ No newline at end of file
+    return [(entry["word"], entry["language"]) for entry in data]
+
+# Function to display the sentence with color-coding based on language tag
+def display_colored_sentence(word_tags):
+    # One join instead of repeated += keeps long sentences linear
+    return "".join(
+        f'<span style="color: {"blue" if tag == "en" else "red"};">{word}</span> '
+        for word, tag in word_tags
+    )